@@ -1,36 +1,7 @@
-from dcr_pd_analysis import dcr, plot, stats
+from dcr_pd_analysis import analyses, figures, pipeline
 
 if __name__ == "__main__":
-    alpha_reps = dcr.load_reps(
-        "../../data/tcrseqgroup/translated/", glob="*PKD*alpha*tsv", expected=32
-    )
-    beta_reps = dcr.load_reps(
-        "../../data/tcrseqgroup/translated/", glob="*PKD*beta*tsv", expected=32
-    )
-    N = 8
-    DURA = 1
-    MUSCULARIS = 2
-    alpha_points = []
-    beta_points = []
-    for i in range(1, N + 1):
-        filtered_alphas = dcr.filter_sample_id(alpha_reps, i)
-        filtered_betas = dcr.filter_sample_id(beta_reps, i)
-        alpha_jac_mat = stats.get_jaccard_matrix(filtered_alphas)
-        beta_jac_mat = stats.get_jaccard_matrix(filtered_betas)
-        alpha_points.append(alpha_jac_mat[DURA, MUSCULARIS])
-        beta_points.append(beta_jac_mat[DURA, MUSCULARIS])
-
-    # Corrected and confirmed by Seppe on 13/01/2025
-    C = [4, 5, 6, 7]
-    P = [0, 1, 2, 3]
-    c_alpha = alpha_points[C[0] : C[-1] + 1]
-    c_beta = beta_points[C[0] : C[-1] + 1]
-    p_alpha = alpha_points[P[0] : P[-1] + 1]
-    p_beta = beta_points[P[0] : P[-1] + 1]
-    fig = plot.cond_box(
-        c_alpha + c_beta,
-        p_alpha + p_beta,
-        ["Alpha", "Beta"],
-        ["Control", "Parkinsons"],
-    )
-    fig.write_image(f"../out/box_ind_me_d_overlap.png", scale=5)
+    data_dir = "../../data/tcrseqgroup/translated/"
+    stages = figures.get_stages(data_dir, "../out")
+    stages += analyses.get_stages(data_dir, "../out")
+    print(pipeline.run(stages, targets=analyses.get_targets("me_d_box")))
@@ -1,15 +1,7 @@
-from dcr_pd_analysis import dcr, merge, plot, stats
+from dcr_pd_analysis import analyses, figures, pipeline
 
 if __name__ == "__main__":
-    alpha_reps = dcr.load_reps(
-        "../../data/tcrseqgroup/translated/", glob="*PKD*alpha*tsv", expected=32
-    )
-    beta_reps = dcr.load_reps(
-        "../../data/tcrseqgroup/translated/", glob="*PKD*beta*tsv", expected=32
-    )
-    alpha_jac_mat = stats.get_jaccard_matrix(alpha_reps)
-    beta_jac_mat = stats.get_jaccard_matrix(beta_reps)
-    names = [i[0].split("_")[2] for i in alpha_reps]
-    merge = alpha_jac_mat + beta_jac_mat.T
-    fig = plot.heatmap(merge, names)
-    fig.write_image("../out/overlap.png", scale=5)
+    data_dir = "../../data/tcrseqgroup/translated/"
+    stages = figures.get_stages(data_dir, "../out")
+    stages += analyses.get_stages(data_dir, "../out")
+    print(pipeline.run(stages, targets=analyses.get_targets("overlap")))
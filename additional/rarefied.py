@@ -0,0 +1,7 @@
+from dcr_pd_analysis import analyses, figures, pipeline
+
+if __name__ == "__main__":
+    data_dir = "../../data/tcrseqgroup/translated/"
+    stages = figures.get_stages(data_dir, "../out")
+    stages += analyses.get_stages(data_dir, "../out")
+    print(pipeline.run(stages, targets=analyses.get_targets("rarefied")))
@@ -1,13 +1,7 @@
-import pathlib
-
-import polars as pl
+from dcr_pd_analysis import analyses, figures, pipeline
 
 if __name__ == "__main__":
-    path = pathlib.Path("../out/query/result")
-    files = path.glob("*.csv")
-    data = {
-        file.resolve().__str__().split("/")[-1].split(".")[0]: pl.read_csv(file)
-        for file in files
-    }
-    dropped = {name: df.drop_nulls("valpha.id") for name, df in data.items()}
-    print(dropped)
+    data_dir = "../../data/tcrseqgroup/translated/"
+    stages = figures.get_stages(data_dir, "../out")
+    stages += analyses.get_stages(data_dir, "../out")
+    print(pipeline.run(stages, targets=analyses.get_targets("result")))
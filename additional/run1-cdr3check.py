@@ -1,8 +1,7 @@
-import polars as pl
-
-from dcr_pd_analysis import dcr, merge, mixcr, plot
+from dcr_pd_analysis import analyses, figures, pipeline
 
 if __name__ == "__main__":
-    run1 = mixcr.get_results("../")
-    cdr3_match = run1.filter(pl.col("CDR3") == "CAASANSGTYQRF")
-    print(cdr3_match)
+    data_dir = "../../data/tcrseqgroup/translated/"
+    stages = figures.get_stages(data_dir, "../out")
+    stages += analyses.get_stages(data_dir, "../out")
+    print(pipeline.run(stages, targets=analyses.get_targets("run1_cdr3check")))
@@ -1,10 +1,7 @@
-from dcr_pd_analysis import mixcr, dcr, merge, plot
+from dcr_pd_analysis import analyses, figures, pipeline
 
 if __name__ == "__main__":
-    run1 = mixcr.get_results("../")
-    run2 = dcr.load_summary("../../data/tcrseqgroup/Summary_NS148.csv")
-    merged = merge.frames(run1, run2)
-    for feature in ["total_transcripts", "unique_transcripts"]:
-        fig = plot.scatter(merged, feature)
-        fig.write_image(f"../out/{feature}_scatter.png", scale=5)
-
+    data_dir = "../../data/tcrseqgroup/translated/"
+    stages = figures.get_stages(data_dir, "../out")
+    stages += analyses.get_stages(data_dir, "../out")
+    print(pipeline.run(stages, targets=analyses.get_targets("scatter")))
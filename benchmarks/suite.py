@@ -0,0 +1,262 @@
+"""
+Timings and peak memory of the hot paths on synthetic repertoires, one JSON line
+per case and size, e.g. python suite.py --sizes 1e3 1e5 --output results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+
+from dcr_pd_analysis import dcr, diversity, mixcr, stats, synthetic
+
+TISSUES = ["D", "ME", "HB", "ST"]
+
+
+def get_names(chain="beta") -> list[str]:
+    return [f"dcr_PKD_{tissue}1_1_{chain}" for tissue in TISSUES]
+
+
+def setup_reps(rows: int, tmp: pathlib.Path) -> tuple:
+    return (synthetic.make_reps(get_names(), rows // len(TISSUES), shared=0.2),)
+
+
+def setup_clonotypes(rows: int, tmp: pathlib.Path) -> tuple:
+    (reps,) = setup_reps(rows, tmp)
+    return (list(dcr.get_clonotypes(reps).items()),)
+
+
+def setup_seqs(rows: int, tmp: pathlib.Path) -> tuple:
+    (reps,) = setup_reps(rows, tmp)
+    return (dcr.get_seqs(reps),)
+
+
+def setup_files(rows: int, tmp: pathlib.Path) -> tuple:
+    reps = synthetic.make_cohort(1, rows // len(TISSUES), chains=["beta"])
+    synthetic.write_cohort(tmp / "data", reps)
+    return (str(tmp),)
+
+
+def setup_tag_counts(rows: int, tmp: pathlib.Path) -> tuple:
+    rng = np.random.default_rng(0)
+    tag_counts = synthetic.make_tag_counts(synthetic.get_counts(rows, 1.5, rng), rng)
+    return (tag_counts.to_frame(),)
+
+
+def setup_diversity(rows: int, tmp: pathlib.Path) -> tuple:
+    (reps,) = setup_reps(rows, tmp)
+    return (dcr.get_pc_clonotypes(reps),)
+
+
+def setup_overlap(rows: int, tmp: pathlib.Path) -> tuple:
+    (clonotypes,) = setup_clonotypes(rows, tmp)
+    filtered = dcr.add_freq_col(dict(clonotypes[:2]))
+    seqs = {name: df["clonotype"].to_list() for name, df in filtered.items()}
+    overlap = dcr.filter_seq_select(stats.get_venn2_clones(seqs), filtered)
+    return (next(iter(overlap.values())),)
+
+
+def setup_alluvial(rows: int, tmp: pathlib.Path) -> tuple:
+    (reps,) = setup_reps(rows, tmp)
+    frames = {}
+    for name, df in reps[:2]:
+        df = df.group_by("junction_aa", "v_call", "j_call").agg(
+            pl.col("duplicate_count").sum()
+        )
+        frames[name] = df.with_columns(
+            (pl.col("duplicate_count") / pl.col("duplicate_count").sum()).alias(
+                "frequency"
+            )
+        )
+    return (frames,)
+
+
+def build_stacked_bar(overlap: dict[str, pl.DataFrame]):
+    from dcr_pd_analysis import plot
+
+    return plot.stacked_bar_si(overlap, top=None).to_json()
+
+
+def build_alluvial(frames: dict[str, pl.DataFrame]):
+    from dcr_pd_analysis import plot
+
+    return plot.alluvial(frames, bins=6).to_json()
+
+
+# name: (setup, run, largest number of rows worth timing)
+CASES = {
+    "load.read_rep": (
+        setup_files,
+        lambda tmp: dcr.read_rep(
+            next(pathlib.Path(tmp).glob("data/tcrseqgroup/translated/*.tsv")),
+            dcr.get_airr_columns(),
+        ),
+        10**7,
+    ),
+    "load.load_reps": (
+        setup_files,
+        lambda tmp: dcr.load_reps(
+            f"{tmp}/data/tcrseqgroup/translated",
+            "*PKD*tsv",
+            len(TISSUES),
+            dcr.get_airr_columns(),
+            max_workers=4,
+        ),
+        10**7,
+    ),
+    "load.mixcr_results": (setup_files, mixcr.get_results, 10**7),
+    "mixcr.parse_tag_counts": (
+        setup_tag_counts,
+        lambda df: df.select(mixcr.parse_tag_counts(pl.col("tagCounts"))),
+        10**7,
+    ),
+    "mixcr.split_tag_counts": (
+        setup_tag_counts,
+        lambda df: df.select(mixcr.split_tag_counts(pl.col("tagCounts"))),
+        10**6,
+    ),
+    "dcr.get_clonotypes": (setup_reps, dcr.get_clonotypes, 10**7),
+    "stats.get_jaccard_matrix": (setup_reps, stats.get_jaccard_matrix, 10**7),
+    "stats.get_jaccard_product_matrix": (
+        setup_reps,
+        stats.get_jaccard_product_matrix,
+        10**7,
+    ),
+    "stats.get_dice_sorensen_matrix": (
+        setup_reps,
+        stats.get_dice_sorensen_matrix,
+        10**7,
+    ),
+    "stats.get_overlap_matrices": (
+        setup_clonotypes,
+        lambda reps: stats.get_overlap_matrices(reps, col="clonotype"),
+        10**7,
+    ),
+    "stats.get_weighted_overlap_matrices": (
+        setup_clonotypes,
+        stats.get_weighted_overlap_matrices,
+        10**7,
+    ),
+    "stats.get_fuzzy_overlap_matrices": (
+        setup_reps,
+        stats.get_fuzzy_overlap_matrices,
+        10**6,
+    ),
+    "stats.get_venn_counts": (
+        setup_seqs,
+        lambda seqs: stats.get_venn_counts(dict(list(seqs.items())[:3])),
+        10**7,
+    ),
+    "dcr.course_grain": (
+        setup_seqs,
+        lambda seqs: dcr.course_grain(seqs, ["HB", "ST"], "BR"),
+        10**7,
+    ),
+    "diversity.get_sample_diversity": (
+        setup_diversity,
+        diversity.get_sample_diversity,
+        10**7,
+    ),
+    "plot.stacked_bar_si": (setup_overlap, build_stacked_bar, 10**5),
+    "plot.alluvial": (setup_alluvial, build_alluvial, 10**7),
+}
+
+
+def get_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def measure(case: str, rows: int, repeats: int) -> dict:
+    """
+    Time one case in this (fresh) process, reporting the peak RSS after setup
+    and after the timed runs so the difference is what the case itself used.
+    """
+    setup, run, _ = CASES[case]
+    with tempfile.TemporaryDirectory() as tmp:
+        args = setup(rows, pathlib.Path(tmp))
+        setup_rss = get_rss_mb()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run(*args)
+            times.append(time.perf_counter() - start)
+    return {
+        "case": case,
+        "rows": rows,
+        "status": "ok",
+        "min_seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "setup_rss_mb": setup_rss,
+        "peak_rss_mb": get_rss_mb(),
+    }
+
+
+def get_environment() -> dict:
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": multiprocessing.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="+",
+        default=[1e3, 1e4, 1e5],
+        help="Total rows of synthetic input, e.g. 1e3 1e7",
+    )
+    parser.add_argument(
+        "--cases", nargs="+", default=None, help="Prefixes of the cases to run"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None, help="JSON file of the timings")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    cases = [
+        case
+        for case in CASES
+        if args.cases is None or any(case.startswith(p) for p in args.cases)
+    ]
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for rows in sorted(int(size) for size in args.sizes):
+        for case in cases:
+            if rows > CASES[case][2]:
+                results.append({"case": case, "rows": rows, "status": "skipped"})
+                continue
+            # A new process per case so ru_maxrss starts from scratch
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    result = pool.submit(measure, case, rows, args.repeats).result()
+                except Exception as e:
+                    result = {"case": case, "rows": rows, "status": f"error: {e!r}"}
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    report = {"environment": get_environment(), "results": results}
+    if args.output is not None:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=1))
@@ -0,0 +1,125 @@
+"""Top-N selection, tail collapsing and frequency binning ahead of plotting"""
+
+import numpy as np
+import polars as pl
+
+from dcr_pd_analysis import dcr
+
+Frame = dcr.Frame
+
+
+def get_top_values(df: Frame, col: str, value_cols: list[str], top: int) -> list[str]:
+    """
+    The top values of col ranked by the summed value_cols, ties broken by col.
+    """
+    ranked = df.group_by(col).agg(pl.sum_horizontal(value_cols).sum().alias("_total"))
+    ranked = ranked.sort(["_total", col], descending=[True, False]).head(top)
+    if isinstance(ranked, pl.LazyFrame):
+        ranked = ranked.collect()
+    return ranked.get_column(col).cast(pl.String).to_list()
+
+
+def collapse_tail(
+    df: Frame,
+    col: str,
+    value_cols: list[str],
+    keep: list[str],
+    by: list[str] | None = None,
+    other="other",
+) -> Frame:
+    """
+    Function which merges every row whose col is not in keep into one other row.
+
+    ...
+
+    Parameters
+    ----------
+        df: Table with one row per value of col within each group of by
+        col: Column identifying an element, such as clonotype or v_call
+        value_cols: Columns summed over the collapsed rows
+        keep: Values of col kept as they are
+        by: Columns the collapsing is done within, e.g. the overlap
+        other: Label of the collapsed rows
+
+    Returns
+    -------
+        by, col and value_cols with at most len(keep) + 1 rows per group, the
+        other row last
+    """
+    if by is None:
+        by = []
+    label = (
+        pl.when(pl.col(col).cast(pl.String).is_in(keep))
+        .then(pl.col(col).cast(pl.String))
+        .otherwise(pl.lit(other))
+    )
+    df = df.with_columns(label.alias(col))
+    df = df.group_by(by + [col], maintain_order=True).agg(pl.col(value_cols).sum())
+    return df.sort(by + [pl.col(col) == other], maintain_order=True)
+
+
+def get_bin_labels(edges: np.ndarray) -> list[str]:
+    """
+    Range labels of consecutive edges, with just enough significant digits for
+    every label to be distinct.
+    """
+    for digits in range(2, 17):
+        labels = [
+            f"{lower:.{digits}g}-{upper:.{digits}g}"
+            for lower, upper in zip(edges, edges[1:])
+        ]
+        if len(set(labels)) == len(labels):
+            break
+    return labels
+
+
+def bin_frequency(df: Frame, cols: list[str], bins=6) -> tuple[Frame, list[str]]:
+    """
+    Function which replaces frequencies with the log-spaced bin they fall in.
+
+    All cols share one set of bins spanning their smallest positive and their
+    largest value, so a label means the same range in every column.
+
+    ...
+
+    Parameters
+    ----------
+        df: Table holding frequencies in cols
+        cols: Frequency columns to bin
+        bins: Number of bins, one if every positive frequency is equal
+
+    Returns
+    -------
+        df with cols as string bin labels, "0" for non-positive frequencies, and
+        the labels from lowest to highest
+    """
+    bounds = df.select(
+        pl.min_horizontal(pl.col(c).filter(pl.col(c) > 0).min() for c in cols).alias(
+            "low"
+        ),
+        pl.max_horizontal(pl.col(c).max() for c in cols).alias("high"),
+    )
+    if isinstance(bounds, pl.LazyFrame):
+        bounds = bounds.collect()
+    low, high = bounds.row(0)
+    if low is None:
+        return df.with_columns(pl.lit("0").alias(col) for col in cols), ["0"]
+    # Equal positive frequencies leave a single bin
+    edges = np.unique(np.logspace(np.log10(low), np.log10(high), bins + 1))
+    if len(edges) == 1:
+        edges = np.repeat(edges, 2)
+    labels = get_bin_labels(edges)
+    breaks = list(np.log10(edges[1:-1]))
+    binned = (
+        pl.when(pl.col(col) > 0)
+        .then(
+            pl.col(col)
+            .log10()
+            .cut(breaks, labels=labels, left_closed=True)
+            .cast(pl.String)
+        )
+        .otherwise(pl.lit("0"))
+        .alias(col)
+        for col in cols
+    )
+    return df.with_columns(binned), ["0"] + labels
@@ -0,0 +1,447 @@
+"""Additional analyses declared as pipeline stages next to the manuscript figures"""
+
+import os
+import pathlib
+
+import numpy as np
+import polars as pl
+
+from dcr_pd_analysis import (
+    clonotype,
+    cohort,
+    dcr,
+    diversity,
+    eigen,
+    merge,
+    mixcr,
+    plot,
+    rarefaction,
+    render,
+    stats,
+    tcric,
+    umi,
+)
+from dcr_pd_analysis.figures import get_condition_groups
+from dcr_pd_analysis.pipeline import Stage
+
+ANALYSES = {
+    "overlap": ["overlap_figure"],
+    "eigen_overlap": ["eigen_overlap"],
+    "ind_overlap": ["ind_overlap_figure"],
+    "me_d_box": ["me_d_box_figure"],
+    "pc_scatter": ["pc_scatter_figure"],
+    "query": ["query_export"],
+    "result": ["query_result_export"],
+    "rarefied": ["rarefied_export"],
+    "v_usage": ["v_usage_figure"],
+    "venn3": ["venn3_figure"],
+    "venn3_clonotype": ["venn3_clonotype_figure"],
+    "scatter": ["scatter_figure"],
+    "run1_cdr3check": ["run1_cdr3check_export"],
+}
+
+
+def get_chain_reps(reps: pl.DataFrame, chain: str) -> list[tuple[str, pl.DataFrame]]:
+    return cohort.to_reps(cohort.filter_samples(reps, chain=chain))
+
+
+def get_merged_jaccard(reps: pl.DataFrame) -> tuple[np.ndarray, list[str]]:
+    """
+    Jaccard index on sequence of every pair of samples, alpha above the diagonal
+    and beta below it, with the sample codes of the alpha chain.
+    """
+    alpha_reps = get_chain_reps(reps, "alpha")
+    beta_reps = get_chain_reps(reps, "beta")
+    alpha_jac_mat = stats.get_jaccard_matrix(alpha_reps)
+    beta_jac_mat = stats.get_jaccard_matrix(beta_reps)
+    names = [name.split("_")[2] for name, _ in alpha_reps]
+    return alpha_jac_mat + beta_jac_mat.T, names
+
+
+def draw_overlap(reps: pl.DataFrame, path: str, force=False) -> dict[str, list[str]]:
+    merged, names = get_merged_jaccard(reps)
+    render.render({path: plot.heatmap(merged, names)}, force=force)
+    return {"outputs": [path]}
+
+
+def get_eigen_overlap(reps: pl.DataFrame) -> np.ndarray:
+    merged, _ = get_merged_jaccard(reps)
+    return eigen.get(merged)
+
+
+def draw_ind_overlap(
+    reps: pl.DataFrame, out_dir: str, force=False
+) -> dict[str, list[str]]:
+    figs = {}
+    for (individual,), part in reps.partition_by(
+        "individual", as_dict=True, maintain_order=True
+    ).items():
+        merged, names = get_merged_jaccard(part)
+        figs[f"{out_dir}/ind_{individual}_overlap.png"] = plot.heatmap(merged, names)
+    render.render(figs, force=force)
+    return {"outputs": list(figs)}
+
+
+def draw_me_d_box(reps: pl.DataFrame, path: str, force=False) -> dict[str, list[str]]:
+    """
+    D/ME Jaccard index on sequence of every individual, controls against PD.
+    """
+    reps = cohort.filter_samples(reps, tissue=["D", "ME"])
+    jaccard = {}
+    for (individual, chain), part in reps.partition_by(
+        "individual", "chain", as_dict=True
+    ).items():
+        jac_mat = stats.get_jaccard_matrix(cohort.to_reps(part))
+        jaccard[(individual, chain)] = float(jac_mat[0, 1])
+    groups = get_condition_groups(reps)
+    points = {
+        condition: [jaccard[(i, chain)] for chain in ["alpha", "beta"] for i in indices]
+        for condition, indices in groups.items()
+    }
+    fig = plot.cond_box(
+        points["HC"],
+        points["PD"],
+        ["Alpha", "Beta"],
+        ["Control", "Parkinsons"],
+    )
+    render.render({path: fig}, force=force)
+    return {"outputs": [path]}
+
+
+def draw_pc_scatter(reps: pl.DataFrame, path: str, force=False) -> dict[str, list[str]]:
+    """
+    Simpson's diversity, with its standard deviation, of every D and ME sample.
+    """
+    filtered = cohort.to_reps(cohort.filter_samples(reps, tissue=["D", "ME"]))
+    filtered = dcr.get_pc_clonotypes(filtered)
+    filtered = {" ".join(name.split("_")[2::2]): df for name, df in filtered.items()}
+    div = diversity.get_sample_diversity(filtered)
+    pc = dict(zip(div["sample"], div["pc_labels"]))
+    var_pc = dict(zip(div["sample"], np.sqrt(div["varpc"])))
+    render.render({path: plot.pc_scatter(pc, var_pc)}, force=force)
+    return {"outputs": [path]}
+
+
+def get_shared(reps: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Clonotype IDs shared by every pair of tissues, HB and ST merged into BR, along
+    with the coarse grained clonotype IDs.
+    """
+    col = "clonotype_id"
+    clonotypes = cohort.get_clonotypes(reps, col=col)
+    cg_clonotypes = cohort.course_grain(clonotypes, {"HB": "BR", "ST": "BR"}, col=col)
+    return cohort.get_shared(cg_clonotypes, col=col), cg_clonotypes
+
+
+def write_query(reps: pl.DataFrame, out_dir: str) -> dict[str, list[str]]:
+    """
+    One TCRIC query CSV of the shared clonotypes of every pair of tissues.
+    """
+    shared, cg_clonotypes = get_shared(reps)
+    dictionary = clonotype.get_dictionary(reps)
+    overlaps = shared.partition_by(["overlap", "chain"], as_dict=True)
+    pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
+    # Pairs with nothing in common still get a (header only) file
+    pairs = cohort.get_pairs(cg_clonotypes).select("overlap", "chain")
+    paths = []
+    for name, chain in pairs.iter_rows():
+        df = overlaps.get((name, chain), shared.clear())
+        paths += tcric.make_csv(
+            {name: df["clonotype_id"]}, chain, dictionary, out_dir=out_dir
+        )
+    return {"outputs": paths}
+
+
+def write_query_result(files: list[str], path: str) -> dict[str, list[str]]:
+    """
+    TCRIC results of the query CSVs, keeping the hits with an alpha CDR3. Without
+    any results, only the overlap header is written.
+    """
+    if not files:
+        pl.DataFrame(schema={"overlap": pl.String}).write_csv(path)
+        return {"outputs": [path]}
+    dropped = [
+        pl.read_csv(file)
+        .drop_nulls("valpha.id")
+        .select(pl.lit(pathlib.Path(file).stem).alias("overlap"), pl.all())
+        for file in files
+    ]
+    pl.concat(dropped, how="diagonal_relaxed").write_csv(path)
+    return {"outputs": [path]}
+
+
+def write_rarefied(
+    reps: pl.DataFrame, jaccard_path: str, diversity_path: str
+) -> dict[str, list[str]]:
+    """
+    D/ME Jaccard index and diversity of each chain rarefied to its own shallowest
+    D or ME sample.
+    """
+    reps = cohort.filter_samples(reps, tissue=["D", "ME"])
+    overlap = []
+    div = []
+    for chain in ["alpha", "beta"]:
+        clonotypes = clonotype.get_clonotype_ids(get_chain_reps(reps, chain))
+        rarefied = rarefaction.rarefy(
+            list(clonotypes.items()), replicates=100, col="clonotype_id", max_workers=8
+        )
+        names = rarefied.schema["sample"].categories.to_list()
+        meta = cohort.get_metadata(names, cohort.get_conditions(reps))
+
+        overlap_matrices = rarefaction.get_overlap(
+            rarefied, col="clonotype_id", max_workers=8
+        )
+        jaccard = overlap_matrices["jaccard"]
+        meta = meta.sort("individual", maintain_order=True)
+        for (individual,), pair in meta.partition_by(
+            "individual", as_dict=True, maintain_order=True
+        ).items():
+            if pair.height != 2:
+                continue
+            i, j = (names.index(name) for name in pair["sample"].cast(pl.String))
+            overlap.append(
+                {
+                    "chain": chain,
+                    "individual": individual,
+                    "condition": pair["condition"][0],
+                    "jaccard_mean": float(np.mean(jaccard[:, i, j])),
+                    "jaccard_std": float(np.std(jaccard[:, i, j])),
+                }
+            )
+
+        summary = rarefaction.summarise(rarefaction.get_diversity(rarefied), ["sample"])
+        div.append(summary.with_columns(pl.col("sample").cast(pl.String)))
+
+    pl.DataFrame(overlap).write_csv(jaccard_path)
+    pl.concat(div).write_csv(diversity_path)
+    return {"outputs": [jaccard_path, diversity_path]}
+
+
+def draw_v_usage(reps: pl.DataFrame, out_dir: str, force=False) -> dict[str, list[str]]:
+    """
+    V gene usage of the clonotypes shared by every pair of tissues against that of
+    the whole chain.
+    """
+    col = "clonotype_id"
+    dictionary = clonotype.get_dictionary(reps)
+    clonotypes = cohort.get_clonotypes(reps, col=col)
+    backgrounds = cohort.get_vregions(clonotypes, ["chain"], col, dictionary)
+    backgrounds = backgrounds.sort("frequency", descending=True)
+    backgrounds = backgrounds.partition_by("chain", as_dict=True)
+
+    shared, _ = get_shared(reps)
+    by = ["individual", "chain", "overlap"]
+    vregions = cohort.get_vregions(shared, by, col, dictionary)
+    vregions = vregions.join(
+        shared.select("overlap", "sample", "sample_right").unique(), on="overlap"
+    )
+    vregions = vregions.sort(
+        pl.col("sample").to_physical(), pl.col("sample_right").to_physical()
+    )
+    figs = {}
+    for (i, chain), df in vregions.partition_by(
+        ["individual", "chain"], as_dict=True, maintain_order=True
+    ).items():
+        overlaps = df.partition_by("overlap", as_dict=True, maintain_order=True)
+        overlaps = {name: rep for (name,), rep in overlaps.items()}
+        fig = plot.vregions(overlaps, backgrounds[(chain,)])
+        figs[f"{out_dir}/vregion/{i}_{chain}_vusage.png"] = fig
+    render.render(figs, force=force)
+    return {"outputs": list(figs)}
+
+
+def draw_venn3(
+    reps: pl.DataFrame, out_dir: str, col="sequence", force=False
+) -> dict[str, list[str]]:
+    """
+    Venn diagram of the D, ME and BR (HB and ST merged) sequences, or clonotypes,
+    of every individual and chain.
+    """
+    figs = {}
+    suffix = "venn" if col == "sequence" else f"{col}_venn"
+    for (i, chain), part in reps.partition_by(
+        "individual", "chain", as_dict=True, maintain_order=True
+    ).items():
+        filtered = cohort.to_reps(part)
+        if col == "sequence":
+            seqs = dcr.get_seqs(filtered)
+        else:
+            filtered = clonotype.get_clonotype_ids(filtered)
+            seqs = {name: df["clonotype_id"].to_list() for name, df in filtered.items()}
+        cg_seqs = dcr.course_grain(seqs, ["HB", "ST"], "BR")
+        venn = stats.get_venn_counts(cg_seqs)
+        labels = list(cg_seqs.keys())
+        figs[f"{out_dir}/{i}_{chain}_{suffix}.png"] = plot.venn3(venn, *labels)
+    render.render(figs, force=force)
+    return {"outputs": list(figs)}
+
+
+def load_results(top_dir: str) -> pl.DataFrame:
+    return mixcr.get_results(top_dir)
+
+
+def draw_scatter(
+    run1: pl.DataFrame, summary_path: str, out_dir: str, force=False
+) -> dict[str, list[str]]:
+    """
+    MiXCR against Decombinator transcript counts, before and after UMI correction.
+    """
+    run2 = dcr.load_summary(summary_path)
+    merged = merge.frames(run1, run2)
+    corrected = merge.frames(umi.collapse(run1), run2)
+    figs = {}
+    for feature in ["total_transcripts", "unique_transcripts"]:
+        figs[f"{out_dir}/{feature}_scatter.png"] = plot.scatter(merged, feature)
+        fig = plot.scatter(corrected, feature)
+        figs[f"{out_dir}/{feature}_umi_corrected_scatter.png"] = fig
+    render.render(figs, force=force)
+    return {"outputs": list(figs)}
+
+
+def write_cdr3_check(
+    run1: pl.DataFrame, path: str, cdr3="CAASANSGTYQRF"
+) -> dict[str, list[str]]:
+    run1.filter(pl.col("CDR3") == cdr3).drop("umis").write_csv(path)
+    return {"outputs": [path]}
+
+
+def get_files(paths) -> tuple[str, ...]:
+    return tuple(sorted(str(path) for path in paths if path.is_file()))
+
+
+def get_stages(data_dir: str, out_dir: str) -> list[Stage]:
+    """
+    Function which declares the additional analyses as pipeline stages, to run
+    alongside figures.get_stages whose reps stage they share.
+
+    The MiXCR exports and the Decombinator summary are found from data_dir in the
+    layout written by synthetic.write_cohort, data/results/*/ and
+    data/tcrseqgroup/Summary_NS148.csv.
+
+    ...
+
+    Parameters
+    ----------
+        data_dir: Directory of the translated Decombinator repertoires
+        out_dir: Directory the figures and tables are written to
+
+    Returns
+    -------
+        The stages, to pass to pipeline.run with targets from get_targets
+    """
+    data_dir = pathlib.Path(data_dir)
+    results_dir = pathlib.Path(os.path.normpath(data_dir / ".." / ".." / ".."))
+    summary_path = data_dir.parent / "Summary_NS148.csv"
+    query_dir = pathlib.Path(out_dir) / "query"
+    result_files = get_files((query_dir / "result").glob("*.csv"))
+    return [
+        Stage(
+            "overlap_figure",
+            draw_overlap,
+            deps=("reps",),
+            params={"path": f"{out_dir}/overlap.png"},
+            modules=(cohort, stats, plot, render),
+        ),
+        Stage(
+            "eigen_overlap",
+            get_eigen_overlap,
+            deps=("reps",),
+            modules=(cohort, stats, eigen),
+        ),
+        Stage(
+            "ind_overlap_figure",
+            draw_ind_overlap,
+            deps=("reps",),
+            params={"out_dir": out_dir},
+            modules=(cohort, stats, plot, render),
+        ),
+        Stage(
+            "me_d_box_figure",
+            draw_me_d_box,
+            deps=("reps",),
+            params={"path": f"{out_dir}/box_ind_me_d_overlap.png"},
+            modules=(cohort, stats, plot, render),
+        ),
+        Stage(
+            "pc_scatter_figure",
+            draw_pc_scatter,
+            deps=("reps",),
+            params={"path": f"{out_dir}/pc_scatter.png"},
+            modules=(cohort, dcr, diversity, plot, render),
+        ),
+        Stage(
+            "query_export",
+            write_query,
+            deps=("reps",),
+            params={"out_dir": str(query_dir)},
+            modules=(clonotype, cohort, tcric),
+        ),
+        Stage(
+            "query_result_export",
+            write_query_result,
+            params={"files": list(result_files), "path": f"{out_dir}/query_result.csv"},
+            files=result_files,
+        ),
+        Stage(
+            "rarefied_export",
+            write_rarefied,
+            deps=("reps",),
+            params={
+                "jaccard_path": f"{out_dir}/rarefied_jaccard.csv",
+                "diversity_path": f"{out_dir}/rarefied_diversity.csv",
+            },
+            modules=(clonotype, cohort, rarefaction),
+        ),
+        Stage(
+            "v_usage_figure",
+            draw_v_usage,
+            deps=("reps",),
+            params={"out_dir": out_dir},
+            modules=(clonotype, cohort, plot, render),
+        ),
+        Stage(
+            "venn3_figure",
+            draw_venn3,
+            deps=("reps",),
+            params={"out_dir": out_dir},
+            modules=(cohort, dcr, stats, plot, render),
+        ),
+        Stage(
+            "venn3_clonotype_figure",
+            draw_venn3,
+            deps=("reps",),
+            params={"out_dir": out_dir, "col": "clonotype"},
+            modules=(clonotype, cohort, dcr, stats, plot, render),
+        ),
+        Stage(
+            "run1",
+            load_results,
+            params={"top_dir": str(results_dir)},
+            files=get_files(results_dir.glob("data/results/*/*.clns_TR*.tsv")),
+            modules=(mixcr,),
+        ),
+        Stage(
+            "scatter_figure",
+            draw_scatter,
+            deps=("run1",),
+            params={"summary_path": str(summary_path), "out_dir": out_dir},
+            files=get_files([summary_path]),
+            modules=(dcr, merge, umi, plot, render),
+        ),
+        Stage(
+            "run1_cdr3check_export",
+            write_cdr3_check,
+            deps=("run1",),
+            params={"path": f"{out_dir}/run1_cdr3check.csv"},
+        ),
+    ]
+
+
+def get_targets(analysis: str | None = None) -> list[str]:
+    """
+    Stages producing the files of one analysis of ANALYSES, or of every analysis if
+    None.
+    """
+    if analysis is None:
+        return [target for targets in ANALYSES.values() for target in targets]
+    return ANALYSES[analysis]
@@ -0,0 +1,198 @@
+"""On-disk Arrow IPC cache of parsed repertoires"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import time
+from collections.abc import Callable
+
+import polars as pl
+
+CHUNK_SIZE = 1 << 20
+
+
+def get_cache_dir() -> pathlib.Path:
+    """
+    Default cache location, overridable with the DCR_CACHE_DIR environment variable.
+    """
+    default = pathlib.Path.home() / ".cache" / "dcr-pd-analysis"
+    return pathlib.Path(os.environ.get("DCR_CACHE_DIR", default))
+
+
+def get_path_key(path: str) -> str:
+    resolved = str(pathlib.Path(path).resolve())
+    return hashlib.blake2b(resolved.encode(), digest_size=8).hexdigest()
+
+
+def get_content_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(path: str, cache_dir: str | pathlib.Path | None = None) -> str:
+    """
+    Function which fingerprints a source file on its path, size, mtime and content.
+
+    The content hash is memoised in a sidecar keyed on size and mtime, so it is
+    only recomputed when the file changes on disk.
+
+    ...
+
+    Parameters
+    ----------
+        path: Source file to fingerprint
+        cache_dir: Cache directory holding the content hash sidecars
+
+    Returns
+    -------
+        A hex string identifying this exact version of the file
+    """
+    root = pathlib.Path(cache_dir) if cache_dir else get_cache_dir()
+    stat = os.stat(path)
+    sidecar = root / f"{get_path_key(path)}.json"
+    content = None
+    if sidecar.is_file():
+        meta = json.loads(sidecar.read_text())
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            content = meta["content"]
+    if content is None:
+        content = get_content_hash(path)
+        meta = {
+            "path": str(pathlib.Path(path).resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "content": content,
+        }
+        root.mkdir(parents=True, exist_ok=True)
+        tmp = sidecar.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, sidecar)
+    key = f"{pathlib.Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}:{content}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def get_entry(path: str, cache_dir: str | pathlib.Path | None = None) -> pathlib.Path:
+    root = pathlib.Path(cache_dir) if cache_dir else get_cache_dir()
+    return root / f"{get_path_key(path)}-{fingerprint(path, cache_dir)}.arrow"
+
+
+def read(
+    path: str,
+    reader: Callable[[str], pl.DataFrame],
+    columns: list[str] | None = None,
+    cache_dir: str | pathlib.Path | None = None,
+    compression: str = "uncompressed",
+) -> pl.DataFrame:
+    """
+    Function which reads a source file through the cache.
+
+    On a miss the full file is parsed with reader and written as Arrow IPC. On a
+    hit the IPC copy is memory-mapped and only the requested columns are read.
+    Stale copies of the same source are removed when a new one is written.
+
+    ...
+
+    Parameters
+    ----------
+        path: Source file to read
+        reader: Function parsing the source file into a DataFrame
+        columns: Columns to return, or None for all
+        cache_dir: Cache directory, defaults to get_cache_dir()
+        compression: IPC compression; "uncompressed" keeps the copy mappable
+
+    Returns
+    -------
+        A polars DataFrame of the source file
+    """
+    entry = get_entry(path, cache_dir)
+    if not entry.is_file():
+        df = reader(path)
+        for stale in entry.parent.glob(f"{get_path_key(path)}-*.arrow"):
+            stale.unlink(missing_ok=True)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        df.write_ipc(tmp, compression=compression)
+        os.replace(tmp, entry)
+        return df.select(columns) if columns else df
+    os.utime(entry)
+    return pl.read_ipc(entry, columns=columns, memory_map=True)
+
+
+def scan(
+    path: str,
+    reader: Callable[[str], pl.DataFrame],
+    cache_dir: str | pathlib.Path | None = None,
+) -> pl.LazyFrame:
+    """
+    Lazily scan the cached copy of a source file, populating the cache on a miss.
+    """
+    entry = get_entry(path, cache_dir)
+    if not entry.is_file():
+        read(path, reader, cache_dir=cache_dir)
+    else:
+        os.utime(entry)
+    return pl.scan_ipc(entry, memory_map=True)
+
+
+def invalidate(
+    path: str | None = None, cache_dir: str | pathlib.Path | None = None
+) -> None:
+    """
+    Remove the cached copies of one source file, or the whole cache if path is None.
+    """
+    root = pathlib.Path(cache_dir) if cache_dir else get_cache_dir()
+    if path is None:
+        shutil.rmtree(root, ignore_errors=True)
+        return
+    key = get_path_key(path)
+    for entry in root.glob(f"{key}*"):
+        entry.unlink(missing_ok=True)
+
+
+def evict(
+    cache_dir: str | pathlib.Path | None = None,
+    max_bytes: int | None = None,
+    max_age: float | None = None,
+) -> list[pathlib.Path]:
+    """
+    Function which evicts cached repertoires by age and then by total size.
+
+    Entries are aged on their last use. When the cache is over max_bytes the least
+    recently used entries are removed first. The content hash sidecar of each
+    evicted entry goes with it.
+
+    ...
+
+    Parameters
+    ----------
+        cache_dir: Cache directory, defaults to get_cache_dir()
+        max_bytes: Maximum total size of the cached copies
+        max_age: Maximum time in seconds since an entry was last used
+
+    Returns
+    -------
+        The evicted entries
+    """
+    root = pathlib.Path(cache_dir) if cache_dir else get_cache_dir()
+    entries = sorted(root.glob("*.arrow"), key=lambda e: e.stat().st_mtime)
+    evicted = []
+    if max_age is not None:
+        cutoff = time.time() - max_age
+        evicted += [e for e in entries if e.stat().st_mtime < cutoff]
+        entries = [e for e in entries if e not in evicted]
+    if max_bytes is not None:
+        total = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            total -= entry.stat().st_size
+            evicted.append(entry)
+    for entry in evicted:
+        entry.unlink(missing_ok=True)
+        key = entry.name.split("-")[0]
+        (root / f"{key}.json").unlink(missing_ok=True)
+    return evicted
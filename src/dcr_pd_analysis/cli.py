@@ -0,0 +1,138 @@
+"""dcr-pd-analysis command line entry point running figures in one process"""
+
+import argparse
+import pathlib
+
+import polars as pl
+
+from dcr_pd_analysis import analyses, figures, pipeline, synthetic
+
+
+def get_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--data-dir",
+        default="../data/tcrseqgroup/translated/",
+        help="Directory of the translated Decombinator repertoires",
+    )
+    common.add_argument(
+        "--out-dir", default="out", help="Directory the figures and tables go to"
+    )
+    common.add_argument(
+        "--expected",
+        type=int,
+        default=None,
+        help="Number of repertoires in --data-dir, defaults to every one found",
+    )
+    common.add_argument(
+        "--artifact-dir",
+        default=None,
+        help="Pipeline artifact store, defaults to the cache directory",
+    )
+    common.add_argument(
+        "--workers", type=int, default=1, help="Number of stages run at once"
+    )
+    common.add_argument(
+        "--force", action="store_true", help="Re-run stages even if up to date"
+    )
+    parser = argparse.ArgumentParser(
+        prog="dcr-pd-analysis",
+        description="Generate the manuscript figures and additional analyses, "
+        "loading the cohort once.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for figure in figures.FIGURES:
+        subparsers.add_parser(figure, parents=[common], help=f"Draw {figure}")
+    subparsers.add_parser(
+        "figures", parents=[common], help="Draw every manuscript figure"
+    )
+    subparsers.add_parser(
+        "all",
+        parents=[common],
+        help="Draw every manuscript figure and run every additional analysis",
+    )
+    for analysis in analyses.ANALYSES:
+        subparsers.add_parser(analysis, parents=[common], help=f"Run {analysis}")
+    generate = subparsers.add_parser(
+        "synthetic", help="Write a synthetic cohort in the layout of the real data"
+    )
+    generate.add_argument("path", help="Data directory, e.g. ../data")
+    generate.add_argument("--individuals", type=int, default=8)
+    generate.add_argument(
+        "--depth", type=int, default=10_000, help="Sequences per repertoire"
+    )
+    generate.add_argument(
+        "--sharing",
+        type=float,
+        default=0.2,
+        help="Fraction of each repertoire shared by the tissues of an individual",
+    )
+    generate.add_argument(
+        "--public",
+        type=float,
+        default=0.01,
+        help="Fraction of each repertoire shared by every individual",
+    )
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument(
+        "--no-mixcr", action="store_true", help="Skip the MiXCR exports"
+    )
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    """
+    Function which runs the pipeline stages of the requested figure or additional
+    analysis, or writes a synthetic cohort.
+
+    Every figure and analysis shares the cohort loaded by the reps stage, and up to
+    date stages are skipped, see pipeline.run.
+
+    ...
+
+    Parameters
+    ----------
+        argv: Command line arguments, defaults to sys.argv[1:]
+    """
+    args = get_parser().parse_args(argv)
+    if args.command == "synthetic":
+        reps = synthetic.make_cohort(
+            args.individuals,
+            args.depth,
+            sharing=args.sharing,
+            public=args.public,
+            seed=args.seed,
+        )
+        written = synthetic.write_cohort(
+            args.path,
+            reps,
+            conditions=synthetic.get_conditions(args.individuals),
+            mixcr=not args.no_mixcr,
+            seed=args.seed,
+        )
+        print(f"Wrote {len(written)} files to {args.path}")
+        return
+    pathlib.Path(args.out_dir).mkdir(parents=True, exist_ok=True)
+    stages = figures.get_stages(args.data_dir, args.out_dir, args.expected)
+    stages += analyses.get_stages(args.data_dir, args.out_dir)
+    if args.command == "all":
+        targets = figures.get_targets() + analyses.get_targets()
+    elif args.command == "figures":
+        targets = figures.get_targets()
+    elif args.command in analyses.ANALYSES:
+        targets = analyses.get_targets(args.command)
+    else:
+        targets = figures.get_targets(args.command)
+    report = pipeline.run(
+        stages,
+        targets=targets,
+        artifact_dir=args.artifact_dir,
+        force=args.force,
+        max_workers=args.workers,
+    )
+    with pl.Config(tbl_rows=-1, fmt_str_lengths=16):
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
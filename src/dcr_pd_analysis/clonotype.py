@@ -0,0 +1,108 @@
+"""Cohort-wide dictionary mapping (CDR3, V, J) clonotypes to dense integer IDs"""
+
+import polars as pl
+
+from dcr_pd_analysis import dcr
+
+Frame = dcr.Frame
+
+CLONOTYPE_COLUMNS = ["junction_aa", "v_call", "j_call"]
+
+
+def build_dictionary(
+    reps: list[tuple[str, pl.DataFrame]] | pl.DataFrame,
+) -> pl.DataFrame:
+    """
+    Function which assigns every distinct (junction_aa, v_call, j_call) triple a
+    dense UInt32 ID shared across samples.
+
+    Triples with a null member are skipped, matching the drop_nulls in
+    dcr.get_clonotypes. IDs follow the sort order of the triples, so the same
+    cohort always produces the same dictionary.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires as returned by dcr.load_reps, or a cohort table
+
+    Returns
+    -------
+        A polars DataFrame with clonotype_id followed by the CLONOTYPE_COLUMNS
+    """
+    if isinstance(reps, pl.DataFrame):
+        triples = reps.select(CLONOTYPE_COLUMNS)
+    else:
+        triples = pl.concat([df.select(CLONOTYPE_COLUMNS) for _, df in reps])
+    triples = triples.drop_nulls().unique().sort(CLONOTYPE_COLUMNS)
+    return triples.with_row_index("clonotype_id")
+
+
+def encode(df: Frame, dictionary: pl.DataFrame) -> Frame:
+    """
+    Add the clonotype_id of each row's triple; rows with a null member get a null ID.
+    """
+    if isinstance(df, pl.LazyFrame):
+        dictionary = dictionary.lazy()
+    return df.join(dictionary, on=CLONOTYPE_COLUMNS, how="left")
+
+
+def decode(df: Frame, dictionary: pl.DataFrame, col="clonotype_id") -> Frame:
+    """
+    Add the triple and the space separated clonotype string back onto an ID column.
+    """
+    if isinstance(df, pl.LazyFrame):
+        dictionary = dictionary.lazy()
+    df = df.join(dictionary, left_on=col, right_on="clonotype_id", how="left")
+    return df.with_columns(dcr.get_clonotype_expr())
+
+
+def get_dictionary(df: Frame) -> pl.DataFrame:
+    """
+    Dictionary rows of the IDs in a table encoded with encode, such as the cohort
+    table of the reps stage, to decode its IDs for display.
+    """
+    df = df.select("clonotype_id", *CLONOTYPE_COLUMNS).drop_nulls("clonotype_id")
+    df = df.unique("clonotype_id")
+    if isinstance(df, pl.LazyFrame):
+        df = df.collect()
+    return df.sort("clonotype_id")
+
+
+def get_clonotype_ids(
+    reps: list[tuple[str, Frame]], dictionary: pl.DataFrame | None = None
+) -> dict[str, Frame]:
+    """
+    Integer counterpart of dcr.get_clonotypes, keyed on clonotype_id. Repertoires
+    already holding a clonotype_id column, as split from an encoded cohort table,
+    need no dictionary.
+    """
+    out = {}
+    for name, df in reps:
+        if "clonotype_id" not in df.collect_schema():
+            df = encode(df, dictionary)
+        df = df.drop_nulls("clonotype_id")
+        df = df.group_by("clonotype_id").agg(
+            pl.col("duplicate_count").sum().alias("duplicate_count"),
+        )
+        out[name] = df
+    return out
+
+
+def get_vregions_from_ids(
+    reps: dict[str, Frame], dictionary: pl.DataFrame
+) -> dict[str, Frame]:
+    """
+    Counterpart of dcr.get_vregions_from_clonotype that looks V genes up by ID
+    instead of re-splitting the clonotype string.
+    """
+    v_calls = dictionary.select("clonotype_id", "v_call")
+    out = {}
+    for name, df in reps.items():
+        lookup = v_calls.lazy() if isinstance(df, pl.LazyFrame) else v_calls
+        df = df.join(lookup, on="clonotype_id", how="left")
+        df = df.group_by("v_call").agg(
+            pl.col("clonotype_count").sum().alias("clonotype_count"),
+        )
+        out[name] = df
+    return out
@@ -0,0 +1,340 @@
+"""Long-format cohort table of every repertoire with per-sample metadata columns"""
+
+import pathlib
+import warnings
+
+import polars as pl
+
+from dcr_pd_analysis import dcr
+
+Frame = dcr.Frame
+
+META_COLUMNS = ["sample", "tissue", "individual", "chain", "condition"]
+
+
+CONDITIONS_FILE = "conditions.csv"
+
+
+def get_condition_map() -> dict[int, str]:
+    # Corrected and confirmed by Seppe on 13/01/2025
+    return {
+        1: "PD",
+        2: "PD",
+        3: "PD",
+        4: "PD",
+        5: "HC",
+        6: "HC",
+        7: "HC",
+        8: "HC",
+    }
+
+
+def read_condition_map(path: str | pathlib.Path) -> dict[int, str]:
+    """
+    Conditions declared in a CSV of individual and condition, such as the
+    CONDITIONS_FILE written next to a synthetic cohort.
+    """
+    df = pl.read_csv(path, schema={"individual": pl.Int16, "condition": pl.String})
+    return dict(df.iter_rows())
+
+
+def write_condition_map(path: str | pathlib.Path, conditions: dict[int, str]):
+    pl.DataFrame(
+        {"individual": list(conditions), "condition": list(conditions.values())},
+        schema={"individual": pl.Int16, "condition": pl.String},
+    ).write_csv(path)
+
+
+def get_conditions(cohort: Frame) -> dict[int, str]:
+    """
+    Condition of every individual of a cohort table, to pass on to get_metadata.
+    """
+    pairs = cohort.select("individual", pl.col("condition").cast(pl.String)).unique()
+    if isinstance(pairs, pl.LazyFrame):
+        pairs = pairs.collect()
+    return dict(pairs.iter_rows())
+
+
+def get_metadata(
+    names: list[str], conditions: dict[int, str] | None = None
+) -> pl.DataFrame:
+    """
+    Function which parses sample names such as dcr_PKD_ME1_1_alpha into metadata.
+
+    ...
+
+    Parameters
+    ----------
+        names: Sample names in cohort order
+        conditions: Condition of every individual, defaults to the real cohort's
+            get_condition_map
+
+    Returns
+    -------
+        A polars DataFrame with one row per sample and the META_COLUMNS as Enums
+    """
+    if conditions is None:
+        conditions = get_condition_map()
+    df = pl.DataFrame({"sample": names})
+    code = pl.col("sample").str.split("_").list.get(2)
+    df = df.with_columns(
+        code.str.extract(dcr.SAMPLE_CODE, 1).alias("tissue"),
+        code.str.extract(dcr.SAMPLE_CODE, 2).cast(pl.Int16).alias("individual"),
+        pl.col("sample").str.split("_").list.last().alias("chain"),
+    )
+    unknown = set(df["individual"].unique().to_list()) - set(conditions)
+    if unknown:
+        warnings.warn(f"Individuals {sorted(unknown)} have no condition")
+    df = df.with_columns(
+        pl.col("individual")
+        .replace_strict(conditions, default=None, return_dtype=pl.String)
+        .alias("condition")
+    )
+    df = df.with_columns(
+        pl.col("sample").cast(pl.Enum(names)),
+        pl.col("tissue").cast(pl.Enum(df["tissue"].unique(maintain_order=True))),
+        pl.col("chain").cast(pl.Enum(df["chain"].unique(maintain_order=True))),
+        pl.col("condition").cast(pl.Enum(["HC", "PD"])),
+    )
+    return df
+
+
+def build(
+    reps: list[tuple[str, Frame]], conditions: dict[int, str] | None = None
+) -> Frame:
+    """
+    Function which concatenates repertoires into a single cohort table.
+
+    The metadata is parsed once per sample and attached as constant columns, so
+    no string parsing happens per row.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires as returned by dcr.load_reps or dcr.scan_reps
+        conditions: Condition of every individual, see get_metadata
+
+    Returns
+    -------
+        The concatenated repertoires with the META_COLUMNS prepended
+    """
+    meta = get_metadata([name for name, _ in reps], conditions)
+    frames = []
+    for row, (_, df) in zip(meta.iter_rows(named=True), reps):
+        df = df.with_columns(
+            pl.lit(value).cast(meta.schema[col]).alias(col)
+            for col, value in row.items()
+        )
+        frames.append(df.select(*META_COLUMNS, pl.exclude(META_COLUMNS)))
+    return pl.concat(frames, how="vertical")
+
+
+def filter_samples(
+    cohort: Frame,
+    individual: int | list[int] | None = None,
+    tissue: str | list[str] | None = None,
+    chain: str | list[str] | None = None,
+    condition: str | list[str] | None = None,
+) -> Frame:
+    """
+    Vectorised replacement for dcr.filter_sample_id and dcr.filter_tissue.
+
+    Every argument takes a single value or a list; None leaves that column
+    unfiltered.
+    """
+    keys = {
+        "individual": individual,
+        "tissue": tissue,
+        "chain": chain,
+        "condition": condition,
+    }
+    for col, key in keys.items():
+        if key is None:
+            continue
+        if not isinstance(key, list):
+            key = [key]
+        cohort = cohort.filter(pl.col(col).is_in(key))
+    return cohort
+
+
+def get_samples(cohort: pl.DataFrame) -> pl.DataFrame:
+    return cohort.select(META_COLUMNS).unique(maintain_order=True)
+
+
+def get_clonotypes(cohort: Frame, col="clonotype") -> Frame:
+    """
+    Summed duplicate_count per sample of each clonotype string, or of each
+    clonotype_id of a cohort encoded with clonotype.encode.
+    """
+    if col == "clonotype":
+        cohort = cohort.with_columns(dcr.get_clonotype_expr())
+    cohort = cohort.drop_nulls(col)
+    return cohort.group_by(META_COLUMNS + [col]).agg(
+        pl.col("duplicate_count").sum().alias("duplicate_count")
+    )
+
+
+def add_freq_col(cohort: Frame, col="duplicate_count") -> Frame:
+    return cohort.with_columns(
+        (pl.col(col) / pl.col(col).sum().over("sample")).alias("frequency")
+    )
+
+
+def aggregate(cohort: Frame, by: list[str], col="duplicate_count") -> Frame:
+    """
+    Cohort-wide totals and row counts for any grouping in one pass.
+
+    On the output of get_clonotypes the row count is the number of distinct
+    clonotypes.
+    """
+    return cohort.group_by(by).agg(
+        pl.col(col).sum().alias(col),
+        pl.len().alias("rows"),
+    )
+
+
+def get_merged_name(name: str, merge_name: str) -> str:
+    parts = name.split("_")
+    _, individual = dcr.split_sample_code(name)
+    return f"{'_'.join(parts[:2])}_{merge_name}{individual}_{'_'.join(parts[-2:])}"
+
+
+def course_grain(
+    cohort: Frame,
+    mapping: dict[str, str],
+    col="clonotype",
+    count_col="duplicate_count",
+) -> Frame:
+    """
+    Function which merges tissues into super-tissues for every individual and chain
+    at once, e.g. {"HB": "BR", "ST": "BR"} pools hindbrain and striatum into BR.
+
+    Merged samples are renamed as dcr.course_grain_df does and appended after the
+    untouched samples.
+
+    ...
+
+    Parameters
+    ----------
+        cohort: Cohort table with one row per sample and value of col
+        mapping: Tissue code to super-tissue code; unmapped tissues are kept
+        col: Column identifying a clonotype
+        count_col: Count column summed over the merged samples
+
+    Returns
+    -------
+        The cohort table with one row per (sample, col) after merging
+    """
+    names = cohort.collect_schema()["sample"].categories.to_list()
+    meta = get_metadata(names)
+    tissues = meta["tissue"].cast(pl.String).to_list()
+    matched = {tissue for tissue in tissues if tissue in mapping}
+    if len(matched) <= 1:
+        warnings.warn(
+            f"Only {len(matched)} tissues matched your search. No course graining applied"
+        )
+        return cohort
+
+    renamed = {
+        name: get_merged_name(name, mapping[tissue]) if tissue in mapping else name
+        for name, tissue in zip(names, tissues)
+    }
+    kept = [name for name, tissue in zip(names, tissues) if tissue not in mapping]
+    merged = [name for name in dict.fromkeys(renamed.values()) if name not in kept]
+    merged_meta = get_metadata(kept + merged)
+
+    cohort = cohort.with_columns(
+        pl.col("sample")
+        .to_physical()
+        .replace_strict(
+            dict(enumerate(renamed.values())), return_dtype=merged_meta.schema["sample"]
+        )
+    )
+    cohort = cohort.group_by("sample", col).agg(pl.col(count_col).sum())
+    if isinstance(cohort, pl.LazyFrame):
+        merged_meta = merged_meta.lazy()
+    cohort = cohort.join(merged_meta, on="sample", how="left")
+    return cohort.select(*META_COLUMNS, col, count_col)
+
+
+def get_shared(cohort: Frame, col="clonotype", by: list[str] | None = None) -> Frame:
+    """
+    Function which finds every value shared by a pair of samples within each group,
+    the cohort-wide counterpart of stats.get_venn2_clones plus dcr.filter_seq.
+
+    ...
+
+    Parameters
+    ----------
+        cohort: Cohort table with one row per sample and value of col
+        col: Column identifying a clonotype
+        by: Metadata columns that both samples of a pair must share, defaults to
+            individual and chain
+
+    Returns
+    -------
+        One row per shared value and sample pair, ordered as in the cohort, with
+        the left and right sample columns suffixed _right and an overlap column
+        named "<sample>_&_<sample_right>"
+    """
+    if by is None:
+        by = ["individual", "chain"]
+    pairs = cohort.join(cohort, on=by + [col], suffix="_right")
+    pairs = pairs.filter(
+        pl.col("sample").to_physical() < pl.col("sample_right").to_physical()
+    )
+    overlap = pl.concat_str(pl.col("sample"), pl.lit("_&_"), pl.col("sample_right"))
+    return pairs.with_columns(overlap.alias("overlap"))
+
+
+def get_pairs(cohort: Frame, by: list[str] | None = None) -> Frame:
+    """
+    Every pair of samples within each group of by, named as in get_shared, whether
+    or not the pair has anything in common.
+    """
+    if by is None:
+        by = ["individual", "chain"]
+    samples = cohort.select(["sample"] + by).unique(maintain_order=True)
+    pairs = samples.join(samples, on=by, suffix="_right")
+    pairs = pairs.filter(
+        pl.col("sample").to_physical() < pl.col("sample_right").to_physical()
+    )
+    overlap = pl.concat_str(pl.col("sample"), pl.lit("_&_"), pl.col("sample_right"))
+    return pairs.with_columns(overlap.alias("overlap"))
+
+
+def get_vregions(
+    cohort: Frame,
+    by: list[str],
+    col="clonotype",
+    dictionary: pl.DataFrame | None = None,
+) -> Frame:
+    """
+    Clonotype count and frequency of each V gene within every group of by. V genes
+    are split from the clonotype string, or looked up in dictionary when col holds
+    clonotype IDs.
+    """
+    if dictionary is None:
+        v_call = pl.col(col).str.split(" ").list[1]
+        cohort = cohort.with_columns(v_call.alias("v_call"))
+    else:
+        v_calls = dictionary.select(pl.col("clonotype_id").alias(col), "v_call")
+        if isinstance(cohort, pl.LazyFrame):
+            v_calls = v_calls.lazy()
+        cohort = cohort.join(v_calls, on=col, how="left")
+    cohort = cohort.group_by(by + ["v_call"]).agg(pl.len().alias("clonotype_count"))
+    return cohort.with_columns(
+        (pl.col("clonotype_count") / pl.col("clonotype_count").sum().over(by)).alias(
+            "frequency"
+        )
+    )
+
+
+def to_reps(cohort: pl.DataFrame) -> list[tuple[str, pl.DataFrame]]:
+    """
+    Split a cohort table back into the list-of-tuples layout used by dcr and stats.
+    """
+    cohort = cohort.sort("sample", maintain_order=True)
+    parts = cohort.partition_by("sample", as_dict=True, maintain_order=True)
+    return [(str(name), df.drop(META_COLUMNS)) for (name,), df in parts.items()]
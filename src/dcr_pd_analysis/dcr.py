@@ -1,8 +1,18 @@
 import pathlib
+import re
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
 
 import polars as pl
 
+from dcr_pd_analysis import cache
+
+# Tissue letters followed by the individual's number, e.g. ME12
+SAMPLE_CODE = r"^([A-Z]+)(\d+)$"
+
+Frame = TypeVar("Frame", pl.DataFrame, pl.LazyFrame)
+
 
 def get_tissue_map() -> dict:
     return {
@@ -16,11 +26,11 @@ def get_tissue_map() -> dict:
 def load_summary(path: str) -> pl.DataFrame:
     df = pl.read_csv(path)
     df = df.filter(pl.nth(0).str.contains("PKD"))
+    code = pl.col("sample").str.split("_").list.get(1)
     df = df.with_columns(
-        pl.col("sample").str.split("_").list.get(1).str.to_lowercase().alias("tissue")
+        code.str.extract(SAMPLE_CODE, 1).str.to_lowercase().alias("tissue"),
+        code.str.extract(SAMPLE_CODE, 2).alias("tissue_id"),
     )
-    df = df.with_columns(pl.col("tissue").str.tail(1).alias("tissue_id"))
-    df = df.with_columns(pl.col("tissue").str.head(-1))
     df = df.with_columns(pl.col("tissue").replace(get_tissue_map()))
     df = df.with_columns(
         pl.col("sample").str.split("_").list.get(2).str.to_lowercase().alias("chain")
@@ -28,7 +38,25 @@ def load_summary(path: str) -> pl.DataFrame:
     return df
 
 
-def load_reps(path: str, glob: str, expected: int) -> list[tuple[str, pl.DataFrame]]:
+def get_airr_schema() -> dict[str, pl.DataType]:
+    return {
+        "sequence_id": pl.String,
+        "v_call": pl.String,
+        "d_call": pl.String,
+        "j_call": pl.String,
+        "junction": pl.String,
+        "junction_aa": pl.String,
+        "sequence": pl.String,
+        "sequence_aa": pl.String,
+        "duplicate_count": pl.Int64,
+    }
+
+
+def get_airr_columns() -> list[str]:
+    return ["junction_aa", "v_call", "j_call", "duplicate_count", "sequence"]
+
+
+def get_rep_files(path: str, glob: str, expected: int) -> list[str]:
     p = pathlib.Path(path).glob(glob)
     files = [p for p in p if p.is_file()]
     files = [f.resolve() for f in files]
@@ -36,22 +64,95 @@ def load_reps(path: str, glob: str, expected: int) -> list[tuple[str, pl.DataFra
     reverse.sort()
     files = [f[::-1] for f in reverse]
     assert len(files) == expected
-    return [
-        (f.split(".")[0].split("/")[-1], pl.read_csv(f, separator="\t")) for f in files
-    ]
+    return files
+
+
+def get_rep_name(path: str) -> str:
+    return path.split(".")[0].split("/")[-1]
+
+
+def split_sample_code(name: str) -> tuple[str, int]:
+    """
+    Tissue and individual of a sample name such as dcr_PKD_ME12_1_alpha.
+    """
+    tissue, individual = re.match(SAMPLE_CODE, name.split("_")[2]).groups()
+    return tissue, int(individual)
+
+
+def read_rep(path: str, columns: list[str] | None = None) -> pl.DataFrame:
+    """
+    Read a single Decombinator repertoire with the AIRR column dtypes pinned.
+
+    Parameters
+    ----------
+        path: Path to a translated Decombinator TSV
+        columns: Columns to read, or None for every column in the file
+
+    Returns
+    -------
+        A polars DataFrame of the repertoire
+    """
+    return pl.read_csv(
+        path, separator="\t", columns=columns, schema_overrides=get_airr_schema()
+    )
+
+
+def load_reps(
+    path: str,
+    glob: str,
+    expected: int,
+    columns: list[str] | None = None,
+    max_workers: int = 1,
+    cache_dir: str | pathlib.Path | None = None,
+) -> list[tuple[str, pl.DataFrame]]:
+    files = get_rep_files(path, glob, expected)
+
+    def read(f: str) -> pl.DataFrame:
+        if cache_dir is None:
+            return read_rep(f, columns)
+        return cache.read(f, read_rep, columns=columns, cache_dir=cache_dir)
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            dfs = list(pool.map(read, files))
+    else:
+        dfs = [read(f) for f in files]
+    return [(get_rep_name(f), df) for f, df in zip(files, dfs)]
+
+
+def scan_rep(path: str, cache_dir: str | pathlib.Path | None = None) -> pl.LazyFrame:
+    if cache_dir is None:
+        return pl.scan_csv(path, separator="\t", schema_overrides=get_airr_schema())
+    return cache.scan(path, read_rep, cache_dir=cache_dir)
+
+
+def scan_reps(
+    path: str,
+    glob: str,
+    expected: int,
+    cache_dir: str | pathlib.Path | None = None,
+) -> list[tuple[str, pl.LazyFrame]]:
+    """
+    Lazy counterpart of load_reps.
+
+    Nothing is read until the plans are collected, so chaining get_clonotypes,
+    get_vregions etc. onto these frames and calling collect_reps lets polars
+    push projections down into the scans and run every sample in parallel.
+    """
+    files = get_rep_files(path, glob, expected)
+    return [(get_rep_name(f), scan_rep(f, cache_dir)) for f in files]
+
+
+def collect_reps(reps: dict[str, pl.LazyFrame]) -> dict[str, pl.DataFrame]:
+    dfs = pl.collect_all(list(reps.values()))
+    return dict(zip(reps.keys(), dfs))
 
 
 def filter_sample_id(
     reps: list[tuple[str, pl.DataFrame]], key: int
 ) -> list[tuple[str, pl.DataFrame]]:
     NAME_I = 0
-    SAMPLE_CODE_I = 2
-    INDIVIDUAL_I = -1
-    filtered_reps = [
-        rep
-        for rep in reps
-        if int(rep[NAME_I].split("_")[SAMPLE_CODE_I][INDIVIDUAL_I]) == key
-    ]
+    filtered_reps = [rep for rep in reps if split_sample_code(rep[NAME_I])[1] == key]
     return filtered_reps
 
 
@@ -59,35 +160,36 @@ def filter_tissue(
     reps: list[tuple[str, pl.DataFrame]], key: list[str]
 ) -> list[tuple[str, pl.DataFrame]]:
     NAME_I = 0
-    SAMPLE_CODE_I = 2
-    INDIVIDUAL_I = -1
-    filtered_reps = [
-        rep
-        for rep in reps
-        if rep[NAME_I].split("_")[SAMPLE_CODE_I][:INDIVIDUAL_I] in key
-    ]
+    filtered_reps = [rep for rep in reps if split_sample_code(rep[NAME_I])[0] in key]
     return filtered_reps
 
 
-def get_vregions(reps: list[tuple[str, pl.DataFrame]]) -> dict[str, pl.DataFrame]:
-    out = {}
-    for name, df in reps:
-        df = df.with_columns(
-            (
-                pl.col("junction_aa") + " " + pl.col("v_call") + " " + pl.col("j_call")
-            ).alias("clonotype")
-        )
-        df = df.drop_nulls("clonotype")
-        df = df.group_by("clonotype").agg(
-            pl.col("duplicate_count").sum().alias("duplicate_count"),
-        )
-        df = df.with_columns(pl.lit(1).alias("clonotype_count"))
-        df = df.with_columns(pl.col("clonotype").str.split(" ").list[1].alias("v_call"))
-        df = df.group_by("v_call").agg(
-            pl.col("clonotype_count").sum().alias("clonotype_count"),
-        )
-        out[name] = df
-    return out
+def get_clonotype_expr() -> pl.Expr:
+    return (
+        pl.col("junction_aa") + " " + pl.col("v_call") + " " + pl.col("j_call")
+    ).alias("clonotype")
+
+
+def to_clonotypes(df: Frame) -> Frame:
+    df = df.with_columns(get_clonotype_expr())
+    df = df.drop_nulls("clonotype")
+    df = df.group_by("clonotype").agg(
+        pl.col("duplicate_count").sum().alias("duplicate_count"),
+    )
+    return df
+
+
+def to_vregions(df: Frame) -> Frame:
+    df = df.with_columns(pl.lit(1).alias("clonotype_count"))
+    df = df.with_columns(pl.col("clonotype").str.split(" ").list[1].alias("v_call"))
+    df = df.group_by("v_call").agg(
+        pl.col("clonotype_count").sum().alias("clonotype_count"),
+    )
+    return df
+
+
+def get_vregions(reps: list[tuple[str, Frame]]) -> dict[str, Frame]:
+    return {name: to_vregions(to_clonotypes(df)) for name, df in reps}
 
 
 def merge_vregions(reps: dict[str, pl.DataFrame]) -> pl.DataFrame:
@@ -107,9 +209,7 @@ def merge_vregions(reps: dict[str, pl.DataFrame]) -> pl.DataFrame:
     return base
 
 
-def add_freq_col(
-    reps: dict[str, pl.DataFrame], col="duplicate_count"
-) -> dict[str, pl.DataFrame]:
+def add_freq_col(reps: dict[str, Frame], col="duplicate_count") -> dict[str, Frame]:
     data = {}
     for name, rep in reps.items():
         rep = rep.with_columns((pl.col(col) / pl.col(col).sum()).alias("frequency"))
@@ -123,23 +223,11 @@ def get_seqs(reps: list[tuple[str, pl.DataFrame]]) -> dict[str, list[str]]:
     return {rep[NAME_I]: rep[DF_I]["sequence"].to_list() for rep in reps}
 
 
-def get_clonotypes(reps: list[tuple[str, pl.DataFrame]]) -> dict[str, pl.DataFrame]:
-    out = {}
-    for name, df in reps:
-        df = df.with_columns(
-            (
-                pl.col("junction_aa") + " " + pl.col("v_call") + " " + pl.col("j_call")
-            ).alias("clonotype")
-        )
-        df = df.drop_nulls("clonotype")
-        df = df.group_by("clonotype").agg(
-            pl.col("duplicate_count").sum().alias("duplicate_count"),
-        )
-        out[name] = df
-    return out
+def get_clonotypes(reps: list[tuple[str, Frame]]) -> dict[str, Frame]:
+    return {name: to_clonotypes(df) for name, df in reps}
 
 
-def get_pc_clonotypes(reps: list[tuple[str, pl.DataFrame]]) -> dict[str, pl.DataFrame]:
+def get_pc_clonotypes(reps: list[tuple[str, Frame]]) -> dict[str, Frame]:
     out = {}
     for name, df in reps:
         df = df.with_columns((pl.col("junction_aa")).alias("clonotype"))
@@ -153,7 +241,7 @@ def get_pc_clonotypes(reps: list[tuple[str, pl.DataFrame]]) -> dict[str, pl.Data
 
 
 def get_vregions_from_clonotype(
-    reps: dict[str, pl.DataFrame]
+    reps: dict[str, pl.DataFrame],
 ) -> dict[str, pl.DataFrame]:
     out = {}
     for name, df in reps.items():
@@ -180,13 +268,11 @@ def course_grain_df(
 ) -> dict[str, pl.DataFrame]:
     NAME_I = 0
     DF_I = 1
-    SAMPLE_CODE_I = 2
-    INDIVIDUAL_I = -1
 
     selected_tissues = {
         rep[NAME_I]: rep[DF_I]
         for rep in reps.items()
-        if rep[NAME_I].split("_")[SAMPLE_CODE_I][:INDIVIDUAL_I] in tissues
+        if split_sample_code(rep[NAME_I])[0] in tissues
     }
 
     if len(selected_tissues) <= 1:
@@ -198,7 +284,7 @@ def course_grain_df(
     reps = {
         rep[NAME_I]: rep[DF_I]
         for rep in reps.items()
-        if rep[NAME_I].split("_")[SAMPLE_CODE_I][:INDIVIDUAL_I] not in tissues
+        if split_sample_code(rep[NAME_I])[0] not in tissues
     }
 
     keys = list(selected_tissues.keys())
@@ -211,7 +297,7 @@ def course_grain_df(
     )
     base = base.select("clonotype", "duplicate_count")
 
-    id = list(reps.keys())[0].split("_")[2][-1]
+    id = split_sample_code(list(reps.keys())[0])[1]
     prefix = "_".join(list(reps.keys())[0].split("_")[:2])
     suffix = "_".join(list(reps.keys())[0].split("_")[-2:])
     new_key = f"{prefix}_{merge_name}{id}_{suffix}"
@@ -225,13 +311,11 @@ def course_grain(
 ) -> dict[str, list[str]]:
     NAME_I = 0
     DF_I = 1
-    SAMPLE_CODE_I = 2
-    INDIVIDUAL_I = -1
 
     selected_tissues = {
         rep[NAME_I]: rep[DF_I]
         for rep in reps.items()
-        if rep[NAME_I].split("_")[SAMPLE_CODE_I][:INDIVIDUAL_I] in tissues
+        if split_sample_code(rep[NAME_I])[0] in tissues
     }
 
     if len(selected_tissues) <= 1:
@@ -243,7 +327,7 @@ def course_grain(
     reps = {
         rep[NAME_I]: rep[DF_I]
         for rep in reps.items()
-        if rep[NAME_I].split("_")[SAMPLE_CODE_I][:INDIVIDUAL_I] not in tissues
+        if split_sample_code(rep[NAME_I])[0] not in tissues
     }
 
     merge = []
@@ -251,7 +335,7 @@ def course_grain(
         merge += seqs
     merge = list(set(merge))
 
-    id = list(reps.keys())[0].split("_")[2][-1]
+    id = split_sample_code(list(reps.keys())[0])[1]
     prefix = "_".join(list(reps.keys())[0].split("_")[:2])
     suffix = "_".join(list(reps.keys())[0].split("_")[-2:])
     new_key = f"{prefix}_{merge_name}{id}_{suffix}"
@@ -261,7 +345,9 @@ def course_grain(
 
 
 def filter_seq(
-    overlaps: dict[str, set[str]], data: dict[str, pl.DataFrame]
+    overlaps: dict[str, set[str]] | dict[str, set[int]],
+    data: dict[str, pl.DataFrame],
+    col="clonotype",
 ) -> dict[str, dict[str, pl.DataFrame]]:
     filtered = {}
     for name, clones in overlaps.items():
@@ -274,14 +360,16 @@ def filter_seq(
         rep_seq = {}
         for rep in reps:
             df = data[rep]
-            df = df.filter(pl.col("clonotype").is_in(pl.Series(list(clones))))
+            df = df.filter(pl.col(col).is_in(pl.Series(list(clones))))
             rep_seq[rep] = df
         filtered[name] = rep_seq
     return filtered
 
 
 def filter_seq_select(
-    overlaps: dict[str, set[str]], data: dict[str, pl.DataFrame]
+    overlaps: dict[str, set[str]] | dict[str, set[int]],
+    data: dict[str, pl.DataFrame],
+    col="clonotype",
 ) -> dict[str, dict[str, pl.DataFrame]]:
     filtered = {}
     for name, clones in overlaps.items():
@@ -294,8 +382,8 @@ def filter_seq_select(
         rep_seq = {}
         for rep in reps:
             df = data[rep]
-            df = df.filter(pl.col("clonotype").is_in(pl.Series(list(clones))))
-            df = df.select(["clonotype", "frequency"])
+            df = df.filter(pl.col(col).is_in(pl.Series(list(clones))))
+            df = df.select([col, "frequency"])
             rep_seq[rep] = df
         filtered[name] = rep_seq
     return filtered
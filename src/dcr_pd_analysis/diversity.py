@@ -0,0 +1,106 @@
+"""Repertoire diversity estimators computed for every sample in one grouped pass"""
+
+import polars as pl
+
+from dcr_pd_analysis import dcr
+
+Frame = dcr.Frame
+
+
+def get_hill_expr(q: float, p: pl.Expr, shannon: pl.Expr) -> pl.Expr:
+    if q == 0:
+        return p.count().cast(pl.Float64)
+    if q == 1:
+        return shannon.exp()
+    return (p**q).sum() ** (1 / (1 - q))
+
+
+def get_diversity(
+    df: Frame,
+    by: list[str],
+    count_col="count",
+    q: list[float] | None = None,
+) -> Frame:
+    """
+    Function which computes the diversity estimators of every group of by at once.
+
+    pc and varpc follow pyrepseq's pc_n and varpc_n: the unbiased probability that
+    two molecules drawn without replacement come from the same clonotype, and
+    its sampling variance. pc_labels matches pyrepseq's pc called on the count
+    column, which treats each count as a label: the probability that two
+    clonotypes have equal counts. Chao1 uses the bias-corrected form when no
+    clonotype is seen exactly twice.
+
+    ...
+
+    Parameters
+    ----------
+        df: One row per clonotype of each group holding its count
+        by: Columns identifying a sample
+        count_col: Column holding the count of each clonotype
+        q: Orders of the Hill numbers to return, defaults to 0, 1 and 2
+
+    Returns
+    -------
+        One row per group with richness, total, pc, pc_labels, varpc, shannon,
+        simpson (sum of squared frequencies), clonality (1 - shannon / ln
+        richness), chao1 and a hill_<q> column per order
+    """
+    if q is None:
+        q = [0, 1, 2]
+    n = pl.col(count_col).cast(pl.Float64)
+    total = n.sum()
+    p = n / total
+    shannon = -(p * p.log()).sum()
+    p2 = (n * (n - 1)).sum() / (total * (total - 1))
+    p3 = (n * (n - 1) * (n - 2)).sum() / (total * (total - 1) * (total - 2))
+    beta = 2 * (2 * total - 3) / ((total - 2) * (total - 3))
+    varpc = (
+        4 * (total - 2) / (total * (total - 1)) * (1 + beta) * p3
+        - beta * p2**2
+        + 2 / (total * (total - 1)) * (1 + beta) * p2
+    )
+    f1 = (pl.col(count_col) == 1).sum().cast(pl.Float64)
+    f2 = (pl.col(count_col) == 2).sum().cast(pl.Float64)
+    richness = pl.col(count_col).count().cast(pl.Float64)
+    ties = pl.col(count_col).unique_counts().cast(pl.Float64)
+    pc_labels = (ties * (ties - 1)).sum() / (richness * (richness - 1))
+    chao1 = (
+        pl.when(f2 > 0)
+        .then(richness + f1**2 / (2 * f2))
+        .otherwise(richness + f1 * (f1 - 1) / 2)
+    )
+    df = df.filter(pl.col(count_col) > 0)
+    df = df.group_by(by, maintain_order=True).agg(
+        pl.col(count_col).count().alias("richness"),
+        total.alias("total"),
+        p2.alias("pc"),
+        pc_labels.alias("pc_labels"),
+        varpc.alias("varpc"),
+        shannon.alias("shannon"),
+        (p**2).sum().alias("simpson"),
+        chao1.alias("chao1"),
+        *(get_hill_expr(order, p, shannon).alias(f"hill_{order}") for order in q),
+    )
+    return df.with_columns(
+        pl.when(pl.col("richness") > 1)
+        .then(1 - pl.col("shannon") / pl.col("richness").log())
+        .alias("clonality")
+    )
+
+
+def get_sample_diversity(
+    reps: dict[str, Frame], count_col="count", q: list[float] | None = None
+) -> pl.DataFrame:
+    """
+    get_diversity over a dict of per-sample frames, such as dcr.get_pc_clonotypes
+    output, with the names in a sample column.
+    """
+    frames = [
+        df.select(pl.lit(name).alias("sample"), pl.col(count_col))
+        for name, df in reps.items()
+    ]
+    diversity = get_diversity(pl.concat(frames), ["sample"], count_col, q)
+    if isinstance(diversity, pl.LazyFrame):
+        diversity = diversity.collect()
+    return diversity
@@ -8,3 +8,4 @@ def get(data: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
     eigenvalues, eigenvectors = np.linalg.eig(data)
     print(eigenvalues.shape)
     print(eigenvectors.shape)
+    return eigenvalues
@@ -0,0 +1,302 @@
+"""Manuscript figures declared as pipeline stages"""
+
+import pathlib
+
+import polars as pl
+
+from dcr_pd_analysis import (
+    cache,
+    clonotype,
+    cohort,
+    dcr,
+    diversity,
+    hypothesis,
+    plot,
+    render,
+    stats,
+)
+from dcr_pd_analysis.pipeline import Stage
+from dcr_pd_analysis.plot import annotate
+
+BOX_FORMAT = dict(interline=0.02, width=1, text_height=0.06, color="black", size=4)
+FIGURES = {
+    "tissue_box": ["tissue_box_export", "tissue_box_figure"],
+    "expanded_box": ["expanded_box_export", "expanded_box_figure"],
+    "pc_box": ["pc_box_export", "pc_box_figure"],
+    "alluvial": ["alluvial_figure"],
+}
+
+
+def get_condition_groups(reps: pl.DataFrame) -> dict[str, list[int]]:
+    """
+    Individuals of each condition in the cohort, see cohort.get_metadata.
+    Individuals without a condition are left out.
+    """
+    groups = {"HC": [], "PD": []}
+    samples = reps.select("condition", "individual").unique().drop_nulls()
+    samples = samples.sort("individual")
+    for condition, individual in samples.iter_rows():
+        groups[condition].append(individual)
+    return groups
+
+
+def load_cohort(data_dir: str, glob: str, expected: int) -> pl.DataFrame:
+    """
+    The cohort table, with the conditions of a cohort.CONDITIONS_FILE in data_dir
+    such as a synthetic one's, otherwise those of the real cohort. The clonotype
+    dictionary is built once here, so every row carries its clonotype_id and the
+    overlaps downstream compare integers rather than clonotype strings.
+    """
+    path = pathlib.Path(data_dir) / cohort.CONDITIONS_FILE
+    conditions = cohort.read_condition_map(path) if path.is_file() else None
+    reps = dcr.load_reps(
+        data_dir,
+        glob=glob,
+        expected=expected,
+        columns=dcr.get_airr_columns(),
+        max_workers=8,
+        cache_dir=cache.get_cache_dir(),
+    )
+    reps = cohort.build(reps, conditions)
+    return clonotype.encode(reps, clonotype.build_dictionary(reps))
+
+
+def get_tissue_box_data(reps: pl.DataFrame) -> dict[str, list[float]]:
+    """
+    D/ME Jaccard index on sequence of every individual and chain, per condition.
+    """
+    reps = cohort.filter_samples(reps, tissue=["D", "ME"])
+    jaccard = {}
+    for (individual, chain), part in reps.partition_by(
+        "individual", "chain", as_dict=True
+    ).items():
+        overlap = stats.get_overlap_matrices(cohort.to_reps(part), col="sequence")
+        jaccard[(individual, chain)] = float(overlap["jaccard"][0, 1])
+    data = {
+        f"{condition} {chain[0].upper()}": [jaccard[(i, chain)] for i in indices]
+        for condition, indices in get_condition_groups(reps).items()
+        for chain in ["alpha", "beta"]
+    }
+    return {k: v for k, v in sorted(data.items(), key=lambda item: item[0][::-1])}
+
+
+def get_expanded_box_data(reps: pl.DataFrame) -> dict[str, list[float]]:
+    """
+    Fraction of expanded ME clonotypes found in D of every individual and chain,
+    per condition.
+    """
+    reps = cohort.filter_samples(reps, tissue=["D", "ME"])
+    clonotypes = cohort.get_clonotypes(reps, col="clonotype_id")
+    index = {}
+    for (individual, chain), part in clonotypes.partition_by(
+        "individual", "chain", as_dict=True
+    ).items():
+        me = part.filter(pl.col("tissue") == "ME")
+        index[(individual, chain)] = stats.get_expanded_index(
+            me.filter(pl.col("duplicate_count") > 1),
+            part.filter(pl.col("tissue") == "D"),
+            col="clonotype_id",
+        )
+    data = {
+        f"{condition} {chain[0].upper()} M->D": [index[(i, chain)] for i in indices]
+        for condition, indices in get_condition_groups(clonotypes).items()
+        for chain in ["alpha", "beta"]
+    }
+    return {k: v for k, v in sorted(data.items(), key=lambda item: item[0][::-1])}
+
+
+def get_pc_box_data(reps: pl.DataFrame) -> dict[str, list[float]]:
+    """
+    Effective number of CDR3s, 1 / pc_labels, of every D and ME sample per condition.
+    """
+    reps = cohort.filter_samples(reps, tissue=["D", "ME"]).drop_nulls("junction_aa")
+    counts = reps.group_by(*cohort.META_COLUMNS, "junction_aa").agg(
+        pl.col("duplicate_count").sum().alias("count")
+    )
+    div = diversity.get_diversity(counts, cohort.META_COLUMNS)
+    pc = {
+        (row["tissue"], row["individual"], row["chain"]): 1 / row["pc_labels"]
+        for row in div.iter_rows(named=True)
+    }
+    data = {
+        f"{chain[0].upper()} {tissue} {condition} ": [
+            pc[(tissue, i, chain)] for i in indices
+        ]
+        for chain in ["alpha", "beta"]
+        for tissue in ["D", "ME"]
+        for condition, indices in get_condition_groups(reps).items()
+    }
+    return {key: data[key] for key in sorted(data)}
+
+
+def compare_box_data(data: dict[str, list[float]]) -> pl.DataFrame:
+    pairs = [[i, i + 1] for i in range(0, len(data), 2)]
+    return hypothesis.compare_groups(data, pairs)
+
+
+def export_box_data(
+    data: dict[str, list[float]],
+    results: pl.DataFrame,
+    data_path: str,
+    stats_path: str,
+    tests_path: str,
+) -> dict[str, list[str]]:
+    """
+    Write the box plot values, their summary statistics and the test results.
+    """
+    # Conditions may differ in size, shorter columns are padded with nulls
+    columns = [pl.DataFrame({key: values}) for key, values in data.items()]
+    pl.concat(columns, how="horizontal").write_csv(data_path)
+    rows = [{"category": k} | stats.get_boxplot_stats(v) for k, v in data.items()]
+    pl.DataFrame(rows).write_csv(stats_path)
+    results.write_csv(tests_path)
+    return {"outputs": [data_path, stats_path, tests_path]}
+
+
+def draw_box(
+    data: dict[str, list[float]],
+    results: pl.DataFrame,
+    plot_name: str,
+    path: str,
+    _format: dict,
+    force=False,
+) -> dict[str, list[str]]:
+    fig = getattr(plot, plot_name)(data)
+    annotate.add_p_value_annotation(fig, results, _format=_format)
+    render.render({path: fig}, force=force)
+    return {"outputs": [path]}
+
+
+def draw_alluvial(
+    reps: pl.DataFrame, out_dir: str, force=False
+) -> dict[str, list[str]]:
+    """
+    Stacked bars of the D/ME shared and private clonotypes of every individual and
+    chain.
+    """
+    figs = {}
+    reps = cohort.filter_samples(reps, tissue=["D", "ME"])
+    for (individual, chain), part in reps.partition_by(
+        "individual", "chain", as_dict=True
+    ).items():
+        filtered = clonotype.get_clonotype_ids(cohort.to_reps(part))
+        clones = {name: df["clonotype_id"].to_list() for name, df in filtered.items()}
+        filtered = dcr.add_freq_col(filtered)
+        venn = stats.get_venn2_clones(clones)
+        filtered = dcr.filter_seq_select(venn, filtered, col="clonotype_id")
+        # Clonotype strings are only needed for the labels
+        dictionary = clonotype.get_dictionary(part)
+        filtered = {
+            name: {
+                key: clonotype.decode(tissue[key], dictionary).select(
+                    "clonotype", "frequency"
+                )
+                for key in sorted(tissue.keys(), reverse=True)
+            }
+            for name, tissue in filtered.items()
+        }
+        for overlap in filtered.keys():
+            path = f"{out_dir}/alluvial/si/{individual}_{chain}_{overlap}_alluvial.svg"
+            figs[path] = plot.stacked_bar_si(filtered[overlap])
+    render.render(figs, force=force)
+    return {"outputs": list(figs)}
+
+
+def get_box_stages(
+    name: str, data_func, data_name: str, tag: str, out_dir: str
+) -> list[Stage]:
+    """
+    Data, test, export and figure stages of the annotated box plot drawn by the
+    plot function called name.
+    """
+    return [
+        Stage(
+            f"{name}_data",
+            data_func,
+            deps=("reps",),
+            modules=(cohort, stats, diversity),
+        ),
+        Stage(
+            f"{name}_tests",
+            compare_box_data,
+            deps=(f"{name}_data",),
+            modules=(hypothesis,),
+        ),
+        Stage(
+            f"{name}_export",
+            export_box_data,
+            deps=(f"{name}_data", f"{name}_tests"),
+            params={
+                "data_path": f"{out_dir}/{data_name}_data.csv",
+                "stats_path": f"{out_dir}/{tag}_boxplot_stats.csv",
+                "tests_path": f"{out_dir}/{tag}_permutation_tests.csv",
+            },
+            modules=(stats,),
+        ),
+        Stage(
+            f"{name}_figure",
+            draw_box,
+            deps=(f"{name}_data", f"{name}_tests"),
+            params={
+                "plot_name": name,
+                "path": f"{out_dir}/{name}.svg",
+                "_format": BOX_FORMAT,
+            },
+            modules=(plot, annotate, render),
+        ),
+    ]
+
+
+def get_stages(data_dir: str, out_dir: str, expected: int | None = 64) -> list[Stage]:
+    """
+    Function which declares every manuscript figure as pipeline stages sharing one
+    load of the cohort.
+
+    ...
+
+    Parameters
+    ----------
+        data_dir: Directory of the translated Decombinator repertoires
+        out_dir: Directory the figures and tables are written to
+        expected: Number of repertoires in data_dir, 64 for the real cohort, or
+            None for however many there are, such as in a synthetic cohort
+
+    Returns
+    -------
+        The stages, to pass to pipeline.run with targets from get_targets
+    """
+    glob = "*PKD*tsv"
+    if expected is None:
+        expected = sum(f.is_file() for f in pathlib.Path(data_dir).glob(glob))
+    conditions = pathlib.Path(data_dir) / cohort.CONDITIONS_FILE
+    return [
+        Stage(
+            "reps",
+            load_cohort,
+            params={"data_dir": data_dir, "glob": glob, "expected": expected},
+            files=tuple(str(f) for f in dcr.get_rep_files(data_dir, glob, expected))
+            + tuple(str(f) for f in [conditions] if f.is_file()),
+            modules=(dcr, cohort, clonotype),
+        ),
+        *get_box_stages("tissue_box", get_tissue_box_data, "jaccard", "fig3r", out_dir),
+        *get_box_stages(
+            "expanded_box", get_expanded_box_data, "expanded", "fig3t", out_dir
+        ),
+        *get_box_stages("pc_box", get_pc_box_data, "eff_species", "si_fig5a", out_dir),
+        Stage(
+            "alluvial_figure",
+            draw_alluvial,
+            deps=("reps",),
+            params={"out_dir": out_dir},
+            modules=(clonotype, cohort, dcr, stats, plot, render),
+        ),
+    ]
+
+
+def get_targets(figure: str | None = None) -> list[str]:
+    """
+    Stages producing the files of one figure of FIGURES, or of every figure if None.
+    """
+    if figure is None:
+        return [target for targets in FIGURES.values() for target in targets]
+    return FIGURES[figure]
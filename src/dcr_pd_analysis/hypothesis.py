@@ -0,0 +1,130 @@
+"""Permutation tests and bootstrap intervals for every group comparison at once"""
+
+import itertools
+import math
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+
+def get_splits(n1: int, n2: int, n_permutations: int, rng: np.random.Generator):
+    """
+    Indices of the pooled values assigned to the first group in each permutation:
+    every split when there are at most n_permutations of them, else random ones.
+    """
+    n = n1 + n2
+    if math.comb(n, n1) <= n_permutations:
+        return np.array(list(itertools.combinations(range(n), n1))), True
+    order = rng.permuted(np.tile(np.arange(n), (n_permutations, 1)), axis=1)
+    return order[:, :n1], False
+
+
+def get_difference(
+    pooled: npt.NDArray[np.float64], first: npt.NDArray[np.int64], n1: int
+) -> npt.NDArray[np.float64]:
+    """
+    Difference in means, group 1 minus group 2, for every comparison (rows of
+    pooled) and split (rows of first) at once.
+    """
+    n2 = pooled.shape[1] - n1
+    total = pooled.sum(axis=1, keepdims=True)
+    sum1 = pooled[:, first].sum(axis=-1)
+    return sum1 / n1 - (total - sum1) / n2
+
+
+def compare_groups(
+    data: dict[str, list[float]],
+    pairs: list[list[int]],
+    n_permutations=100_000,
+    n_bootstrap=10_000,
+    alpha=0.05,
+    seed=0,
+) -> pl.DataFrame:
+    """
+    Function which runs a two-sided permutation test on the difference in means and
+    a percentile bootstrap interval for every pair of groups.
+
+    Comparisons with the same group sizes share one (comparisons x permutations)
+    array, so all of them are resampled together. With n=4 per group there are
+    only 70 splits and the test is exact.
+
+    ...
+
+    Parameters
+    ----------
+        data: Values of each group keyed by name, in plotting order; None and NaN
+            values are ignored
+        pairs: Positions of the two groups of each comparison, e.g. [[0, 1], [2, 3]]
+        n_permutations: Largest number of splits enumerated exactly, and the
+            number of random permutations used beyond it
+        n_bootstrap: Number of bootstrap resamples of each group
+        alpha: One minus the coverage of the bootstrap interval
+        seed: Seed of the random permutations and bootstrap resamples
+
+    Returns
+    -------
+        One row per pair with the group names and positions, their sizes, the
+        difference in means, the permutation p-value, its Bonferroni adjustment
+        over all pairs, the bootstrap interval and whether the test was exact
+    """
+    rng = np.random.default_rng(seed)
+    names = list(data)
+    values = [
+        np.array([v for v in data[name] if v is not None and not np.isnan(v)], float)
+        for name in names
+    ]
+    rows = [
+        {
+            "group1": names[x0],
+            "group2": names[x1],
+            "x0": x0,
+            "x1": x1,
+            "n1": len(values[x0]),
+            "n2": len(values[x1]),
+        }
+        for x0, x1 in pairs
+    ]
+    results = {}
+    sizes = sorted({(row["n1"], row["n2"]) for row in rows})
+    for n1, n2 in sizes:
+        members = [
+            i for i, row in enumerate(rows) if (row["n1"], row["n2"]) == (n1, n2)
+        ]
+        if n1 == 0 or n2 == 0:
+            for i in members:
+                results[i] = dict.fromkeys(
+                    ["difference", "p_value", "ci_lower", "ci_upper"], np.nan
+                ) | {"exact": True}
+            continue
+        pooled = np.stack(
+            [
+                np.concatenate([values[rows[i]["x0"]], values[rows[i]["x1"]]])
+                for i in members
+            ]
+        )
+        observed = get_difference(pooled, np.arange(n1)[None, :], n1)[:, 0]
+        first, exact = get_splits(n1, n2, n_permutations, rng)
+        null = get_difference(pooled, first, n1)
+        extreme = np.abs(null) >= np.abs(observed)[:, None] - 1e-12
+        if exact:
+            p_value = extreme.mean(axis=1)
+        else:
+            p_value = (extreme.sum(axis=1) + 1) / (len(first) + 1)
+
+        sample1 = rng.integers(0, n1, (n_bootstrap, n1))
+        sample2 = n1 + rng.integers(0, n2, (n_bootstrap, n2))
+        boot = pooled[:, sample1].mean(axis=-1) - pooled[:, sample2].mean(axis=-1)
+        lower, upper = np.quantile(boot, [alpha / 2, 1 - alpha / 2], axis=1)
+        for k, i in enumerate(members):
+            results[i] = {
+                "difference": observed[k],
+                "p_value": p_value[k],
+                "ci_lower": lower[k],
+                "ci_upper": upper[k],
+                "exact": exact,
+            }
+    df = pl.DataFrame([row | results[i] for i, row in enumerate(rows)])
+    return df.with_columns(
+        (pl.col("p_value") * len(pairs)).clip(upper_bound=1).alias("p_adjusted")
+    )
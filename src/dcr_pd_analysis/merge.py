@@ -1,12 +1,19 @@
 import polars as pl
 
 
-def frames(run1: pl.DataFrame, run2: pl.DataFrame) -> pl.DataFrame:
-    run1 = run1.select(["tissue", "chain", "tissue_id", "unique_molecule_count"])
+def frames(
+    run1: pl.DataFrame, run2: pl.DataFrame, count_col="unique_molecule_count"
+) -> pl.DataFrame:
+    """
+    Join run1 MiXCR counts to run2 Decombinator collapsing summaries.
+
+    Pass umi.collapse output as run1 to compare error-corrected molecule counts.
+    """
+    run1 = run1.select(["tissue", "chain", "tissue_id", count_col])
     run1 = run1.filter(pl.nth(0).is_in(["dura", "muscularis", "hindbrain", "striatum"]))
     run1 = run1.group_by("tissue", "chain", "tissue_id").agg(
-        pl.col("unique_molecule_count").sum().alias("total_transcripts"),
-        pl.col("unique_molecule_count").len().alias("unique_transcripts"),
+        pl.col(count_col).sum().alias("total_transcripts"),
+        pl.col(count_col).len().alias("unique_transcripts"),
     )
     run1 = run1.with_columns(pl.col("tissue_id").cast(pl.Int8))
     run2 = run2.select(
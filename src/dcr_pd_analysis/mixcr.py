@@ -10,108 +10,113 @@ def format_umis(element: pl.Expr) -> pl.Expr:
     return element.str.split("=").list.get(0).str.strip_chars("{").str.strip_chars("}")
 
 
-def get_results(top_dir_path: str) -> pl.DataFrame:
+def split_tag_counts(tag_counts: pl.Expr) -> pl.Expr:
     """
-    Get mixcr results
+    Previous tagCounts handling, kept as a baseline: UMIs only, as strings
+    """
+    return (
+        pl.when(tag_counts.str.contains(".*:.*"))
+        .then(tag_counts.str.split(":").list.slice(0, 1))
+        .otherwise(tag_counts.str.split(",").list.eval(format_umis(pl.element())))
+    )
+
+
+def get_umi_dtype() -> pl.DataType:
+    return pl.List(pl.Struct({"umi": pl.String, "count": pl.UInt32}))
+
+
+def parse_tag_counts(tag_counts: pl.Expr) -> pl.Expr:
+    """
+    Parse tagCounts such as {AACG=3,TTGA=1} into list[struct{umi: str, count: u32}]
+
+    The single tag UMI:count form is rewritten to UMI=count first, so both forms go
+    through one split rather than two when/then branches.
+    """
+    entries = tag_counts.str.replace(":", "=", literal=True).str.strip_chars("{}")
+    entries = entries.str.split(",").list.eval(
+        pl.element().str.split_exact("=", 1).struct.rename_fields(["umi", "count"])
+    )
+    return entries.cast(get_umi_dtype())
+
+
+def get_umi_table(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Explode the umis column of get_results into one row per clone and UMI
+    """
+    df = df.with_row_index("clone")
+    df = df.explode("umis").unnest("umis")
+    return df.drop_nulls("umi")
+
+
+def get_columns() -> list[str]:
+    return [
+        "cloneId",
+        "readCount",
+        "uniqueMoleculeCount",
+        "targetSequences",
+        "aaSeqCDR3",
+        "nSeqImputedVDJRegion",
+        "bestVHit",
+        "bestJHit",
+        "tagCounts",
+    ]
+
+
+def get_file_metadata(path: pathlib.Path) -> dict[str, str]:
+    """
+    Parse tissue, chain and tissue_id from a file name such as ME_1.clns_TRA.tsv
+    """
+    parts = path.name.split("_")
+    return {
+        "tissue": parts[0].lower(),
+        "chain": parts[-1].split(".")[0],
+        "tissue_id": parts[-2].split(".")[0],
+    }
+
+
+def scan_results(top_dir_path: str) -> pl.LazyFrame:
+    """
+    Lazily scan mixcr results
+
+    File name metadata is parsed once per file and TRD/TRG files are skipped
+    before anything is read.
     """
     p = pathlib.Path(top_dir_path).glob("data/results/*/*.clns_TR*.tsv")
     files = [p for p in p if p.is_file()]
 
-    dfs = [
-        pl.read_csv(
-            f,
-            separator="\t",
-            columns=[
-                "cloneId",
-                "readCount",
-                "uniqueMoleculeCount",
-                "targetSequences",
-                "aaSeqCDR3",
-                "nSeqImputedVDJRegion",
-                "bestVHit",
-                "bestJHit",
-                "tagCounts",
-            ],
-        ).with_columns(pl.lit(str(f)).alias("path"))
-        for f in files
-    ]
+    dfs = []
+    for f in files:
+        meta = get_file_metadata(f)
+        # if chain is TRD or TRG, drop
+        if "TRD" in meta["chain"] or "TRG" in meta["chain"]:
+            continue
+        df = pl.scan_csv(f, separator="\t").select(get_columns())
+        df = df.with_columns(pl.lit(value).alias(key) for key, value in meta.items())
+        dfs.append(df)
 
     df = pl.concat(dfs, how="vertical_relaxed")
-    df = df.with_columns(pl.col("path").str.split("/").list.last().alias("sample"))
-    df = df.with_columns(
-        pl.col("sample").str.split("_").list.get(0).str.to_lowercase().alias("tissue")
-    )
-    df = df.with_columns(
-        pl.col("sample")
-        .str.split("_")
-        .list.get(-1)
-        .str.split(".")
-        .list.get(0)
-        .alias("chain")
-    )
-    df = df.with_columns(
-        pl.col("sample")
-        .str.split("_")
-        .list.get(-2)
-        .str.split(".")
-        .list.get(0)
-        .alias("tissue_id")
-    )
-    df = df.with_columns(
-        pl.col("bestVHit").str.split("*").list.get(0).alias("bestVHit")
+    # if * or _ present within row string of CDR3, or CDR3 is missing, drop
+    df = df.filter(
+        pl.col("aaSeqCDR3").is_not_null()
+        & pl.col("aaSeqCDR3").str.contains(r"\*|_").not_()
     )
-    df = df.with_columns(
-        pl.col("bestJHit").str.split("*").list.get(0).alias("bestJHit")
-    )
-    df = df.with_columns(
-        pl.when(pl.col("tagCounts").str.contains(".*:.*"))
-        .then(pl.col("tagCounts").str.split(":").list.slice(0, 1))
-        .otherwise(
-            pl.col("tagCounts").str.split(",").list.eval(format_umis(pl.element()))
-        )
-        .alias("tagCounts")
-    )
-    df = df.drop("path", "sample")
     df = df.select(
-        [
-            "tissue",
-            "chain",
-            "tissue_id",
-            "readCount",
-            "uniqueMoleculeCount",
-            "aaSeqCDR3",
-            "bestVHit",
-            "bestJHit",
-            "nSeqImputedVDJRegion",
-            "tagCounts",
-        ]
-    )
-    # if chain is TRD or TRG, drop
-    df = df.filter(pl.col("chain").str.contains("TRD|TRG") == False)
-    df = df.rename(
-        {
-            "readCount": "read_count",
-            "uniqueMoleculeCount": "unique_molecule_count",
-            "aaSeqCDR3": "CDR3",
-            "bestVHit": "v_gene",
-            "bestJHit": "j_gene",
-            "nSeqImputedVDJRegion": "sequence",
-            "tagCounts": "umis",
-        }
-    )
-    df = df.sort(["tissue", "chain", "tissue_id"])
-
-    # if * or _ present within row string of CDR3, make whole string null
-    df = df.with_columns(
-        pl.when(pl.col("CDR3").str.contains(r"\*|_"))
-        .then(None)
-        .otherwise(pl.col("CDR3"))
-        .alias("CDR3")
-    )
-    df = df.with_columns(
-        pl.when(pl.col("CDR3").is_null()).then(0).otherwise(1).alias("CDR3_hit")
+        "tissue",
+        "chain",
+        "tissue_id",
+        pl.col("readCount").alias("read_count"),
+        pl.col("uniqueMoleculeCount").alias("unique_molecule_count"),
+        pl.col("aaSeqCDR3").alias("CDR3"),
+        pl.col("bestVHit").str.split("*").list.get(0).alias("v_gene"),
+        pl.col("bestJHit").str.split("*").list.get(0).alias("j_gene"),
+        pl.col("nSeqImputedVDJRegion").alias("sequence"),
+        parse_tag_counts(pl.col("tagCounts")).alias("umis"),
     )
-    # drop all nulls in CDR3 hit column
-    df = df.filter(pl.col("CDR3_hit") == 1)
-    df = df.drop("CDR3_hit")
-    return df
+    return df.sort(["tissue", "chain", "tissue_id"])
+
+
+def get_results(top_dir_path: str, streaming: bool = False) -> pl.DataFrame:
+    """
+    Get mixcr results
+    """
+    return scan_results(top_dir_path).collect(streaming=streaming)
@@ -0,0 +1,320 @@
+"""Indexed near-neighbour search over CDR3 and UMI strings"""
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+PAIR_SCHEMA = {"node": pl.UInt32, "node_right": pl.UInt32}
+
+
+def encode(values: pl.Series) -> npt.NDArray[np.uint8]:
+    """
+    ASCII strings as a (n, width) byte matrix, padded with zeros where shorter.
+    """
+    width = int(values.str.len_bytes().max() or 0)
+    padded = values.str.pad_end(width, "\0")
+    return np.frombuffer("".join(padded.to_list()).encode(), np.uint8).reshape(
+        len(values), width
+    )
+
+
+def get_key_pairs(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Function which pairs up every two nodes sharing an index key.
+
+    Keys are sorted once in numpy so equal keys sit next to each other; comparing
+    each key with the one offset places later then yields every pair in a group
+    of up to offset + 1 nodes. This stays close to linear because almost every
+    key group holds a single node.
+
+    ...
+
+    Parameters
+    ----------
+        df: Index entries with UInt32 node and UInt64 key columns
+
+    Returns
+    -------
+        A polars DataFrame of distinct node pairs with node < node_right
+    """
+    keys = df.get_column("key").to_numpy()
+    nodes = df.get_column("node").to_numpy()
+    order = np.argsort(keys)
+    keys, nodes = keys[order], nodes[order]
+    repeated = np.zeros(len(keys), bool)
+    repeated[1:] = keys[1:] == keys[:-1]
+    repeated[:-1] |= repeated[1:]
+    keys, nodes = keys[repeated], nodes[repeated]
+    left, right = [], []
+    offset = 1
+    while offset < len(keys):
+        same = keys[:-offset] == keys[offset:]
+        if not same.any():
+            break
+        left.append(nodes[:-offset][same])
+        right.append(nodes[offset:][same])
+        offset += 1
+    if not left:
+        return pl.DataFrame(schema=PAIR_SCHEMA)
+    left, right = np.concatenate(left), np.concatenate(right)
+    pairs = pl.DataFrame(
+        {"node": np.minimum(left, right), "node_right": np.maximum(left, right)},
+        schema=PAIR_SCHEMA,
+    )
+    return pairs.filter(pl.col("node") < pl.col("node_right")).unique()
+
+
+def get_segment_bounds(length: int, distance: int) -> list[tuple[int, int]]:
+    # Values no longer than distance are all neighbours, so they share one key
+    if length <= distance:
+        return [(0, 0)]
+    edges = np.linspace(0, length, distance + 2).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def get_segment_keys(
+    df: pl.DataFrame, col: str, by: list[str], distance: int
+) -> pl.DataFrame:
+    """
+    Function which builds the pigeonhole index for a Hamming distance search.
+
+    Each value is cut into distance + 1 segments. Two equal length values with at
+    most distance mismatches must agree exactly on at least one segment, so every
+    neighbour shares a key hashed from (by, length, segment index, segment).
+
+    ...
+
+    Parameters
+    ----------
+        df: Values to index with a UInt32 node column
+        col: String column to search
+        by: Columns both values of a pair must share
+        distance: Maximum Hamming distance
+
+    Returns
+    -------
+        A polars DataFrame of node and UInt64 key, one row per segment
+    """
+    df = df.with_columns(pl.col(col).str.len_bytes().alias("length"))
+    keys = []
+    for (length,), part in df.partition_by("length", as_dict=True).items():
+        for i, (start, end) in enumerate(get_segment_bounds(length, distance)):
+            segment = pl.col(col).str.slice(start, end - start)
+            key = pl.struct(*by, "length", pl.lit(i).alias("index"), segment)
+            keys.append(part.select("node", key.hash().alias("key")))
+    if not keys:
+        return pl.DataFrame(schema={"node": pl.UInt32, "key": pl.UInt64})
+    return pl.concat(keys)
+
+
+def get_deletion_keys(
+    df: pl.DataFrame, col: str, by: list[str], distance: int
+) -> pl.DataFrame:
+    """
+    Function which builds the symmetric deletion index for an edit distance search.
+
+    Two values within distance edits share a string reached by at most distance
+    deletions from each, so every neighbour shares a key hashed from (by,
+    variant). Deletions are applied at non-decreasing positions so each set of
+    positions is generated once. Lengths are grouped implicitly, as variants of
+    values more than distance apart in length never meet.
+
+    ...
+
+    Parameters
+    ----------
+        df: Values to index with a UInt32 node column
+        col: String column to search
+        by: Columns both values of a pair must share
+        distance: Maximum Levenshtein distance
+
+    Returns
+    -------
+        A polars DataFrame of node and UInt64 key, one row per deletion variant
+    """
+    key = pl.struct(*by, "variant").hash().alias("key")
+    frontier = df.select("node", *by, pl.col(col).alias("variant"), last=pl.lit(0))
+    keys = [frontier.select("node", key)]
+    for _ in range(distance):
+        longest = frontier.get_column("variant").str.len_chars().max() or 0
+        variant = pl.col("variant")
+        frontier = pl.concat(
+            [
+                frontier.filter(
+                    (variant.str.len_chars() > i) & (pl.col("last") <= i)
+                ).select(
+                    "node",
+                    *by,
+                    variant.str.head(i) + variant.str.slice(i + 1),
+                    last=pl.lit(i),
+                )
+                for i in range(longest)
+            ]
+        )
+        keys.append(frontier.select("node", key))
+    return pl.concat(keys)
+
+
+def get_hamming(
+    codes: npt.NDArray[np.uint8],
+    left: npt.NDArray[np.uint32],
+    right: npt.NDArray[np.uint32],
+    block_size=2**20,
+) -> npt.NDArray[np.int64]:
+    distances = np.empty(len(left), np.int64)
+    for start in range(0, len(left), block_size):
+        block = slice(start, start + block_size)
+        distances[block] = np.count_nonzero(
+            codes[left[block]] != codes[right[block]], axis=1
+        )
+    return distances
+
+
+def get_levenshtein(
+    codes: npt.NDArray[np.uint8],
+    lengths: npt.NDArray[np.int64],
+    left: npt.NDArray[np.uint32],
+    right: npt.NDArray[np.uint32],
+    block_size=2**16,
+) -> npt.NDArray[np.int64]:
+    """
+    Edit distance of each pair, running the dynamic programme across a block of
+    pairs at once rather than pair by pair.
+    """
+    width = codes.shape[1]
+    distances = np.empty(len(left), np.int64)
+    for start in range(0, len(left), block_size):
+        block = slice(start, start + block_size)
+        a, b = codes[left[block]], codes[right[block]]
+        len_a, len_b = lengths[left[block]], lengths[right[block]]
+        n = len(a)
+        prev = np.broadcast_to(np.arange(width + 1, dtype=np.int16), (n, width + 1))
+        out = len_b.copy()
+        for i in range(1, width + 1):
+            cur = np.empty((n, width + 1), np.int16)
+            cur[:, 0] = i
+            best = np.minimum(prev[:, :-1] + (a[:, i - 1, None] != b), prev[:, 1:] + 1)
+            for j in range(1, width + 1):
+                cur[:, j] = np.minimum(best[:, j - 1], cur[:, j - 1] + 1)
+            done = len_a == i
+            out[done] = cur[done, len_b[done]]
+            prev = cur
+        distances[block] = out
+    return distances
+
+
+def get_pairs(
+    df: pl.DataFrame,
+    col="junction_aa",
+    by: list[str] | None = None,
+    distance=1,
+    metric="levenshtein",
+) -> pl.DataFrame:
+    """
+    Function which finds every pair of rows whose values lie within distance.
+
+    Candidates come from the get_deletion_keys or get_segment_keys index and are
+    then verified exactly, so the result matches an all pairs comparison without
+    its quadratic cost. Hash collisions can only add candidates, never lose one.
+
+    ...
+
+    Parameters
+    ----------
+        df: Rows to search, typically distinct (junction_aa, v_call) pairs
+        col: String column to compare
+        by: Columns both rows of a pair must share, defaults to v_call
+        distance: Maximum distance between the values of a pair
+        metric: Either "levenshtein" or "hamming"
+
+    Returns
+    -------
+        One row per pair with the row indices node < node_right and the distance,
+        rows with a null in col or by never pair
+    """
+    if by is None:
+        by = ["v_call"]
+    if metric not in ("levenshtein", "hamming"):
+        raise ValueError(f"Unknown metric {metric}, use levenshtein or hamming")
+    df = df.select(*by, col).with_row_index("node")
+    values = df.get_column(col).fill_null("")
+    df = df.drop_nulls()
+    if distance < 1 or df.is_empty():
+        return pl.DataFrame(schema=PAIR_SCHEMA | {"distance": pl.Int64})
+    if metric == "hamming":
+        pairs = get_key_pairs(get_segment_keys(df, col, by, distance))
+    else:
+        pairs = get_key_pairs(get_deletion_keys(df, col, by, distance))
+    left = pairs["node"].to_numpy()
+    right = pairs["node_right"].to_numpy()
+    codes = encode(values)
+    if metric == "hamming":
+        found = get_hamming(codes, left, right)
+    else:
+        lengths = values.str.len_bytes().to_numpy().astype(np.int64)
+        found = get_levenshtein(codes, lengths, left, right)
+    pairs = pairs.with_columns(pl.Series("distance", found))
+    return pairs.filter(pl.col("distance") <= distance).sort("node", "node_right")
+
+
+def get_neighbours(
+    reps: list[tuple[str, pl.DataFrame]],
+    col="junction_aa",
+    by: list[str] | None = None,
+    distance=1,
+    metric="levenshtein",
+) -> pl.DataFrame:
+    """
+    Function which finds every pair of values within distance across samples.
+
+    Distinct values are indexed once for the whole cohort, so the search costs the
+    same whether 2 or 64 samples are compared. Identical values are returned with
+    distance 0.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires to compare
+        col: String column to compare
+        by: Columns both values of a pair must share, defaults to v_call
+        distance: Maximum distance between the values of a pair
+        metric: Either "levenshtein" or "hamming"
+
+    Returns
+    -------
+        One row per (sample, value, sample_right, value_right) with sample !=
+        sample_right, in both directions, plus the by columns and the distance
+    """
+    if by is None:
+        by = ["v_call"]
+    members = pl.concat(
+        [
+            df.select(pl.lit(name).alias("sample"), *by, col).drop_nulls().unique()
+            for name, df in reps
+        ]
+    )
+    values = members.select(*by, col).unique().sort(by + [col])
+    values = values.with_row_index("node")
+    pairs = get_pairs(values, col, by, distance, metric)
+    nodes = values.select(pl.col("node"), pl.col("node").alias("node_right"))
+    pairs = pl.concat(
+        [
+            nodes.with_columns(pl.lit(0, pl.Int64).alias("distance")),
+            pairs,
+            pairs.select(
+                pl.col("node_right").alias("node"),
+                pl.col("node").alias("node_right"),
+                "distance",
+            ),
+        ]
+    )
+    members = members.join(values, on=by + [col])
+    pairs = pairs.join(members, on="node").join(
+        members.select("sample", col, "node"),
+        left_on="node_right",
+        right_on="node",
+        suffix="_right",
+    )
+    pairs = pairs.filter(pl.col("sample") != pl.col("sample_right"))
+    return pairs.select("sample", col, "sample_right", f"{col}_right", *by, "distance")
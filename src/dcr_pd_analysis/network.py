@@ -0,0 +1,199 @@
+"""Clonotype similarity network and clusters spanning the cohort"""
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from dcr_pd_analysis import neighbours
+
+
+def get_nodes(cohort: pl.DataFrame, col="clonotype") -> pl.DataFrame:
+    """
+    Distinct clonotypes of a cohort.get_clonotypes table, split back into
+    junction_aa, v_call and j_call, with a node index.
+    """
+    nodes = cohort.select(col).unique().sort(col)
+    parts = pl.col(col).str.split(" ")
+    nodes = nodes.with_columns(
+        parts.list.get(0).alias("junction_aa"),
+        parts.list.get(1).alias("v_call"),
+        parts.list.get(2).alias("j_call"),
+    )
+    return nodes.with_row_index("node")
+
+
+def get_edges(
+    nodes: pl.DataFrame,
+    col="junction_aa",
+    by: list[str] | None = None,
+    distance=1,
+    metric="levenshtein",
+    max_workers=1,
+) -> pl.DataFrame:
+    """
+    Function which finds every edge of the clonotype graph.
+
+    Edges never cross the by groups, so each group is searched on its own. This
+    bounds the index held in memory to the groups in flight, and the groups run
+    in a thread pool as the search spends its time in polars and numpy.
+
+    ...
+
+    Parameters
+    ----------
+        nodes: Output of get_nodes
+        col: String column to compare
+        by: Columns both ends of an edge must share, defaults to v_call
+        distance: Maximum distance between the ends of an edge
+        metric: Either "levenshtein" or "hamming", see neighbours.get_pairs
+        max_workers: Number of groups searched at once
+
+    Returns
+    -------
+        One row per edge with node < node_right and the distance
+    """
+    if by is None:
+        by = ["v_call"]
+    groups = nodes.partition_by(by) if by else [nodes]
+
+    def search(group: pl.DataFrame) -> pl.DataFrame:
+        pairs = neighbours.get_pairs(group, col, by, distance, metric)
+        lookup = group.get_column("node")
+        return pairs.with_columns(
+            pl.col("node").map_batches(lookup.gather),
+            pl.col("node_right").map_batches(lookup.gather),
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        edges = list(executor.map(search, groups))
+    if not edges:
+        return pl.DataFrame(schema=neighbours.PAIR_SCHEMA | {"distance": pl.Int64})
+    return pl.concat(edges).sort("node", "node_right")
+
+
+def get_graph(edges: pl.DataFrame, n: int) -> sp.csr_array:
+    """
+    Symmetric sparse adjacency matrix of n nodes, weighted by distance + 1 so edges
+    between identical CDR3s are kept.
+    """
+    left = edges.get_column("node").to_numpy()
+    right = edges.get_column("node_right").to_numpy()
+    weights = edges.get_column("distance").to_numpy() + 1
+    graph = sp.coo_array(
+        (
+            np.concatenate([weights, weights]),
+            (np.concatenate([left, right]), np.concatenate([right, left])),
+        ),
+        shape=(n, n),
+    )
+    return graph.tocsr()
+
+
+def get_leiden_labels(
+    edges: pl.DataFrame, n: int, resolution: float, seed: int
+) -> np.ndarray:
+    try:
+        import igraph
+    except ImportError as e:
+        raise ImportError(
+            "Leiden clustering needs python-igraph, use method='components' without it"
+        ) from e
+    graph = igraph.Graph(n=n, edges=edges.select("node", "node_right").rows())
+    # Closer neighbours weigh more, with the weights of get_graph reversed
+    weights = (1 / (edges.get_column("distance") + 1)).to_list()
+    igraph.set_random_number_generator(random.Random(seed))
+    partition = graph.community_leiden(
+        objective_function="modularity", weights=weights, resolution=resolution
+    )
+    return np.asarray(partition.membership)
+
+
+def get_clusters(
+    nodes: pl.DataFrame,
+    edges: pl.DataFrame,
+    method="components",
+    resolution=1.0,
+    seed=0,
+) -> pl.DataFrame:
+    """
+    Function which groups the clonotype graph into clusters.
+
+    ...
+
+    Parameters
+    ----------
+        nodes: Output of get_nodes
+        edges: Output of get_edges
+        method: "components" for connected components, or "leiden" for Leiden
+            communities, which requires python-igraph
+        resolution: Leiden modularity resolution
+        seed: Leiden random seed
+
+    Returns
+    -------
+        The nodes table with a cluster column, numbered from the largest cluster
+    """
+    n = nodes.height
+    if method == "components":
+        _, labels = csgraph.connected_components(get_graph(edges, n), directed=False)
+    elif method == "leiden":
+        labels = get_leiden_labels(edges, n, resolution, seed)
+    else:
+        raise ValueError(f"Unknown method {method}, use components or leiden")
+    nodes = nodes.with_columns(pl.Series("cluster", labels, pl.UInt32))
+    size = pl.len().over("cluster")
+    order = nodes.select("cluster", size.alias("size")).unique()
+    order = order.sort(["size", "cluster"], descending=[True, False])
+    order = order.with_row_index("rank").select("cluster", "rank")
+    nodes = nodes.join(order, on="cluster", how="left")
+    return nodes.with_columns(pl.col("rank").alias("cluster")).drop("rank")
+
+
+def get_composition(
+    cohort: pl.DataFrame, clusters: pl.DataFrame, col="clonotype", min_size=2
+) -> pl.DataFrame:
+    """
+    Function which reports where in the cohort each cluster is found.
+
+    ...
+
+    Parameters
+    ----------
+        cohort: The cohort.get_clonotypes table the graph was built from
+        clusters: Output of get_clusters
+        col: Column identifying a clonotype
+        min_size: Smallest number of clonotypes for a cluster to be reported
+
+    Returns
+    -------
+        One row per cluster with its clonotype, sample and individual counts, the
+        summed duplicate_count, the number of clonotype occurrences in each tissue
+        and condition as tissue_<code> and condition_<code> columns, and the
+        fraction of occurrences from PD individuals
+    """
+    members = cohort.join(clusters.select(col, "cluster"), on=col)
+    summary = members.group_by("cluster").agg(
+        pl.col(col).n_unique().alias("clonotypes"),
+        pl.col("sample").n_unique().alias("samples"),
+        pl.col("individual").n_unique().alias("individuals"),
+        pl.col("duplicate_count").sum().alias("duplicate_count"),
+    )
+    summary = summary.filter(pl.col("clonotypes") >= min_size)
+    for meta in ["tissue", "condition"]:
+        counts = members.group_by("cluster", meta).agg(pl.len().alias("occurrences"))
+        counts = counts.with_columns(
+            pl.concat_str(pl.lit(f"{meta}_"), pl.col(meta).cast(pl.String)).alias(meta)
+        )
+        wide = counts.pivot(meta, index="cluster", values="occurrences")
+        summary = summary.join(wide, on="cluster", how="left")
+    summary = summary.fill_null(0)
+    occurrences = pl.sum_horizontal(pl.col("^condition_.*$"))
+    if "condition_PD" in summary.columns:
+        summary = summary.with_columns(
+            (pl.col("condition_PD") / occurrences).alias("pd_fraction")
+        )
+    return summary.sort("cluster")
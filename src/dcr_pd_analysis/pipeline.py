@@ -0,0 +1,265 @@
+"""Incremental stage runner with a content-addressed artifact store"""
+
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import time
+import types
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+
+from dcr_pd_analysis import cache
+
+
+@dataclasses.dataclass(frozen=True)
+class Stage:
+    """
+    One step of a pipeline: func is called with the results of deps in order,
+    followed by params as keyword arguments. A func taking a force argument is
+    also passed the force of the run, which is not part of the key.
+
+    files are fingerprinted into the key, as is the source of func and of every
+    module in modules, so editing plot styling only invalidates the stages that
+    list the plot module.
+    """
+
+    name: str
+    func: Callable
+    deps: tuple[str, ...] = ()
+    params: dict = dataclasses.field(default_factory=dict)
+    files: tuple[str, ...] = ()
+    modules: tuple[types.ModuleType, ...] = ()
+
+
+def get_artifact_dir() -> pathlib.Path:
+    return cache.get_cache_dir() / "artifacts"
+
+
+def get_code_hash(stage: Stage) -> str:
+    """
+    Hash of the source of func, of the functions of its own module it calls by
+    name, and of the modules listed on the stage.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(inspect.getsource(stage.func).encode())
+    module = inspect.getmodule(stage.func)
+    for name in stage.func.__code__.co_names:
+        helper = getattr(module, name, None)
+        if inspect.isfunction(helper) and helper.__module__ == module.__name__:
+            digest.update(inspect.getsource(helper).encode())
+    for module in stage.modules:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+def get_key(stage: Stage, dep_keys: list[str]) -> str:
+    """
+    Function which hashes everything a stage's result depends on.
+
+    ...
+
+    Parameters
+    ----------
+        stage: Stage to key
+        dep_keys: Keys of the stage's deps, in order
+
+    Returns
+    -------
+        A hex string that changes whenever the code, params, input files or any
+        upstream stage change
+    """
+    parts = {
+        "name": stage.name,
+        "code": get_code_hash(stage),
+        "params": stage.params,
+        "files": [cache.fingerprint(f) for f in stage.files],
+        "deps": dep_keys,
+    }
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def find(artifact_dir: pathlib.Path, name: str, key: str) -> pathlib.Path | None:
+    for path in artifact_dir.glob(f"{name}-{key}.*"):
+        if not path.name.endswith(".tmp"):
+            return path
+    return None
+
+
+def save(artifact_dir: pathlib.Path, name: str, key: str, result) -> pathlib.Path:
+    """
+    Store a result as Parquet (DataFrame), .npy (array), .npz (dict of arrays) or
+    JSON (anything else), replacing older artifacts of the same stage.
+    """
+    if isinstance(result, pl.DataFrame):
+        suffix, write = "parquet", lambda f: result.write_parquet(f)
+    elif isinstance(result, np.ndarray):
+        suffix, write = "npy", lambda f: np.save(f, result)
+    elif (
+        isinstance(result, dict)
+        and result
+        and all(isinstance(v, np.ndarray) for v in result.values())
+    ):
+        suffix, write = "npz", lambda f: np.savez(f, **result)
+    else:
+        suffix, write = "json", lambda f: f.write(json.dumps(result).encode())
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    path = artifact_dir / f"{name}-{key}.{suffix}"
+    tmp = artifact_dir / f"{name}-{key}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    for stale in artifact_dir.glob(f"{name}-*"):
+        if not stale.name.endswith(".tmp"):
+            stale.unlink(missing_ok=True)
+    os.replace(tmp, path)
+    return path
+
+
+def load(path: pathlib.Path):
+    if path.suffix == ".parquet":
+        return pl.read_parquet(path)
+    if path.suffix == ".npy":
+        return np.load(path)
+    if path.suffix == ".npz":
+        with np.load(path) as saved:
+            return dict(saved)
+    return json.loads(path.read_text())
+
+
+def is_fresh(path: pathlib.Path | None) -> bool:
+    """
+    An artifact is fresh if it exists and, when it is a JSON {"outputs": paths}
+    record of written files, those files still exist too.
+    """
+    if path is None:
+        return False
+    if path.suffix == ".json":
+        result = load(path)
+        if isinstance(result, dict) and "outputs" in result:
+            return all(pathlib.Path(f).is_file() for f in result["outputs"])
+    return True
+
+
+def run(
+    stages: list[Stage],
+    targets: list[str] | None = None,
+    artifact_dir: str | pathlib.Path | None = None,
+    force=False,
+    max_workers=1,
+) -> pl.DataFrame:
+    """
+    Function which brings the target stages up to date, re-running only stale ones.
+
+    Keys are computed for every stage the targets need. A stage runs when no
+    artifact holds its key; fresh upstream artifacts are only read when a stale
+    stage needs their result, so an up to date pipeline reads nothing.
+
+    Stages that write files, such as figures, should return {"outputs": [paths]}
+    so deleting an output also marks the stage stale.
+
+    ...
+
+    Parameters
+    ----------
+        stages: Every stage, deps referring to other stages by name
+        targets: Names of the stages to bring up to date, defaults to all
+        artifact_dir: Artifact store, defaults to get_artifact_dir()
+        force: Re-run every needed stage regardless of its artifact, passed on
+            to stages taking a force argument such as figure renders
+        max_workers: Number of stale stages run at once; stages only start once
+            every stage of the previous dependency level has finished
+
+    Returns
+    -------
+        One row per needed stage with its key, whether it ran or was cached, and
+        the seconds it took
+    """
+    root = pathlib.Path(artifact_dir) if artifact_dir else get_artifact_dir()
+    by_name = {stage.name: stage for stage in stages}
+    if targets is None:
+        targets = list(by_name)
+
+    keys = {}
+
+    def get_stage_key(name: str, path=()) -> str:
+        if name in path:
+            raise ValueError(f"Cycle in pipeline: {' -> '.join(path + (name,))}")
+        if name not in keys:
+            stage = by_name[name]
+            dep_keys = [get_stage_key(dep, path + (name,)) for dep in stage.deps]
+            keys[name] = get_key(stage, dep_keys)
+        return keys[name]
+
+    for target in targets:
+        get_stage_key(target)
+
+    # Keys were filled depth first, so every stage comes after its deps
+    levels = {}
+    for name in keys:
+        levels[name] = max((levels[dep] + 1 for dep in by_name[name].deps), default=0)
+
+    results = {}
+    report = []
+
+    def get_result(name: str):
+        if name not in results:
+            results[name] = load(find(root, name, keys[name]))
+        return results[name]
+
+    def execute(stage: Stage, args: list):
+        start = time.perf_counter()
+        params = stage.params
+        if "force" in inspect.signature(stage.func).parameters:
+            params = params | {"force": force}
+        result = stage.func(*args, **params)
+        seconds = time.perf_counter() - start
+        path = save(root, stage.name, keys[stage.name], result)
+        return result, path, seconds
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for level in range(max(levels.values(), default=-1) + 1):
+            futures = {}
+            for name in [name for name in keys if levels[name] == level]:
+                key = keys[name]
+                if not force and is_fresh(find(root, name, key)):
+                    report.append(
+                        {"stage": name, "key": key, "status": "cached", "seconds": 0.0}
+                    )
+                    continue
+                stage = by_name[name]
+                # Stages of a level may share a dep. Writers such as write_csv
+                # mutably borrow the DataFrame, so a concurrent read of the same
+                # object raises "Already borrowed"; clones share the buffers
+                args = [
+                    arg.clone() if isinstance(arg, pl.DataFrame) else arg
+                    for arg in map(get_result, stage.deps)
+                ]
+                futures[name] = executor.submit(execute, stage, args)
+            for name, future in futures.items():
+                result, path, seconds = future.result()
+                # JSON results are reloaded so downstream stages see the same types
+                # whether this stage ran now or on an earlier run
+                results[name] = load(path) if path.suffix == ".json" else result
+                report.append(
+                    {
+                        "stage": name,
+                        "key": keys[name],
+                        "status": "ran",
+                        "seconds": seconds,
+                    }
+                )
+    return pl.DataFrame(
+        report,
+        schema={
+            "stage": pl.String,
+            "key": pl.String,
+            "status": pl.String,
+            "seconds": pl.Float64,
+        },
+    )
@@ -1,6 +1,6 @@
 """Plotting functions"""
 
-from collections.abc import Callable
+import warnings
 from typing import Any
 
 import numpy as np
@@ -11,6 +11,11 @@ import polars as pl
 from plotly.basedatatypes import BaseTraceType
 from plotly.subplots import make_subplots
 
+from dcr_pd_analysis import aggregate
+
+MAX_ELEMENTS = 5000
+MAX_ELEMENTS_BINS = 6
+
 
 def scatter(data: pl.DataFrame, feature: str) -> go.Figure:
     fig = go.Figure()
@@ -296,37 +301,133 @@ def venn3(data: dict[str, int], left: str, right: str, bot: str) -> go.Figure:
     return fig
 
 
-def get_bars(df: pl.DataFrame, x: list[str]) -> list[go.Bar]:
+def get_stack(
+    df: pl.DataFrame, n_regions: int
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Heights and bases of every row stacked in order over the last n_regions
+    columns, as (rows, regions) arrays.
+    """
+    y = df[:, -n_regions:].to_numpy().astype(float)
+    return y, np.cumsum(y, axis=0) - y
+
+
+def get_bars(
+    df: pl.DataFrame, x: list[str], colors: list[str] | None = None, **kwargs
+) -> list[go.Bar]:
+    """
+    One bar trace stacking every row of df, the first column naming each row,
+    with the stacking offsets passed as base and one colour per bar.
+    """
     n_regions = len(x)
-    bars = []
-    for row in df.iter_rows():
-        bar = go.Bar(
-            name=row[0],
-            x=x,
-            y=[float(i) for i in row[-n_regions:]],
-        )
-        bars.append(bar)
-    return bars
-
-
-def get_trace(
-    df: pl.DataFrame, x: list[str], colors: list[str], trace: Callable, **kwargs
-) -> list[BaseTraceType]:
+    y, base = get_stack(df, n_regions)
+    if colors is None:
+        colors = co.qualitative.Plotly
+    marker_color = [colors[i % len(colors)] for i in range(len(df))]
+    bar = go.Bar(
+        x=np.tile(x, len(df)),
+        y=y.ravel(),
+        base=base.ravel(),
+        marker_color=np.repeat(marker_color, n_regions),
+        hovertext=np.repeat(df[:, 0].cast(pl.String).to_numpy(), n_regions),
+        showlegend=False,
+        **kwargs,
+    )
+    return [bar]
+
+
+def get_fill_color(color: str, alpha=0.5) -> str:
+    """
+    Translucent version of a palette colour, by default the half-transparent fill
+    plotly gives stacked areas.
+    """
+    rgb = co.convert_colors_to_same_type(color, "rgb")[0][0]
+    red, green, blue = co.unlabel_rgb(rgb)
+    return f"rgba({red:g}, {green:g}, {blue:g}, {alpha})"
+
+
+def get_bands(
+    df: pl.DataFrame, x: list[str], colors: list[str], **kwargs
+) -> list[go.Scatter]:
+    """
+    Filled bands joining the stacked bars of each row, one scatter trace per
+    colour with the bands of its rows separated by None. Bands are filled at half
+    opacity like the stacked area traces they replace, whose spline edges are
+    straight between the two regions of a stacked bar.
+    """
     n_regions = len(x)
+    y, base = get_stack(df, n_regions)
+    index = np.arange(len(df))
     traces = []
-    for index, row in enumerate(df.iter_rows()):
-        traced = trace(
-            name=row[0],
-            x=x,
-            y=[float(i) for i in row[-n_regions:]],
-            marker_color=colors[index],
-            **kwargs,
+    for i, color in enumerate(colors):
+        rows = index[index % len(colors) == i]
+        if not len(rows):
+            break
+        # Along the top edge, back along the bottom, then a gap
+        xs = np.concatenate([x, x[::-1], [None]])
+        ys = np.concatenate(
+            [(base + y)[rows], base[rows, ::-1], np.full((len(rows), 1), None)],
+            axis=1,
+        )
+        traces.append(
+            go.Scatter(
+                x=np.tile(xs, len(rows)),
+                y=ys.ravel(),
+                fill="toself",
+                fillcolor=get_fill_color(color),
+                mode="lines",
+                line=dict(color=color),
+                hoverinfo="skip",
+                showlegend=False,
+                **kwargs,
+            )
         )
-        traces.append(traced)
     return traces
 
 
-def stacked_bar(data: dict[str, pl.DataFrame]) -> go.Figure:
+def get_legend(
+    df: pl.DataFrame, colors: list[str], max_entries=10, **kwargs
+) -> list[go.Bar]:
+    """
+    Empty traces giving legend entries to the first max_entries rows only.
+    """
+    names = df[:max_entries, 0].cast(pl.String).to_list()
+    return [
+        go.Bar(name=name, x=[None], y=[None], marker_color=colors[i % len(colors)])
+        for i, name in enumerate(names)
+    ]
+
+
+def get_stacked_bar_traces(
+    df: pl.DataFrame, x: list[str], colors: list[str], max_legend=10
+) -> list[BaseTraceType]:
+    """
+    Function which draws stacked bars of every row of df joined by bands.
+
+    The rows become a fixed number of traces, one bar trace holding every bar
+    and one band trace per colour, so figure size grows with the rows but the
+    trace count does not.
+
+    ...
+
+    Parameters
+    ----------
+        df: One row per clonotype, named by the first column, with its
+            frequency in each region in the last len(x) columns
+        x: Region labels
+        colors: Palette cycled over the rows
+        max_legend: Number of leading rows given a legend entry
+
+    Returns
+    -------
+        The band, bar and legend traces in drawing order
+    """
+    bands = get_bands(df, x, colors, line_width=0.1)
+    bars = get_bars(df, x, colors)
+    return bands + bars + get_legend(df, colors, max_legend)
+
+
+def stacked_bar(data: dict[str, pl.DataFrame], top: int | None = 10) -> go.Figure:
     x = list(data.keys())
     fmt_x = [
         f"{i.split("_")[2][:-1]} {i.split("_")[2][-1]} {i.split("_")[-1][0].capitalize()}"
@@ -336,23 +437,12 @@ def stacked_bar(data: dict[str, pl.DataFrame]) -> go.Figure:
     colors = co.qualitative.Plotly
     df = data[x[0]].join(other=data[x[1]], on="clonotype")
     df = df.sort(["frequency", "frequency_right"], descending=True)
-    df = df.head(10)
+    if top is not None:
+        df = df.head(top)
     print(fmt_x, df)
-    bars = get_trace(df, fmt_x, colors, go.Bar, offsetgroup=1)
-    scatters = get_trace(
-        df,
-        fmt_x,
-        colors,
-        go.Scatter,
-        stackgroup="one",
-        showlegend=False,
-        line_shape="spline",
-        offsetgroup=2,
-        line_width=0.1,
-    )
-    fig = go.Figure(data=scatters + bars)
+    fig = go.Figure(data=get_stacked_bar_traces(df, fmt_x, colors))
     fig.update_layout(
-        barmode="stack",
+        barmode="overlay",
         showlegend=True,
         yaxis=dict(title=dict(text="Clonotype molecule frequency")),
         margin=dict(l=30, r=30, t=30, b=30),
@@ -360,7 +450,7 @@ def stacked_bar(data: dict[str, pl.DataFrame]) -> go.Figure:
     return fig
 
 
-def stacked_bar_si(data: dict[str, pl.DataFrame]) -> go.Figure:
+def stacked_bar_si(data: dict[str, pl.DataFrame], top: int | None = 10) -> go.Figure:
     x = list(data.keys())
     fmt_x = [
         f"{i.split("_")[2][:-1]} {i.split("_")[2][-1]} {i.split("_")[-1][0].capitalize()}"
@@ -370,23 +460,12 @@ def stacked_bar_si(data: dict[str, pl.DataFrame]) -> go.Figure:
     colors = co.qualitative.Plotly
     df = data[x[0]].join(other=data[x[1]], on="clonotype")
     df = df.sort(["frequency", "frequency_right"], descending=True)
-    df = df.head(10)
+    if top is not None:
+        df = df.head(top)
     print(fmt_x, df)
-    bars = get_trace(df, fmt_x, colors, go.Bar, offsetgroup=1)
-    scatters = get_trace(
-        df,
-        fmt_x,
-        colors,
-        go.Scatter,
-        stackgroup="one",
-        showlegend=False,
-        line_shape="spline",
-        offsetgroup=2,
-        line_width=0.1,
-    )
-    fig = go.Figure(data=scatters + bars)
+    fig = go.Figure(data=get_stacked_bar_traces(df, fmt_x, colors))
     fig.update_layout(
-        barmode="stack",
+        barmode="overlay",
         showlegend=True,
         yaxis=dict(title=dict(text="Clonotype molecule frequency")),
         margin=dict(l=30, r=30, t=30, b=30),
@@ -399,7 +478,19 @@ def stacked_bar_si(data: dict[str, pl.DataFrame]) -> go.Figure:
     return fig
 
 
-def alluvial(data: dict[str, pl.DataFrame]) -> go.Figure:
+def alluvial(
+    data: dict[str, pl.DataFrame], top: int | None = None, bins: int | None = None
+) -> go.Figure:
+    """
+    Parallel categories of the frequencies of the clonotypes shared by two
+    regions.
+
+    top keeps the most frequent clonotypes and merges the rest into one "other"
+    category. bins replaces the frequencies by that many log-spaced ranges, each
+    ribbon then counting the clonotypes moving between two ranges. With neither,
+    more than MAX_ELEMENTS shared clonotypes are binned into MAX_ELEMENTS_BINS
+    ranges.
+    """
     x = list(data.keys())
     assert len(x) == 2
     df = data[x[0]].join(other=data[x[1]], on=["junction_aa", "v_call", "j_call"])
@@ -409,18 +500,43 @@ def alluvial(data: dict[str, pl.DataFrame]) -> go.Figure:
         )
     )
     df = df.drop(["junction_aa", "v_call", "j_call"])
-    print(df)
-
-    region1_dim = go.parcats.Dimension(values=df["frequency"], label=x[0])
-    region2_dim = go.parcats.Dimension(values=df["frequency_right"], label=x[1])
-
-    color = df["clonotype"]
-    colorscale = co.sequential.Viridis
+    freq_cols = ["frequency", "frequency_right"]
+    if top is None and bins is None and df.height > MAX_ELEMENTS:
+        warnings.warn(
+            f"Binning the frequencies of {df.height} clonotypes into "
+            f"{MAX_ELEMENTS_BINS} ranges"
+        )
+        bins = MAX_ELEMENTS_BINS
+    df = df.with_columns(pl.lit(1, pl.UInt32).alias("count"))
+    order = {}
+    if top is not None:
+        keep = aggregate.get_top_values(df, "clonotype", freq_cols, top)
+        df = aggregate.collapse_tail(df, "clonotype", freq_cols + ["count"], keep)
+        # The merged tail is its own category rather than a summed frequency
+        other = df.filter(pl.col("clonotype") == "other")
+        other = other.with_columns(pl.lit("other").alias(col) for col in freq_cols)
+        df = df.filter(pl.col("clonotype") != "other")
+        if bins is None:
+            df = df.with_columns(pl.col(freq_cols).cast(pl.String))
+    if bins is not None:
+        df, labels = aggregate.bin_frequency(df, freq_cols, bins)
+        categories = labels + (["other"] if top is not None else [])
+        order = dict(categoryorder="array", categoryarray=categories)
+    if top is not None:
+        df = pl.concat([df, other])
+    if bins is not None:
+        df = df.group_by(freq_cols, maintain_order=True).agg(pl.col("count").sum())
+
+    region1_dim = go.parcats.Dimension(values=df["frequency"], label=x[0], **order)
+    region2_dim = go.parcats.Dimension(
+        values=df["frequency_right"], label=x[1], **order
+    )
 
     fig = go.Figure(
         data=[
             go.Parcats(
                 dimensions=[region1_dim, region2_dim],
+                counts=df["count"],
                 # line={"color": color, "colorscale": colorscale, "shape": "hspline"},
             )
         ]
@@ -429,7 +545,20 @@ def alluvial(data: dict[str, pl.DataFrame]) -> go.Figure:
     return fig
 
 
-def vregions(overlap: dict[str, pl.DataFrame], background: pl.DataFrame) -> go.Figure:
+def vregions(
+    overlap: dict[str, pl.DataFrame], background: pl.DataFrame, top: int | None = None
+) -> go.Figure:
+    """
+    V gene usage of each overlap against the background. top keeps the V genes
+    most used in the background and merges the others into one other bar.
+    """
+    if top is not None:
+        keep = aggregate.get_top_values(background, "v_call", ["frequency"], top)
+        background = aggregate.collapse_tail(background, "v_call", ["frequency"], keep)
+        overlap = {
+            name: aggregate.collapse_tail(df, "v_call", ["frequency"], keep)
+            for name, df in overlap.items()
+        }
     PLOTS = 3
     SIZE = 8
     fig = go.Figure()
@@ -1,154 +1,73 @@
-import numpy as np
-import scipy.stats as stats
+import plotly.graph_objects as go
+import polars as pl
+
+
+def add_bracket(
+    fig: go.Figure,
+    x0: float,
+    x1: float,
+    y_range: tuple[float, float],
+    subplot_str: str,
+    _format: dict,
+) -> go.Figure:
+    """Draws a bracket from x0 to x1 spanning y_range in the subplot's y domain"""
+    line = dict(color=_format["color"], width=_format["width"])
+    y0, y1 = y_range
+    for xa, ya, xb, yb in [(x0, y0, x0, y1), (x0, y1, x1, y1), (x1, y0, x1, y1)]:
+        fig.add_shape(
+            type="line",
+            xref="x" + subplot_str,
+            yref="y" + subplot_str + " domain",
+            x0=xa,
+            y0=ya,
+            x1=xb,
+            y1=yb,
+            line=line,
+        )
+    return fig
 
 
 def add_p_value_annotation(
     fig,
-    array_columns,
+    results: pl.DataFrame,
     subplot=None,
     _format=dict(interline=0.07, text_height=1.07, color="black", width=2, size=8),
+    col="p_adjusted",
 ):
-    """Adds notations giving the p-value between two box plot data (t-test two-sided comparison)
+    """Adds notations giving the p-value of each comparison in a results table
 
-    From: https://stackoverflow.com/questions/67505252/plotly-box-p-value-significant-annotation
+    Bracket drawing from: https://stackoverflow.com/questions/67505252/plotly-box-p-value-significant-annotation
 
     Parameters:
     ----------
     fig: figure
         plotly boxplot figure
-    array_columns: np.array
-        array of which columns to compare
-        e.g.: [[0,1], [1,2]] compares column 0 with 1 and 1 with 2
+    results: pl.DataFrame
+        output of hypothesis.compare_groups, one row per comparison with the
+        box positions x0 and x1
     subplot: None or int
         specifies if the figures has subplots and what subplot to add the notation to
     _format: dict
         format characteristics for the lines
+    col: str
+        column of results holding the p-value to print
 
     Returns:
     -------
     fig: figure
         figure with the added notation
     """
-
-    line_width = _format["width"]
-
-    # Specify in what y_range to plot for each pair of columns
-    y_range = np.zeros([len(array_columns), 2])
-    for i in range(len(array_columns)):
-        # y_range[i] = [1.01 + i * _format["interline"], 1.02 + i * _format["interline"]]
-        y_range[i] = [
-            1.01,
-            1.02,
-        ]
-
-    # Get values from figure
-    fig_dict = fig.to_dict()
-
-    # Get indices if working with subplots
-    if subplot:
-        if subplot == 1:
-            subplot_str = ""
-        else:
-            subplot_str = str(subplot)
-        indices = []  # Change the box index to the indices of the data for that subplot
-        for index, data in enumerate(fig_dict["data"]):
-            # print(index, data['xaxis'], 'x' + subplot_str)
-            if data["xaxis"] == "x" + subplot_str:
-                indices = np.append(indices, index)
-        indices = [int(i) for i in indices]
-        print((indices))
-    else:
-        subplot_str = ""
-
-    # Print the p-values
-    for index, column_pair in enumerate(array_columns):
-        if subplot:
-            data_pair = [indices[column_pair[0]], indices[column_pair[1]]]
-        else:
-            data_pair = column_pair
-        # Mare sure it is selecting the data and subplot you want
-        print(
-            "0:",
-            fig_dict["data"][data_pair[0]]["name"],
-            fig_dict["data"][data_pair[0]]["y"],
-        )
-        print(
-            "1:",
-            fig_dict["data"][data_pair[1]]["name"],
-            fig_dict["data"][data_pair[1]]["y"],
-        )
-
-        filtered_data0 = [
-            i for i in fig_dict["data"][data_pair[0]]["y"] if i is not None
-        ]
-        filtered_data1 = [
-            i for i in fig_dict["data"][data_pair[1]]["y"] if i is not None
-        ]
-
-        # Get the p-value modified by n of comparisons
-        pvalue = stats.ttest_ind(filtered_data0, filtered_data1, equal_var=False)[1] * len(array_columns)
-        if pvalue > 1:
-            pvalue = 1
-        if pvalue >= 0.05:
-            symbol = "ns"
-        elif pvalue >= 0.01:
-            symbol = "*"
-        elif pvalue >= 0.001:
-            symbol = "**"
-        else:
-            symbol = "***"
-        symbol = pvalue
-        # Vertical line
-        fig.add_shape(
-            type="line",
-            xref="x" + subplot_str,
-            yref="y" + subplot_str + " domain",
-            x0=column_pair[0],
-            y0=y_range[index][0],
-            x1=column_pair[0],
-            y1=y_range[index][1],
-            line=dict(
-                color=_format["color"],
-                width=line_width,
-            ),
-        )
-        # Horizontal line
-        fig.add_shape(
-            type="line",
-            xref="x" + subplot_str,
-            yref="y" + subplot_str + " domain",
-            x0=column_pair[0],
-            y0=y_range[index][1],
-            x1=column_pair[1],
-            y1=y_range[index][1],
-            line=dict(
-                color=_format["color"],
-                width=line_width,
-            ),
-        )
-        # Vertical line
-        fig.add_shape(
-            type="line",
-            xref="x" + subplot_str,
-            yref="y" + subplot_str + " domain",
-            x0=column_pair[1],
-            y0=y_range[index][0],
-            x1=column_pair[1],
-            y1=y_range[index][1],
-            line=dict(
-                color=_format["color"],
-                width=line_width,
-            ),
-        )
-        ## add text at the correct x, y coordinates
-        ## for bars, there is a direct mapping from the bar number to 0, 1, 2...
+    subplot_str = "" if subplot in (None, 1) else str(subplot)
+    y_range = (1.01, 1.02)
+    for row in results.iter_rows(named=True):
+        add_bracket(fig, row["x0"], row["x1"], y_range, subplot_str, _format)
         fig.add_annotation(
             dict(
                 font=dict(color=_format["color"], size=_format["size"]),
-                x=(column_pair[0] + column_pair[1]) / 2,
-                y=y_range[index][1] + _format["text_height"],
+                x=(row["x0"] + row["x1"]) / 2,
+                y=y_range[1] + _format["text_height"],
                 showarrow=False,
-                text=f"<i>p</i>={symbol:0.2e}",
+                text=f"<i>p</i>={row[col]:0.2e}",
                 textangle=0,
                 xref="x" + subplot_str,
                 yref="y" + subplot_str + " domain",
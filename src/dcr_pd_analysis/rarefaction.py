@@ -0,0 +1,212 @@
+"""Rarefaction of repertoires to a common depth for depth-normalised comparisons"""
+
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+import scipy.sparse as sp
+
+from dcr_pd_analysis import diversity, stats
+
+
+def get_depth(reps: list[tuple[str, pl.DataFrame]], count_col="duplicate_count") -> int:
+    """
+    Smallest total count across the repertoires, the deepest common depth.
+    """
+    return min(int(df.get_column(count_col).sum()) for _, df in reps)
+
+
+def subsample(
+    counts: npt.NDArray[np.int64],
+    depth: int,
+    replicates: int,
+    rng: np.random.Generator,
+    max_bytes=1 << 26,
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """
+    Draw replicates subsamples of depth molecules without replacement, as many at
+    once as fit in max_bytes, keeping only the non-zero counts.
+
+    Returns the replicate, the index into counts and the subsampled count of every
+    non-zero entry.
+    """
+    step = max(1, max_bytes // (8 * len(counts)))
+    parts = []
+    for start in range(0, replicates, step):
+        size = min(step, replicates - start)
+        draws = rng.multivariate_hypergeometric(counts, depth, size=size)
+        replicate, index = np.nonzero(draws)
+        parts.append((replicate + start, index, draws[replicate, index]))
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def rarefy(
+    reps: list[tuple[str, pl.DataFrame]],
+    depth: int | None = None,
+    replicates=100,
+    col="clonotype",
+    count_col="duplicate_count",
+    seed=0,
+    max_workers=1,
+    max_bytes=1 << 26,
+) -> pl.DataFrame:
+    """
+    Function which rarefies every repertoire to a common depth, many times over.
+
+    Each repertoire gets its own child of SeedSequence(seed), so the draws do not
+    depend on max_workers or on the order the samples finish in. Repertoires with
+    fewer than depth molecules are left out with a warning.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires with one row per value of col
+        depth: Molecules drawn per replicate, defaults to get_depth(reps)
+        replicates: Number of independent subsamples of each repertoire
+        col: Column identifying a clonotype
+        count_col: Column holding the count of each clonotype
+        seed: Root seed of the draws
+        max_workers: Number of repertoires subsampled at once
+        max_bytes: Size of the dense draws each worker holds at once
+
+    Returns
+    -------
+        A long polars DataFrame of replicate, sample, col and count_col holding
+        the non-zero counts of every subsample
+    """
+    if depth is None:
+        depth = get_depth(reps, count_col)
+    shallow = [name for name, df in reps if df.get_column(count_col).sum() < depth]
+    if shallow:
+        warnings.warn(f"{len(shallow)} samples have fewer than {depth} molecules")
+    kept = [(name, df) for name, df in reps if name not in shallow]
+    names = pl.Enum([name for name, _ in kept])
+    seeds = np.random.SeedSequence(seed).spawn(len(kept))
+
+    def draw(rep: tuple[str, pl.DataFrame], seed: np.random.SeedSequence):
+        name, df = rep
+        df = df.filter(pl.col(count_col) > 0)
+        counts = df.get_column(count_col).to_numpy().astype(np.int64)
+        rng = np.random.default_rng(seed)
+        replicate, index, draws = subsample(counts, depth, replicates, rng, max_bytes)
+        return pl.DataFrame(
+            {
+                "replicate": pl.Series(replicate, dtype=pl.UInt32),
+                "sample": pl.Series([name] * len(index), dtype=names),
+                col: df.get_column(col).gather(index),
+                count_col: pl.Series(draws, dtype=pl.UInt32),
+            }
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(draw, kept, seeds))
+    return pl.concat(frames).sort("replicate", maintain_order=True)
+
+
+def get_rarefied_reps(
+    rarefied: pl.DataFrame,
+) -> dict[int, list[tuple[str, pl.DataFrame]]]:
+    """
+    Split rarefy output into the list-of-tuples layout of each replicate.
+    """
+    out = {}
+    for (replicate,), df in rarefied.partition_by(
+        "replicate", as_dict=True, maintain_order=True
+    ).items():
+        parts = df.partition_by("sample", as_dict=True, maintain_order=True)
+        out[replicate] = [
+            (str(name), part.drop("replicate", "sample"))
+            for (name,), part in parts.items()
+        ]
+    return out
+
+
+def get_overlap(
+    rarefied: pl.DataFrame,
+    col="clonotype",
+    count_col="duplicate_count",
+    max_workers=1,
+) -> dict[str, npt.NDArray[np.float64]]:
+    """
+    Function which computes the presence based overlap indices of every replicate.
+
+    Values of col are indexed once for all replicates into one stacked count
+    matrix with a row per replicate and sample. Each replicate is then a block of
+    rows whose indices come from stats.get_overlap_from_counts, and the blocks
+    are computed in parallel.
+
+    ...
+
+    Parameters
+    ----------
+        rarefied: Output of rarefy
+        col: Column identifying a clonotype
+        count_col: Column holding the subsampled counts
+        max_workers: Number of replicates computed at once
+
+    Returns
+    -------
+        Arrays of shape (replicates, samples, samples) keyed by the index names of
+        stats.get_overlap_matrices, samples in the order of the sample Enum
+    """
+    n = len(rarefied.schema["sample"].categories)
+    replicates = rarefied.get_column("replicate").n_unique()
+    # Clonotype IDs are column indices already, strings are indexed as categories
+    column = pl.col(col)
+    if not rarefied.schema[col].is_integer():
+        column = column.cast(pl.Categorical).to_physical()
+    long = rarefied.drop_nulls(col).select(
+        (
+            pl.col("replicate").rank("dense").cast(pl.Int64) * n
+            - n
+            + pl.col("sample").to_physical()
+        ).alias("row"),
+        column.cast(pl.Int64).alias("column"),
+        pl.col(count_col).cast(pl.Float64),
+    )
+    n_values = long["column"].max() + 1 if long.height else 0
+    counts = sp.csr_array(
+        (
+            long[count_col].to_numpy(),
+            (long["row"].to_numpy(), long["column"].to_numpy()),
+        ),
+        shape=(replicates * n, n_values),
+    )
+
+    def get_block(replicate: int) -> dict[str, npt.NDArray[np.float64]]:
+        block = counts[replicate * n : (replicate + 1) * n]
+        return stats.get_overlap_from_counts(block, expanded=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        blocks = list(executor.map(get_block, range(replicates)))
+    return {key: np.stack([block[key] for block in blocks]) for key in blocks[0]}
+
+
+def get_diversity(
+    rarefied: pl.DataFrame, count_col="duplicate_count", q: list[float] | None = None
+) -> pl.DataFrame:
+    """
+    diversity.get_diversity of every sample and replicate in one grouped pass.
+    """
+    return diversity.get_diversity(rarefied, ["replicate", "sample"], count_col, q)
+
+
+def summarise(df: pl.DataFrame, by: list[str], alpha=0.05) -> pl.DataFrame:
+    """
+    Mean, standard deviation and central 1 - alpha interval of every numeric column
+    over the replicates of each group.
+    """
+    cols = [
+        col
+        for col, dtype in df.schema.items()
+        if dtype.is_numeric() and col not in by + ["replicate"]
+    ]
+    return df.group_by(by, maintain_order=True).agg(
+        *(pl.col(col).mean().alias(f"{col}_mean") for col in cols),
+        *(pl.col(col).std().alias(f"{col}_std") for col in cols),
+        *(pl.col(col).quantile(alpha / 2).alias(f"{col}_lower") for col in cols),
+        *(pl.col(col).quantile(1 - alpha / 2).alias(f"{col}_upper") for col in cols),
+    )
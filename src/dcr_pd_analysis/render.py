@@ -0,0 +1,139 @@
+"""Batch figure rendering through a pool of persistent kaleido processes"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import pathlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.graph_objects as go
+import plotly.io as pio
+import polars as pl
+
+from dcr_pd_analysis import cache
+
+POOLS = {}
+POOL_LOCK = threading.Lock()
+
+
+def get_manifest_path() -> pathlib.Path:
+    return cache.get_cache_dir() / "renders.json"
+
+
+def get_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool kept for the life of the interpreter, so each worker starts
+    kaleido once and reuses it for every later figure. Workers are spawned
+    rather than forked, which is unsafe once polars has started its threads.
+    """
+    with POOL_LOCK:
+        if max_workers not in POOLS:
+            POOLS[max_workers] = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return POOLS[max_workers]
+
+
+def get_hash(spec: str, path: str, scale: float) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([pathlib.Path(path).suffix, scale]).encode())
+    digest.update(spec.encode())
+    return digest.hexdigest()
+
+
+def write(spec: str, path: str, scale: float) -> float:
+    """
+    Render one figure from its JSON and return the seconds it took.
+    """
+    start = time.perf_counter()
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    pio.write_image(json.loads(spec), path, scale=scale, validate=False)
+    return time.perf_counter() - start
+
+
+def read_manifest(path: pathlib.Path) -> dict[str, str]:
+    if not path.is_file():
+        return {}
+    return json.loads(path.read_text())
+
+
+def write_manifest(path: pathlib.Path, manifest: dict[str, str]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def render(
+    figures: dict[str, go.Figure],
+    scale=5,
+    max_workers=4,
+    manifest_path: str | pathlib.Path | None = None,
+    force=False,
+) -> pl.DataFrame:
+    """
+    Function which renders a batch of figures to image files in parallel.
+
+    Figures are serialised to JSON once and sent to a pool of worker processes
+    that stays alive between calls, so the kaleido start-up is paid once per
+    worker rather than once per image. A manifest records the hash of the JSON,
+    format and scale behind every file; figures whose file still exists and
+    whose hash is unchanged are skipped.
+
+    ...
+
+    Parameters
+    ----------
+        figures: Figures keyed by the path they are written to, the format
+            following its suffix as in fig.write_image
+        scale: Scale factor passed to kaleido
+        max_workers: Number of rendering processes, 1 renders in this process
+        manifest_path: Record of rendered hashes, defaults to get_manifest_path()
+        force: Render every figure even if unchanged
+
+    Returns
+    -------
+        One row per figure with its path, whether it was rendered or skipped,
+        and its render time in seconds
+    """
+    manifest_path = (
+        pathlib.Path(manifest_path) if manifest_path else get_manifest_path()
+    )
+    specs = {path: fig.to_json() for path, fig in figures.items()}
+    hashes = {path: get_hash(spec, path, scale) for path, spec in specs.items()}
+    # Relative paths are resolved so scripts run from any directory agree
+    entries = {path: str(pathlib.Path(path).resolve()) for path in specs}
+    manifest = read_manifest(manifest_path)
+    stale = [
+        path
+        for path in specs
+        if force
+        or manifest.get(entries[path]) != hashes[path]
+        or not pathlib.Path(path).is_file()
+    ]
+
+    if max_workers == 1 or len(stale) < 2:
+        seconds = {path: write(specs[path], path, scale) for path in stale}
+    else:
+        pool = get_pool(max_workers)
+        futures = {path: pool.submit(write, specs[path], path, scale) for path in stale}
+        seconds = {path: future.result() for path, future in futures.items()}
+
+    if stale:
+        # Re-read so concurrent batches writing the same manifest keep their entries
+        with POOL_LOCK:
+            manifest = read_manifest(manifest_path)
+            manifest |= {entries[path]: hashes[path] for path in stale}
+            write_manifest(manifest_path, manifest)
+    return pl.DataFrame(
+        {
+            "path": [str(path) for path in specs],
+            "status": ["rendered" if path in seconds else "skipped" for path in specs],
+            "seconds": [seconds.get(path, 0.0) for path in specs],
+        },
+        schema={"path": pl.String, "status": pl.String, "seconds": pl.Float64},
+    )
@@ -0,0 +1,298 @@
+"""MinHash and HyperLogLog sketches for approximate repertoire overlap"""
+
+import math
+import os
+import pathlib
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+from dcr_pd_analysis import dcr, stats
+
+EMPTY = np.iinfo(np.uint64).max
+MINHASH_SEED = 0
+HLL_SEED = 1
+# 2**-k for every possible register value k, ranks never exceed 61
+HLL_WEIGHTS = np.exp2(-np.arange(64, dtype=np.float64))
+
+
+def get_minhash_size(error: float) -> int:
+    """
+    Number of MinHash bins giving a Jaccard standard error of about error.
+    """
+    return math.ceil(1 / error**2)
+
+
+def get_hll_precision(error: float) -> int:
+    """
+    HyperLogLog precision p (2**p registers) giving a relative cardinality
+    standard error of about error.
+    """
+    return min(18, max(4, math.ceil(2 * math.log2(1.04 / error))))
+
+
+def hash_values(values: pl.Series, seed: int) -> npt.NDArray[np.uint64]:
+    # polars hashes are only stable within a polars version, see save/load
+    return values.drop_nulls().unique().hash(seed=seed).to_numpy()
+
+
+def get_minhash(hashes: npt.NDArray[np.uint64], size: int) -> npt.NDArray[np.uint64]:
+    """
+    One permutation MinHash: each hash falls in bin hash % size and the signature
+    keeps the smallest hash // size seen per bin, EMPTY where no value landed.
+    """
+    signature = np.full(size, EMPTY, np.uint64)
+    np.minimum.at(signature, hashes % np.uint64(size), hashes // np.uint64(size))
+    return signature
+
+
+def get_bit_length(values: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint8]:
+    smeared = values.copy()
+    for shift in (1, 2, 4, 8, 16, 32):
+        smeared |= smeared >> np.uint64(shift)
+    return np.bitwise_count(smeared)
+
+
+def get_hll(hashes: npt.NDArray[np.uint64], precision: int) -> npt.NDArray[np.uint8]:
+    registers = np.zeros(1 << precision, np.uint8)
+    index = hashes >> np.uint64(64 - precision)
+    # Guard bit bounds the rank when every remaining bit is zero
+    rest = (hashes << np.uint64(precision)) | np.uint64(1 << (precision - 1))
+    rank = (65 - get_bit_length(rest)).astype(np.uint8)
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def get_sketch(
+    values: pl.Series, error=0.01
+) -> dict[str, npt.NDArray[np.uint64] | npt.NDArray[np.uint8]]:
+    """
+    Function which sketches the distinct values of a column.
+
+    ...
+
+    Parameters
+    ----------
+        values: Column to sketch, nulls are ignored
+        error: Target standard error of the Jaccard and cardinality estimates
+
+    Returns
+    -------
+        A dict holding the "minhash" signature and the "hll" registers
+    """
+    return {
+        "minhash": get_minhash(
+            hash_values(values, MINHASH_SEED), get_minhash_size(error)
+        ),
+        "hll": get_hll(hash_values(values, HLL_SEED), get_hll_precision(error)),
+    }
+
+
+def sketch_reps(
+    reps: list[tuple[str, pl.DataFrame]], col="sequence", error=0.01
+) -> dict[str, dict[str, npt.NDArray]]:
+    return {name: get_sketch(df.get_column(col), error) for name, df in reps}
+
+
+def get_sketch_path(path: str, col: str, sketch_dir: str | None = None) -> pathlib.Path:
+    source = pathlib.Path(path)
+    root = pathlib.Path(sketch_dir) if sketch_dir else source.parent
+    return root / f"{source.name}.{col}.sketch.npz"
+
+
+def save(path: pathlib.Path, sketch: dict[str, npt.NDArray], source: str) -> None:
+    stat = os.stat(source)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp.npz")
+    np.savez(
+        tmp,
+        minhash=sketch["minhash"],
+        hll=sketch["hll"],
+        polars_version=pl.__version__,
+        source_size=stat.st_size,
+        source_mtime_ns=stat.st_mtime_ns,
+    )
+    os.replace(tmp, path)
+
+
+def load(
+    path: pathlib.Path, source: str, error: float
+) -> dict[str, npt.NDArray] | None:
+    """
+    Read a persisted sketch, or None if it is missing, stale, sized for another
+    error or was hashed by a different polars version.
+    """
+    if not path.is_file():
+        return None
+    stat = os.stat(source)
+    with np.load(path) as saved:
+        valid = (
+            str(saved["polars_version"]) == pl.__version__
+            and int(saved["source_size"]) == stat.st_size
+            and int(saved["source_mtime_ns"]) == stat.st_mtime_ns
+            and saved["minhash"].size == get_minhash_size(error)
+            and saved["hll"].size == 1 << get_hll_precision(error)
+        )
+        if not valid:
+            return None
+        return {"minhash": saved["minhash"], "hll": saved["hll"]}
+
+
+def load_sketches(
+    path: str,
+    glob: str,
+    expected: int,
+    col="sequence",
+    error=0.01,
+    sketch_dir: str | None = None,
+) -> dict[str, dict[str, npt.NDArray]]:
+    """
+    Function which sketches every repertoire matching glob, persisting each sketch
+    next to its source file (or in sketch_dir) so later runs skip the parse.
+
+    ...
+
+    Parameters
+    ----------
+        path: Directory holding the repertoires
+        glob: Pattern selecting the repertoires, as for dcr.load_reps
+        expected: Number of repertoires expected to match
+        col: Column to sketch
+        error: Target standard error of the estimates
+        sketch_dir: Directory for the sketches, defaults to alongside the data
+
+    Returns
+    -------
+        Sketches keyed by repertoire name in load_reps order
+    """
+    sketches = {}
+    for f in dcr.get_rep_files(path, glob, expected):
+        sketch_path = get_sketch_path(f, col, sketch_dir)
+        sketch = load(sketch_path, f, error)
+        if sketch is None:
+            sketch = get_sketch(dcr.read_rep(f, columns=[col]).get_column(col), error)
+            sketch_path.parent.mkdir(parents=True, exist_ok=True)
+            save(sketch_path, sketch, f)
+        sketches[dcr.get_rep_name(f)] = sketch
+    return sketches
+
+
+def get_estimate(
+    sums: npt.NDArray[np.float64], zeros: npt.NDArray[np.int64], m: int
+) -> npt.NDArray[np.float64]:
+    """
+    HyperLogLog estimate from the summed 2**-register and the number of zero
+    registers, with the linear counting small range correction.
+    """
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m**2 / sums
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def get_cardinality(registers: npt.NDArray[np.uint8]) -> npt.NDArray[np.float64]:
+    """
+    HyperLogLog estimate of a single register array or of stacked arrays along the
+    last axis.
+    """
+    sums = HLL_WEIGHTS[registers].sum(axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    return get_estimate(sums, zeros, registers.shape[-1])
+
+
+def get_jaccard_matrix(
+    sketches: dict[str, dict[str, npt.NDArray]],
+) -> npt.NDArray[np.float64]:
+    """
+    Approximate Jaccard index for all pairs: the fraction of bins, among those
+    filled in either sample, where both signatures hold the same minimum.
+
+    Bins empty in both samples are counted for all pairs at once as a product of
+    the empty masks. Equal minima are counted one row at a time over the upper
+    triangle, so no pairs x bins array is built.
+    """
+    signatures = np.stack([s["minhash"] for s in sketches.values()])
+    n, size = signatures.shape
+    empty = (signatures == EMPTY).astype(np.float32)
+    both_empty = empty @ empty.T
+    same = np.zeros((n, n), np.float64)
+    for i in range(n):
+        same[i, i:] = np.count_nonzero(signatures[i:] == signatures[i], axis=-1)
+    same = np.triu(same) + np.triu(same, 1).T - both_empty
+    return stats.safe_divide(same, size - both_empty)
+
+
+def get_union_matrix(
+    sketches: dict[str, dict[str, npt.NDArray]], max_bytes=1 << 26
+) -> npt.NDArray[np.float64]:
+    """
+    Function which estimates the union size of all pairs from their merged
+    (elementwise max) registers, without building the merged registers.
+
+    The sum of 2**-max(a, b) over registers telescopes into one term per register
+    value v weighted by the number of registers where both a <= v and b <= v,
+    which for every pair at once is the product of the n x m indicator matrix
+    with its transpose. Registers only span a few dozen values, so this is a
+    handful of matrix products rather than n**2 / 2 passes over the registers.
+
+    ...
+
+    Parameters
+    ----------
+        sketches: Sketches keyed by sample name, as from load_sketches
+        max_bytes: Size of the indicator matrix of one chunk of registers
+
+    Returns
+    -------
+        The n x n matrix of estimated union sizes
+    """
+    registers = np.stack([s["hll"] for s in sketches.values()])
+    n, m = registers.shape
+    top = int(registers.max())
+    sums = np.full((n, n), m * HLL_WEIGHTS[top])
+    zeros = np.zeros((n, n), np.int64)
+    step = max(1, max_bytes // (4 * n))
+    for start in range(0, m, step):
+        chunk = registers[:, start : start + step]
+        for value in range(int(chunk.min()), top):
+            below = (chunk <= value).astype(np.float32)
+            both = below @ below.T
+            if value == 0:
+                zeros += both.astype(np.int64)
+            sums += (HLL_WEIGHTS[value] - HLL_WEIGHTS[value + 1]) * both
+    return get_estimate(sums, zeros, m)
+
+
+def get_overlap_matrices(
+    sketches: dict[str, dict[str, npt.NDArray]],
+) -> dict[str, npt.NDArray[np.float64]]:
+    """
+    Function which estimates the main overlap quantities for all sample pairs from
+    sketches alone.
+
+    ...
+
+    Parameters
+    ----------
+        sketches: Sketches keyed by sample name, as from load_sketches
+
+    Returns
+    -------
+        Full square matrices keyed by name: jaccard, union, intersection and
+        containment, where containment[i, j] estimates the fraction of sample i
+        found in sample j (the direction of stats.get_expanded_index), plus the
+        estimated distinct count of each sample under "cardinality"
+    """
+    jaccard = get_jaccard_matrix(sketches)
+    union = get_union_matrix(sketches)
+    cardinality = get_cardinality(np.stack([s["hll"] for s in sketches.values()]))
+    intersection = jaccard * union
+    return {
+        "jaccard": jaccard,
+        "union": union,
+        "intersection": intersection,
+        "containment": np.minimum(
+            stats.safe_divide(intersection, cardinality[:, None]), 1.0
+        ),
+        "cardinality": cardinality,
+    }
@@ -3,6 +3,9 @@ from collections.abc import Callable
 import numpy as np
 import numpy.typing as npt
 import polars as pl
+import scipy.sparse as sp
+
+from dcr_pd_analysis import neighbours
 
 
 def get_jaccard_index(
@@ -176,44 +179,309 @@ def cosine_similarity(
 
 
 
+def get_fuzzy_overlap_matrices(
+    reps: list[tuple[str, pl.DataFrame]],
+    col="junction_aa",
+    by: list[str] | None = None,
+    distance=1,
+    metric="levenshtein",
+) -> dict[str, npt.NDArray[np.float64]]:
+    """
+    Function which computes overlap indices for all sample pairs where values within
+    distance of each other count as shared.
+
+    Values are the distinct (by, col) combinations of each sample. matched[i, j] is
+    the number of values of sample i with a neighbour in sample j; the fuzzy
+    intersection averages both directions, so with distance 0 every index equals
+    its exact counterpart.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires to compare
+        col: String column to compare, see neighbours.get_pairs
+        by: Columns both values of a pair must share, defaults to v_call
+        distance: Maximum distance between neighbouring values
+        metric: Either "levenshtein" or "hamming"
+
+    Returns
+    -------
+        Full square matrices keyed by name: matched, intersection, jaccard and
+        containment (matched over the row sample size, the direction of
+        get_expanded_index)
+    """
+    if by is None:
+        by = ["v_call"]
+    named = [(str(index), df) for index, (_, df) in enumerate(reps)]
+    sizes = np.array(
+        [df.select(*by, col).drop_nulls().unique().height for _, df in named],
+        np.float64,
+    )
+    found = neighbours.get_neighbours(named, col, by, distance, metric)
+    found = found.group_by("sample", "sample_right").agg(
+        pl.struct(*by, col).n_unique().alias("matched")
+    )
+    matched = np.zeros((len(reps), len(reps)), np.float64)
+    matched[
+        found["sample"].cast(pl.Int64).to_numpy(),
+        found["sample_right"].cast(pl.Int64).to_numpy(),
+    ] = found["matched"].to_numpy()
+    np.fill_diagonal(matched, sizes)
+    intersection = (matched + matched.T) / 2
+    union = sizes[:, None] + sizes[None, :] - intersection
+    return {
+        "matched": matched,
+        "intersection": intersection,
+        "jaccard": safe_divide(intersection, union),
+        "containment": safe_divide(matched, sizes[:, None]),
+    }
+
+
+def get_fuzzy_jaccard_index(
+    sample1: pl.DataFrame,
+    sample2: pl.DataFrame,
+    col="junction_aa",
+    by: list[str] | None = None,
+    distance=1,
+    metric="levenshtein",
+) -> float:
+    """
+    Jaccard index counting values within distance as shared, see
+    get_fuzzy_overlap_matrices.
+    """
+    overlap = get_fuzzy_overlap_matrices(
+        [("sample1", sample1), ("sample2", sample2)], col, by, distance, metric
+    )
+    return float(overlap["jaccard"][0, 1])
+
+
+def get_fuzzy_expanded_index(
+    expanded: pl.DataFrame,
+    target: pl.DataFrame,
+    col="junction_aa",
+    by: list[str] | None = None,
+    distance=1,
+    metric="levenshtein",
+) -> float:
+    """
+    Fraction of expanded values with a value within distance in target, see
+    get_fuzzy_overlap_matrices.
+    """
+    overlap = get_fuzzy_overlap_matrices(
+        [("expanded", expanded), ("target", target)], col, by, distance, metric
+    )
+    return float(overlap["containment"][0, 1])
+
+
+def get_count_matrix(
+    reps: list[tuple[str, pl.DataFrame]], col="sequence", count_col: str | None = None
+) -> sp.csr_array:
+    """
+    Function which builds a sparse sample by value count matrix for a cohort.
+
+    Values of col are given dense column indices once for the whole cohort, so
+    every pairwise comparison afterwards is integer arithmetic on the matrix.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires, one matrix row per repertoire in order
+        col: Column whose distinct values become the matrix columns
+        count_col: Column summed into each cell, or None to count rows
+
+    Returns
+    -------
+        A scipy CSR array of shape (len(reps), number of distinct values)
+    """
+    count = pl.col(count_col) if count_col else pl.lit(1)
+    long = pl.concat(
+        [
+            df.select(
+                pl.lit(index, pl.UInt32).alias("row"),
+                pl.col(col).alias("value"),
+                count.cast(pl.Float64).alias("count"),
+            )
+            for index, (_, df) in enumerate(reps)
+        ]
+    )
+    long = long.drop_nulls("value")
+    long = long.group_by("row", "value").agg(pl.col("count").sum())
+    long = long.with_columns(
+        (pl.col("value").rank("dense") - 1).cast(pl.UInt32).alias("column")
+    )
+    n_values = long["column"].max() + 1 if long.height else 0
+    return sp.csr_array(
+        (long["count"].to_numpy(), (long["row"].to_numpy(), long["column"].to_numpy())),
+        shape=(len(reps), n_values),
+    )
+
+
+def safe_divide(
+    numerator: npt.NDArray[np.float64], denominator: npt.NDArray[np.float64]
+) -> npt.NDArray[np.float64]:
+    """
+    Elementwise division which gives 0 wherever the denominator is 0, matching the
+    empty union convention of the pairwise index functions.
+    """
+    numerator, denominator = np.broadcast_arrays(numerator, denominator)
+    out = np.zeros(numerator.shape, np.float64)
+    return np.divide(numerator, denominator, out=out, where=denominator > 0)
+
+
+def get_overlap_matrices(
+    reps: list[tuple[str, pl.DataFrame]],
+    col="sequence",
+    count_col: str | None = None,
+) -> dict[str, npt.NDArray[np.float64]]:
+    """
+    Function which computes every presence based overlap index for all sample pairs
+    from a single sparse matrix product.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires to compare
+        col: Column to compute the indices upon
+        count_col: Count column; when given, "expanded" is also returned using
+            values with a count above 1 as the expanded set of each row sample
+
+    Returns
+    -------
+        Full square matrices keyed by index name: jaccard, jaccard_product,
+        dice_sorensen, cosine and intersection, plus expanded if count_col is set
+    """
+    counts = get_count_matrix(reps, col=col, count_col=count_col)
+    return get_overlap_from_counts(counts, expanded=bool(count_col))
+
+
+def get_overlap_from_counts(
+    counts: sp.csr_array, expanded=False
+) -> dict[str, npt.NDArray[np.float64]]:
+    """
+    The indices of get_overlap_matrices from a sample by value count matrix, such
+    as one replicate block of a stacked matrix.
+    """
+    presence = (counts > 0).astype(np.float64)
+    intersection = (presence @ presence.T).toarray()
+    sizes = np.diag(intersection)
+    union = sizes[:, None] + sizes[None, :] - intersection
+    out = {
+        "intersection": intersection,
+        "jaccard": safe_divide(intersection, union),
+        "jaccard_product": safe_divide(intersection, np.outer(sizes, sizes)),
+        "dice_sorensen": safe_divide(2 * intersection, sizes[:, None] + sizes[None, :]),
+        "cosine": safe_divide(intersection, np.sqrt(np.outer(sizes, sizes))),
+    }
+    if expanded:
+        above = (counts > 1).astype(np.float64)
+        expanded_intersection = (above @ presence.T).toarray()
+        out["expanded"] = safe_divide(expanded_intersection, above.sum(axis=1)[:, None])
+    return out
+
+
+def get_weighted_overlap_matrices(
+    reps: list[tuple[str, pl.DataFrame]],
+    col="clonotype",
+    count_col="duplicate_count",
+    block_size=2**20,
+) -> dict[str, npt.NDArray[np.float64]]:
+    """
+    Function which computes abundance weighted overlap indices for all sample pairs
+    from the count matrix used by get_overlap_matrices.
+
+    Morisita-Horn and cosine come from sparse matrix products. The sum of pairwise
+    minimum frequencies, which Bray-Curtis and the weighted Jaccard are built on, is
+    only non-zero on values present in at least two samples, so it is accumulated
+    over those columns in dense blocks of at most block_size elements.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Named repertoires to compare
+        col: Column to compute the indices upon
+        count_col: Column holding the abundance of each value
+        block_size: Upper bound on the elements held in memory per block
+
+    Returns
+    -------
+        Full square matrices keyed by index name: morisita_horn, cosine,
+        bray_curtis (as a similarity, 1 - dissimilarity, on relative
+        frequencies) and weighted_jaccard (Ruzicka, on relative frequencies)
+    """
+    counts = get_count_matrix(reps, col=col, count_col=count_col)
+    totals = counts.sum(axis=1)
+    freqs = sp.diags_array(safe_divide(np.ones_like(totals), totals)) @ counts
+    freqs = sp.csr_array(freqs)
+
+    coincidence = (freqs @ freqs.T).toarray()
+    simpson = np.diag(coincidence)
+    morisita_horn = safe_divide(2 * coincidence, simpson[:, None] + simpson[None, :])
+
+    products = (counts @ counts.T).toarray()
+    norms = np.sqrt(np.diag(products))
+    cosine = safe_divide(products, np.outer(norms, norms))
+
+    n = counts.shape[0]
+    shared = np.flatnonzero((counts > 0).sum(axis=0) >= 2)
+    shared_freqs = sp.csc_array(freqs[:, shared])
+    minimum = np.zeros((n, n), np.float64)
+    step = max(1, block_size // max(1, n * n))
+    for start in range(0, len(shared), step):
+        block = shared_freqs[:, start : start + step].toarray()
+        minimum += np.minimum(block[:, None, :], block[None, :, :]).sum(axis=-1)
+    np.fill_diagonal(minimum, (totals > 0).astype(np.float64))
+
+    return {
+        "morisita_horn": morisita_horn,
+        "cosine": cosine,
+        "bray_curtis": minimum,
+        "weighted_jaccard": safe_divide(minimum, 2 - minimum),
+    }
+
+
+def to_upper_triangle(mat: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    Lay a full matrix out like the pairwise loops did: values above the diagonal,
+    NaN on it and zeros below.
+    """
+    out = np.triu(mat, k=1)
+    np.fill_diagonal(out, np.nan)
+    return out
+
+
 def get_jaccard_matrix(reps: list[tuple[str, pl.DataFrame]]) -> npt.NDArray[np.float64]:
-    jac_index = np.zeros((len(reps), len(reps)), np.float64)
-    for i, rep1 in enumerate(reps):
-        jac_index[i, i] = np.nan
-        for j, rep2 in enumerate(reps[i + 1 :]):
-            print(f"Comparing {i}:{rep1[0]} and {i + j + 1}:{rep2[0]}")
-            jac_index[i, i + j + 1] = get_jaccard_index(rep1[1], rep2[1])
-    return jac_index
+    return to_upper_triangle(get_overlap_matrices(reps)["jaccard"])
 
 
 def get_jaccard_product_matrix(
     reps: list[tuple[str, pl.DataFrame]]
 ) -> npt.NDArray[np.float64]:
-    jac_index = np.zeros((len(reps), len(reps)), np.float64)
-    for i, rep1 in enumerate(reps):
-        jac_index[i, i] = np.nan
-        for j, rep2 in enumerate(reps[i + 1 :]):
-            print(f"Comparing {i}:{rep1[0]} and {i + j + 1}:{rep2[0]}")
-            jac_index[i, i + j + 1] = get_jaccard_product_index(rep1[1], rep2[1])
-    return jac_index
+    return to_upper_triangle(get_overlap_matrices(reps)["jaccard_product"])
 
 
 def get_dice_sorensen_matrix(
     reps: list[tuple[str, pl.DataFrame]]
 ) -> npt.NDArray[np.float64]:
-    jac_index = np.zeros((len(reps), len(reps)), np.float64)
-    for i, rep1 in enumerate(reps):
-        jac_index[i, i] = np.nan
-        for j, rep2 in enumerate(reps[i + 1 :]):
-            print(f"Comparing {i}:{rep1[0]} and {i + j + 1}:{rep2[0]}")
-            jac_index[i, i + j + 1] = get_dice_sorensen_index(rep1[1], rep2[1])
-    return jac_index
+    return to_upper_triangle(get_overlap_matrices(reps)["dice_sorensen"])
 
 
 def get_similarity_matrix(
     reps: list[tuple[str, pl.DataFrame]],
     func: Callable[[pl.DataFrame, pl.DataFrame], float],
 ) -> npt.NDArray[np.float64]:
+    # Presence based indices are computed in one pass on the default column
+    vectorised = {
+        get_jaccard_index: "jaccard",
+        get_jaccard_product_index: "jaccard_product",
+        get_dice_sorensen_index: "dice_sorensen",
+        cosine_similarity: "cosine",
+    }
+    if func in vectorised:
+        return to_upper_triangle(get_overlap_matrices(reps)[vectorised[func]])
     jac_index = np.zeros((len(reps), len(reps)), np.float64)
     for i, rep1 in enumerate(reps):
         jac_index[i, i] = np.nan
@@ -223,9 +491,75 @@ def get_similarity_matrix(
     return jac_index
 
 
+def get_membership(reps: dict[str, list[str]]) -> pl.DataFrame:
+    """
+    Function which assigns every distinct value a bitmask of the samples it occurs
+    in, bit i standing for the i-th key of reps.
+
+    ...
+
+    Parameters
+    ----------
+        reps: Values of each sample keyed by sample name, at most 64 samples
+
+    Returns
+    -------
+        A polars DataFrame with one row per distinct value and a UInt64 mask column
+    """
+    if len(reps) > 64:
+        raise ValueError(f"At most 64 samples are supported, not {len(reps)}.")
+    long = pl.concat(
+        [
+            pl.DataFrame({"value": pl.Series(values)}).with_columns(
+                pl.lit(1 << index, pl.UInt64).alias("bit")
+            )
+            for index, values in enumerate(reps.values())
+        ],
+        how="vertical_relaxed",
+    )
+    long = long.drop_nulls("value").unique()
+    return long.group_by("value").agg(pl.col("bit").sum().alias("mask"))
+
+
+def get_region_name(mask: int, names: list[str]) -> str:
+    return "_&_".join(name for index, name in enumerate(names) if mask >> index & 1)
+
+
+def get_region_counts(reps: dict[str, list[str]]) -> dict[str, int]:
+    """
+    Exact size of every non-empty exclusive region of a k-way Venn/UpSet diagram,
+    keyed by the member sample names joined with "_&_". Only the regions that
+    occur are reported, so the cost does not grow with the 2^k - 1 possible ones.
+    """
+    names = list(reps.keys())
+    counts = get_membership(reps).group_by("mask").len().sort("mask")
+    return {get_region_name(mask, names): n for mask, n in counts.iter_rows()}
+
+
+def get_region_members(reps: dict[str, list[str]]) -> dict[str, set[str]]:
+    """
+    Members of every non-empty exclusive region, keyed as in get_region_counts.
+    """
+    names = list(reps.keys())
+    regions = get_membership(reps).group_by("mask").agg(pl.col("value"))
+    return {
+        get_region_name(mask, names): set(values)
+        for mask, values in regions.iter_rows()
+    }
+
+
+def get_shared(membership: pl.DataFrame, indices: list[int]) -> set[str]:
+    """
+    Values present in every sample in indices, whatever else they occur in.
+    """
+    mask = sum(1 << index for index in indices)
+    shared = membership.filter((pl.col("mask") & pl.lit(mask, pl.UInt64)) == mask)
+    return set(shared["value"].to_list())
+
+
 def get_venn_counts(reps: dict[str, list[str]]) -> dict[str, int]:
     """
-    Gets counts of each region of a venn3 diagram.
+    Gets counts of each region of a venn diagram.
 
     Subtracts higher order overlaps from lower order overlaps.
 
@@ -241,75 +575,41 @@ def get_venn_counts(reps: dict[str, list[str]]) -> dict[str, int]:
     venn(region2) = 8
     venn(region1_&_region2) = 2
     """
-    list_reps = [(name, strings) for name, strings in reps.items()]
-    venn = {}
-    two_region_names = []
-    for index1, (rep1_name, rep1_strings) in enumerate(list_reps):
-        set1 = set(rep1_strings)
-        assert (
-            rep1_strings.sort() == list(set1).sort()
-        )  # Double check that the lists really are sets
-        venn[rep1_name] = len(set1)
-        for rep2_name, rep2_strings in list_reps[index1 + 1 :]:
-            set2 = set(rep2_strings)
-            overlap = len(set1 & set2)
-            venn[rep1_name] -= overlap
-            overlap_name = f"{rep1_name}_&_{rep2_name}"
-            two_region_names.append(overlap_name)
-            venn[overlap_name] = overlap
-
-    # All reps intersect in different loop for readability
-    all_intersect_name = "_&_".join([name for name, _ in list_reps])
-    base_set = set(list_reps[0][1])
-    for rep in list_reps[1:]:
-        base_set = base_set & set(rep[1])
-    all_overlap = len(base_set)
-    for name, _ in list_reps:
-        venn[name] += all_overlap  # Corrects double subtraction
-    for name in two_region_names:
-        venn[name] -= all_overlap
-    venn[all_intersect_name] = len(base_set)
-
-    return venn
+    # Venn diagrams label every region, including the empty ones
+    names = list(reps.keys())
+    counts = get_region_counts(reps)
+    return {
+        name: counts.get(name, 0)
+        for name in (get_region_name(m, names) for m in range(1, 1 << len(names)))
+    }
 
 
 def get_venn_seqs(reps: dict[str, list[str]]) -> dict[str, set[str]]:
-    list_reps = [(name, seqs) for name, seqs in reps.items()]
+    names = list(reps.keys())
+    membership = get_membership(reps)
     venn = {}
-    for index1, (rep1_name, rep1_seq) in enumerate(list_reps):
-        set1 = set(rep1_seq)
-        assert (
-            rep1_seq.sort() == list(set1).sort()
-        )  # Double check that the lists really are sets
-        venn[rep1_name] = set1
-        for rep2_name, rep2_seq in list_reps[index1 + 1 :]:
-            set2 = set(rep2_seq)
-            venn[f"{rep1_name}_&_{rep2_name}"] = set1 & set2
-
-    # All reps intersect in different loop for readability
-    all_intersect_name = "_&_".join([name for name, _ in list_reps])
-    base_set = set(list_reps[0][1])
-    for rep in list_reps[1:]:
-        base_set = base_set & set(rep[1])
-    venn[all_intersect_name] = base_set
-
+    for index1, rep1_name in enumerate(names):
+        venn[rep1_name] = get_shared(membership, [index1])
+        for index2, rep2_name in enumerate(names[index1 + 1 :], start=index1 + 1):
+            venn[f"{rep1_name}_&_{rep2_name}"] = get_shared(
+                membership, [index1, index2]
+            )
+    venn["_&_".join(names)] = get_shared(membership, list(range(len(names))))
     return venn
 
 
 def get_venn2_clones(reps: dict[str, list[str]]) -> dict[str, set[str]]:
-    list_reps = [(name, clones) for name, clones in reps.items()]
+    names = list(reps.keys())
+    membership = get_membership(reps)
     venn = {}
-    for index1, (rep1_name, rep1_clones) in enumerate(list_reps):
-        set1 = set(rep1_clones)
-        assert (
-            rep1_clones.sort() == list(set1).sort()
-        )  # Double check that the lists really are sets
-        for rep2_name, rep2_clones in list_reps[index1 + 1 :]:
-            set2 = set(rep2_clones)
-            venn[f"{rep1_name}_&_{rep2_name}"] = set1 & set2
-
+    for index1, rep1_name in enumerate(names):
+        for index2, rep2_name in enumerate(names[index1 + 1 :], start=index1 + 1):
+            venn[f"{rep1_name}_&_{rep2_name}"] = get_shared(
+                membership, [index1, index2]
+            )
     return venn
 
+
 def get_boxplot_stats(values: list[float]) -> dict:
     """
     Calculate boxplot statistics for a list of values.
@@ -0,0 +1,378 @@
+"""Synthetic repertoires in the Decombinator and MiXCR layouts for scale testing"""
+
+import pathlib
+
+import numpy as np
+import polars as pl
+
+from dcr_pd_analysis import cohort, dcr
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+NUCLEOTIDES = "ACGT"
+TISSUES = ["D", "ME", "HB", "ST"]
+
+
+def get_genes(chain: str) -> tuple[list[str], list[str]]:
+    """
+    Mouse-like V and J gene names of the alpha or beta chain.
+    """
+    if chain == "alpha":
+        return [f"TRAV{i}" for i in range(1, 41)], [f"TRAJ{i}" for i in range(1, 51)]
+    return [f"TRBV{i}" for i in range(1, 31)], [f"TRBJ{i}" for i in range(1, 15)]
+
+
+def get_random_strings(
+    lengths: np.ndarray, alphabet: str, rng: np.random.Generator
+) -> pl.Series:
+    """
+    Uniform random strings over alphabet of the given lengths, built one length
+    at a time from byte arrays rather than one string at a time.
+    """
+    lookup = np.frombuffer(alphabet.encode(), dtype=np.uint8)
+    parts, index = [], []
+    for length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == length)
+        chars = lookup[rng.integers(0, len(alphabet), (len(rows), length))]
+        parts.append(pl.Series(chars.view(f"S{length}").ravel()).cast(pl.String))
+        index.append(rows)
+    if not parts:
+        return pl.Series([], dtype=pl.String)
+    order = np.argsort(np.concatenate(index), kind="stable")
+    return pl.concat(parts).gather(order)
+
+
+def get_counts(n: int, alpha: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Power-law molecule counts of at least one, P(count > x) ~ x^-alpha as seen
+    for T cell clone sizes.
+    """
+    return np.floor(rng.pareto(alpha, n) + 1).astype(np.int64)
+
+
+def make_clonotypes(n: int, chain="beta", seed=0) -> pl.DataFrame:
+    """
+    Function which draws n random clonotypes of one chain.
+
+    ...
+
+    Parameters
+    ----------
+        n: Number of clonotypes
+        chain: alpha or beta, setting the V and J gene names
+        seed: Seed of the draws
+
+    Returns
+    -------
+        A polars DataFrame of v_call, j_call, junction_aa and a nucleotide
+        junction of matching length, CDR3s being C, 8 to 16 residues and F
+    """
+    rng = np.random.default_rng(seed)
+    v_genes, j_genes = get_genes(chain)
+    lengths = rng.integers(10, 19, n)
+    middle = get_random_strings(lengths - 2, AMINO_ACIDS, rng)
+    return pl.DataFrame(
+        {
+            "v_call": pl.Series(v_genes).gather(rng.integers(0, len(v_genes), n)),
+            "j_call": pl.Series(j_genes).gather(rng.integers(0, len(j_genes), n)),
+            "junction": get_random_strings(3 * lengths, NUCLEOTIDES, rng),
+            "junction_aa": "C" + middle + "F",
+        }
+    )
+
+
+def make_dcr_rep(clonotypes: pl.DataFrame, alpha=1.5, seed=0) -> pl.DataFrame:
+    """
+    Function which lays clonotypes out as a translated Decombinator repertoire.
+
+    ...
+
+    Parameters
+    ----------
+        clonotypes: Output of make_clonotypes, one row per sequence
+        alpha: Power-law exponent of the duplicate counts
+        seed: Seed of the counts
+
+    Returns
+    -------
+        A polars DataFrame with the columns of dcr.get_airr_schema
+    """
+    rng = np.random.default_rng(seed)
+    n = clonotypes.height
+    return clonotypes.select(
+        pl.format("seq{}", pl.int_range(n)).alias("sequence_id"),
+        "v_call",
+        pl.lit(None, pl.String).alias("d_call"),
+        "j_call",
+        "junction",
+        "junction_aa",
+        pl.col("junction").alias("sequence"),
+        pl.col("junction_aa").alias("sequence_aa"),
+        pl.Series("duplicate_count", get_counts(n, alpha, rng)),
+    )
+
+
+def make_tag_counts(
+    molecules: np.ndarray, rng: np.random.Generator, umi_length=8
+) -> pl.Series:
+    """
+    MiXCR tagCounts strings such as {ACGTACGT=3,...} holding molecules[i] UMIs
+    for clone i, built with one grouped string join.
+    """
+    clone = np.repeat(np.arange(len(molecules)), molecules)
+    reads = rng.integers(1, 20, len(clone))
+    umis = get_random_strings(np.full(len(clone), umi_length), NUCLEOTIDES, rng)
+    entries = pl.DataFrame({"clone": clone, "entry": umis + "=" + reads.astype(str)})
+    joined = entries.group_by("clone", maintain_order=True).agg(
+        pl.col("entry").str.join(",")
+    )
+    return ("{" + joined.get_column("entry") + "}").alias("tagCounts")
+
+
+def make_mixcr_rep(
+    clonotypes: pl.DataFrame,
+    alpha=1.5,
+    seed=0,
+    molecules: np.ndarray | None = None,
+) -> pl.DataFrame:
+    """
+    Function which lays clonotypes out as a MiXCR clns export.
+
+    ...
+
+    Parameters
+    ----------
+        clonotypes: Output of make_clonotypes, one row per clone
+        alpha: Power-law exponent of the unique molecule counts
+        seed: Seed of the counts and UMIs
+        molecules: Unique molecule count of each clone instead of drawn ones
+
+    Returns
+    -------
+        A polars DataFrame with the columns of mixcr.get_columns, readCount
+        summing the reads of each clone's UMIs
+    """
+    rng = np.random.default_rng(seed)
+    if molecules is None:
+        molecules = get_counts(clonotypes.height, alpha, rng)
+    tag_counts = make_tag_counts(molecules, rng)
+    reads = (
+        tag_counts.str.extract_all(r"=(\d+)")
+        .list.eval(pl.element().str.slice(1).cast(pl.Int64))
+        .list.sum()
+    )
+    return clonotypes.select(
+        pl.int_range(pl.len()).alias("cloneId"),
+        reads.alias("readCount"),
+        pl.Series("uniqueMoleculeCount", molecules),
+        pl.col("junction").alias("targetSequences"),
+        pl.col("junction_aa").alias("aaSeqCDR3"),
+        pl.col("junction").alias("nSeqImputedVDJRegion"),
+        (pl.col("v_call") + "*00(100)").alias("bestVHit"),
+        (pl.col("j_call") + "*00(50)").alias("bestJHit"),
+        tag_counts,
+    )
+
+
+def make_reps(
+    names: list[str], n: int, chain="beta", shared=0.1, alpha=1.5, seed=0
+) -> list[tuple[str, pl.DataFrame]]:
+    """
+    Function which draws Decombinator repertoires overlapping through a common pool.
+
+    ...
+
+    Parameters
+    ----------
+        names: Sample names, such as dcr_PKD_D1_1_beta
+        n: Number of sequences of each repertoire
+        chain: alpha or beta
+        shared: Fraction of each repertoire drawn from a pool common to all, the
+            rest being private
+        alpha: Power-law exponent of the duplicate counts
+        seed: Seed of the pool and of every repertoire
+
+    Returns
+    -------
+        Named repertoires in the list-of-tuples layout of dcr.load_reps
+    """
+    pool_seed, *rep_seeds = np.random.SeedSequence(seed).spawn(len(names) + 1)
+    pool = make_clonotypes(n, chain, pool_seed)
+    n_shared = int(round(shared * n))
+    reps = []
+    for name, rep_seed in zip(names, rep_seeds):
+        choice_seed, private_seed, count_seed = rep_seed.spawn(3)
+        rng = np.random.default_rng(choice_seed)
+        common = pool[rng.choice(n, n_shared, replace=False)]
+        private = make_clonotypes(n - n_shared, chain, private_seed)
+        clonotypes = pl.concat([common, private])
+        reps.append((name, make_dcr_rep(clonotypes, alpha, count_seed)))
+    return reps
+
+
+def get_conditions(individuals=8) -> dict[int, str]:
+    """
+    Conditions of a synthetic cohort, the first half of the individuals PD and the
+    rest HC like the real one.
+    """
+    return {
+        i: "PD" if i <= individuals // 2 else "HC" for i in range(1, individuals + 1)
+    }
+
+
+def make_cohort(
+    individuals=8,
+    depth=10_000,
+    tissues: list[str] | None = None,
+    chains: list[str] | None = None,
+    sharing: float | dict[str, float] = 0.2,
+    public=0.01,
+    alpha=1.5,
+    seed=0,
+) -> list[tuple[str, pl.DataFrame]]:
+    """
+    Function which draws a cohort of Decombinator repertoires named like the real
+    ones, dcr_PKD_<TISSUE><ID>_1_<chain>.
+
+    Each repertoire mixes three kinds of clonotypes: public ones from a pool
+    common to every individual, ones from a pool common to the tissues of its
+    individual, and private ones. Raising sharing for two tissues raises their
+    overlap within each individual.
+
+    ...
+
+    Parameters
+    ----------
+        individuals: Number of individuals, see get_conditions for their
+            conditions
+        depth: Number of sequences of each repertoire
+        tissues: Tissue codes, defaults to TISSUES
+        chains: Chains, defaults to alpha and beta
+        sharing: Fraction of each repertoire drawn from its individual's pool,
+            one for all tissues or one per tissue code
+        public: Fraction of each repertoire drawn from the public pool
+        alpha: Power-law exponent of the duplicate counts
+        seed: Seed of every draw
+
+    Returns
+    -------
+        Named repertoires in the list-of-tuples layout of dcr.load_reps, by
+        chain, individual and tissue
+    """
+    if tissues is None:
+        tissues = TISSUES
+    if chains is None:
+        chains = ["alpha", "beta"]
+    if not isinstance(sharing, dict):
+        sharing = dict.fromkeys(tissues, sharing)
+    if any(public + sharing[tissue] > 1 for tissue in tissues):
+        raise ValueError("public and sharing fractions add up to more than 1")
+    reps = []
+    for chain, chain_seed in zip(
+        chains, np.random.SeedSequence(seed).spawn(len(chains))
+    ):
+        public_seed, *individual_seeds = chain_seed.spawn(individuals + 1)
+        public_pool = make_clonotypes(depth, chain, public_seed)
+        for i, individual_seed in enumerate(individual_seeds, start=1):
+            pool_seed, *tissue_seeds = individual_seed.spawn(len(tissues) + 1)
+            pool = make_clonotypes(depth, chain, pool_seed)
+            for tissue, tissue_seed in zip(tissues, tissue_seeds):
+                choice_seed, private_seed, count_seed = tissue_seed.spawn(3)
+                rng = np.random.default_rng(choice_seed)
+                n_public = int(round(public * depth))
+                n_shared = int(round(sharing[tissue] * depth))
+                clonotypes = pl.concat(
+                    [
+                        public_pool[rng.choice(depth, n_public, replace=False)],
+                        pool[rng.choice(depth, n_shared, replace=False)],
+                        make_clonotypes(
+                            depth - n_public - n_shared, chain, private_seed
+                        ),
+                    ]
+                )
+                rep = make_dcr_rep(clonotypes, alpha, count_seed)
+                reps.append((f"dcr_PKD_{tissue}{i}_1_{chain}", rep))
+    return reps
+
+
+def get_summary(reps: list[tuple[str, pl.DataFrame]]) -> pl.DataFrame:
+    """
+    Decombinator collapsing summary of reps in the layout dcr.load_summary reads,
+    one sample such as PKD_D1_alpha per repertoire.
+    """
+    rows = []
+    for name, df in reps:
+        _, study, code, _, chain = name.split("_")
+        total = int(df.get_column("duplicate_count").sum())
+        rows.append(
+            {
+                "sample": f"{study}_{code}_{chain}",
+                "TotalDCRsPostCollapsing": total,
+                "UniqueDCRsPostCollapsing": df.height,
+            }
+        )
+    return pl.DataFrame(rows)
+
+
+def write_cohort(
+    path: str | pathlib.Path,
+    reps: list[tuple[str, pl.DataFrame]],
+    conditions: dict[int, str] | None = None,
+    mixcr=True,
+    seed=0,
+) -> list[pathlib.Path]:
+    """
+    Function which writes a synthetic cohort in the on-disk layout the scripts read.
+
+    Decombinator TSVs go to path/tcrseqgroup/translated along with the condition
+    of every individual in cohort.CONDITIONS_FILE, the collapsing summary
+    to path/tcrseqgroup/Summary_NS148.csv and the MiXCR exports, with the same
+    clones and molecule counts, to path/results/run1. With path set to
+    ../data from the repository root, the scripts find everything where the
+    real data would be: mixcr.get_results reads the parent of path.
+
+    ...
+
+    Parameters
+    ----------
+        path: Data directory to write into
+        reps: Output of make_cohort
+        conditions: Condition of every individual, defaults to get_conditions of
+            the number of individuals in reps
+        mixcr: Whether to also write the MiXCR exports
+        seed: Seed of the MiXCR UMIs and read counts
+
+    Returns
+    -------
+        The paths of every file written
+    """
+    path = pathlib.Path(path)
+    translated = path / "tcrseqgroup" / "translated"
+    translated.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name, df in reps:
+        written.append(translated / f"{name}.tsv")
+        df.write_csv(written[-1], separator="\t")
+    if conditions is None:
+        individuals = {dcr.split_sample_code(name)[1] for name, _ in reps}
+        conditions = get_conditions(len(individuals))
+    written.append(translated / cohort.CONDITIONS_FILE)
+    cohort.write_condition_map(written[-1], conditions)
+    written.append(path / "tcrseqgroup" / "Summary_NS148.csv")
+    get_summary(reps).write_csv(written[-1])
+    if not mixcr:
+        return written
+
+    run = path / "results" / "run1"
+    run.mkdir(parents=True, exist_ok=True)
+    tissue_map = dcr.get_tissue_map()
+    seeds = np.random.SeedSequence(seed).spawn(len(reps))
+    for (name, df), rep_seed in zip(reps, seeds):
+        tissue_code, individual = dcr.split_sample_code(name)
+        tissue = tissue_map[tissue_code.lower()]
+        chain = name.split("_")[-1]
+        suffix = "TRA" if chain == "alpha" else "TRB"
+        molecules = df.get_column("duplicate_count").to_numpy()
+        export = make_mixcr_rep(df, seed=rep_seed, molecules=molecules)
+        written.append(run / f"{tissue}_{individual}.clns_{suffix}.tsv")
+        export.write_csv(written[-1], separator="\t")
+    return written
@@ -5,13 +5,30 @@ def split_clonotype(index: int, alias: str) -> pl.Expr:
     return pl.col("clonotype").str.split(" ").list[index].alias(alias)
 
 
-def make_csv(queries: dict[str, pl.Series], chain: str) -> None:
+def make_csv(
+    queries: dict[str, pl.Series],
+    chain: str,
+    dictionary: pl.DataFrame | None = None,
+    out_dir="../out/query",
+) -> list[str]:
+    paths = []
     for overlap, clones in queries.items():
         clones = clones.to_frame()
-        clones = clones.with_columns(
-            split_clonotype(0, f"Cdr3{chain.capitalize()}.id"),
-            split_clonotype(1, f"V{chain.capitalize()}.gene"),
-            split_clonotype(2, f"J{chain.capitalize()}.gene"),
-        )
-        clones = clones.drop("clonotype")
-        clones.write_csv(f"../out/query/{overlap}.csv")
+        if dictionary is None:
+            clones = clones.with_columns(
+                split_clonotype(0, f"Cdr3{chain.capitalize()}.id"),
+                split_clonotype(1, f"V{chain.capitalize()}.gene"),
+                split_clonotype(2, f"J{chain.capitalize()}.gene"),
+            )
+            clones = clones.drop("clonotype")
+        else:
+            clones = clones.join(dictionary, on="clonotype_id", how="left")
+            clones = clones.select(
+                pl.col("junction_aa").alias(f"Cdr3{chain.capitalize()}.id"),
+                pl.col("v_call").alias(f"V{chain.capitalize()}.gene"),
+                pl.col("j_call").alias(f"J{chain.capitalize()}.gene"),
+            )
+        path = f"{out_dir}/{overlap}.csv"
+        clones.write_csv(path)
+        paths.append(path)
+    return paths
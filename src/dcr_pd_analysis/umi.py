@@ -0,0 +1,146 @@
+"""UMI error correction and molecule counting for MiXCR runs"""
+
+from collections import deque
+
+import numpy as np
+import polars as pl
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from dcr_pd_analysis import mixcr, neighbours
+
+KEY_COLUMNS = ["tissue", "chain", "tissue_id", "CDR3"]
+
+
+def get_umi_counts(df: pl.DataFrame, by: list[str] | None = None) -> pl.DataFrame:
+    """
+    Reads per distinct UMI within each group, from get_results or get_umi_table
+    output. Rows get a node index matching neighbours.get_pairs.
+    """
+    if by is None:
+        by = KEY_COLUMNS
+    if "umis" in df.columns:
+        df = mixcr.get_umi_table(df)
+    df = df.group_by(by + ["umi"]).agg(pl.col("count").sum())
+    return df.sort(by + ["umi"]).with_row_index("node")
+
+
+def get_directional_labels(graph: sp.csr_array, counts: np.ndarray) -> np.ndarray:
+    """
+    Molecule of every UMI, grown by breadth-first search along the directed edges
+    from each unassigned UMI in descending count order, as in UMI-tools. A UMI
+    reached from two abundant ones joins the first, so they stay apart.
+    """
+    labels = np.full(len(counts), -1, np.int64)
+    indptr, indices = graph.indptr.tolist(), graph.indices.tolist()
+    # An edge only points to a smaller (or, at one read each, equal) count, so a
+    # UMI without outgoing edges is either reached earlier or a molecule of its own
+    roots = np.flatnonzero(np.diff(graph.indptr) > 0)
+    roots = roots[np.argsort(-counts[roots], kind="stable")]
+    label = 0
+    for root in roots.tolist():
+        if labels[root] >= 0:
+            continue
+        labels[root] = label
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for neighbour in indices[indptr[node] : indptr[node + 1]]:
+                if labels[neighbour] < 0:
+                    labels[neighbour] = label
+                    queue.append(neighbour)
+        label += 1
+    alone = labels < 0
+    labels[alone] = np.arange(label, label + alone.sum())
+    return labels
+
+
+def get_components(
+    umis: pl.DataFrame,
+    by: list[str] | None = None,
+    distance=1,
+    method="directional",
+) -> pl.DataFrame:
+    """
+    Function which clusters the UMIs of each group into molecules.
+
+    "cluster" joins every pair within distance. "directional" follows UMI-tools:
+    an edge points from a UMI to a neighbour whose count is at most half of its
+    own plus one, and molecules grow along those edges from the most abundant
+    UMI, so two abundant UMIs one error apart stay separate molecules even when
+    linked through a rare one.
+
+    ...
+
+    Parameters
+    ----------
+        umis: Output of get_umi_counts
+        by: Columns defining a group, defaults to KEY_COLUMNS
+        distance: Maximum Hamming distance between UMIs of one molecule
+        method: Either "cluster" or "directional"
+
+    Returns
+    -------
+        The umis table with a molecule column labelling each UMI's cluster
+    """
+    if by is None:
+        by = KEY_COLUMNS
+    if method not in ("cluster", "directional"):
+        raise ValueError(f"Unknown method {method}, use cluster or directional")
+    n = umis.height
+    pairs = neighbours.get_pairs(umis, "umi", by, distance, metric="hamming")
+    left = pairs["node"].to_numpy()
+    right = pairs["node_right"].to_numpy()
+    if method == "cluster":
+        graph = sp.coo_array(
+            (np.ones(len(left), np.int8), (left, right)), shape=(n, n)
+        ).tocsr()
+        _, labels = csgraph.connected_components(graph, directed=False)
+    else:
+        counts = umis["count"].to_numpy().astype(np.int64)
+        # Both directions are tested, equal counts of one read link both ways
+        forward = counts[left] >= 2 * counts[right] - 1
+        backward = counts[right] >= 2 * counts[left] - 1
+        source = np.concatenate([left[forward], right[backward]])
+        target = np.concatenate([right[forward], left[backward]])
+        graph = sp.coo_array(
+            (np.ones(len(source), np.int8), (source, target)), shape=(n, n)
+        ).tocsr()
+        labels = get_directional_labels(graph, counts)
+    return umis.with_columns(pl.Series("molecule", labels, pl.UInt32))
+
+
+def collapse(
+    df: pl.DataFrame,
+    by: list[str] | None = None,
+    distance=1,
+    method="directional",
+) -> pl.DataFrame:
+    """
+    Function which error-corrects UMIs and counts molecules per clonotype.
+
+    UMIs are first pooled over every clone sharing a key, then clustered with
+    get_components so sequencing errors in the UMI do not inflate the count.
+
+    ...
+
+    Parameters
+    ----------
+        df: MiXCR results from mixcr.get_results, or its get_umi_table
+        by: Columns identifying a clonotype, defaults to KEY_COLUMNS
+        distance: Maximum Hamming distance between UMIs of one molecule
+        method: Either "cluster" or "directional", see get_components
+
+    Returns
+    -------
+        One row per clonotype with the raw distinct UMI count, the corrected
+        unique_molecule_count and the read_count summed over the tags
+    """
+    if by is None:
+        by = KEY_COLUMNS
+    umis = get_components(get_umi_counts(df, by), by, distance, method)
+    return umis.group_by(by, maintain_order=True).agg(
+        pl.len().alias("raw_umi_count"),
+        pl.col("molecule").n_unique().alias("unique_molecule_count"),
+        pl.col("count").sum().alias("read_count"),
+    )
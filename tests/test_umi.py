@@ -0,0 +1,41 @@
+import polars as pl
+
+from dcr_pd_analysis import umi
+
+
+def get_umis(counts: dict[str, int]) -> pl.DataFrame:
+    df = pl.DataFrame(
+        {
+            "tissue": "dura",
+            "chain": "TRB",
+            "tissue_id": "1",
+            "CDR3": "CASSF",
+            "umi": list(counts),
+            "count": list(counts.values()),
+        }
+    )
+    return umi.get_umi_counts(df)
+
+
+def get_molecules(umis: pl.DataFrame) -> dict[str, int]:
+    return dict(zip(umis["umi"], umis["molecule"]))
+
+
+def test_directional_keeps_abundant_umis_apart_through_a_rare_one():
+    umis = get_umis({"AAAA": 100, "AACA": 1, "AACC": 100})
+    molecules = get_molecules(umi.get_components(umis))
+    assert molecules["AAAA"] == molecules["AACA"]
+    assert molecules["AACC"] != molecules["AAAA"]
+    assert len(set(molecules.values())) == 2
+
+
+def test_cluster_joins_every_pair_within_distance():
+    umis = get_umis({"AAAA": 100, "AACA": 1, "AACC": 100})
+    molecules = get_molecules(umi.get_components(umis, method="cluster"))
+    assert len(set(molecules.values())) == 1
+
+
+def test_directional_does_not_join_similar_counts():
+    umis = get_umis({"AAAA": 10, "AAAC": 8, "GGGG": 1})
+    molecules = get_molecules(umi.get_components(umis))
+    assert len(set(molecules.values())) == 3